@@ -0,0 +1,263 @@
+"""Run level comparison of the pulse rates before and after the treatment, per condition.
+
+every file gives a mean pulse rate per tentacle in its control part (the
+first minutes, see H5Processor.max_ctrl_frame) and after it. the effect of
+the treatment is estimated on the paired differences, treated minus control
+rate of the same tentacle, per condition (substance, concentration):
+
+- the model (effect_hz, its se, p value and ci) is a mixed model of the
+  mean difference with a random intercept per well, i.e. a random treatment
+  slope per well, so the wells and not the tentacles are the replicates.
+- the bootstrap (boot_effect_hz and its ci) is the pooled mean of the
+  differences of all the condition's tentacles, resampling whole wells.
+"""
+
+import os
+import warnings
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from logger import getLogger, get_log_queue, init_worker_logging
+from xenio import atomic_output
+from .ragged import Ragged
+
+LOGGER = getLogger(__name__)
+
+
+CONDITIONS_NAME = "conditions.csv"
+PEAKS_ARRAYS_SUFFIX = ".peaks.npz"  # ExportPeaksArrays
+META_PREFIX = "meta"
+DIFF = "diff"  # treated minus control rate of a tentacle
+EFFECT_PARAM = "Intercept"  # of the differences model
+
+
+class ConditionKeys:
+    FILE = "file"
+    WELL = "well"
+    SUBSTANCE = "substance"
+    CONCENTRATION = "concentration"
+    UNIT = "concentration_unit"
+    TENTACLE = "tentacle"
+    TREATED = "treated"  # 0 control part, 1 after it
+    RATE = "rate"
+    PEAKS = "peaks"
+
+    CONDITION = [SUBSTANCE, CONCENTRATION, UNIT]
+
+
+class ResultKeys:
+    FILES = "files"
+    WELLS = "wells"
+    PAIRS = "tentacle_pairs"
+    CONTROL_RATE = "control_rate_hz"
+    TREATED_RATE = "treated_rate_hz"
+    MODEL = "model"
+    CONVERGED = "converged"
+    EFFECT = "effect_hz"
+    EFFECT_SE = "effect_se"
+    P_VALUE = "p_value"
+    CI_LOW = "ci_low"
+    CI_HIGH = "ci_high"
+    BOOT_EFFECT = "boot_effect_hz"
+    BOOT_CI_LOW = "boot_ci_low"
+    BOOT_CI_HIGH = "boot_ci_high"
+    BOOTSTRAPS = "bootstraps"
+
+    ALL = [
+        FILES, WELLS, PAIRS, CONTROL_RATE, TREATED_RATE, MODEL, CONVERGED, EFFECT,
+        EFFECT_SE, P_VALUE, CI_LOW, CI_HIGH, BOOT_EFFECT, BOOT_CI_LOW, BOOT_CI_HIGH, BOOTSTRAPS,
+    ]
+
+
+class Models:
+    MIXED = "mixedlm"
+    OLS = "ols"  # a single well (nothing to pool over) or the mixed model failed
+    NONE = "none"  # no tentacle has rates on both sides
+
+
+def phase_rates(peaks: Ragged, rates: Ragged, ctrl_secs: float):
+    """Mean pulse rate of every row before `ctrl_secs` and from it on.
+
+    all the rows at once, a bincount over (row, phase) bins. returns two
+    (row, phase) arrays, the means (NaN if no rate) and the number of rates.
+    """
+    n_rows = len(peaks)
+    values = rates.flat()
+    bins = peaks.row_ids() * 2 + (peaks.flat() >= ctrl_secs)
+    finite = np.isfinite(values)
+    counts = np.bincount(bins[finite], minlength=2 * n_rows).reshape(n_rows, 2)
+    sums = np.bincount(bins[finite], weights=values[finite], minlength=2 * n_rows).reshape(n_rows, 2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = np.where(counts > 0, sums / counts, np.nan)
+    return means, counts
+
+
+def well_of(shortname: str):
+    # {exp_num}_{exp_well}_... (H5Processor._get_shortname), the whole name if it didn't parse.
+    # the well alone, the recordings (exp_num) of the same well are one replicate
+    parts = shortname.split("_")
+    return parts[1] if len(parts) > 2 else shortname
+
+
+def file_observations(shortname: str, arrays, ctrl_secs: float = None):
+    """The (tentacle, phase) mean rates of one file's peaks arrays (np.load of its .peaks.npz)."""
+    peaks = Ragged.from_arrays(arrays, "peaks")
+    rates = Ragged.from_arrays(arrays, "rhythms")
+    meta = {key.removeprefix(f"{META_PREFIX}."): arrays[key].item() for key in arrays if key.startswith(f"{META_PREFIX}.")}
+    means, counts = phase_rates(peaks, rates, meta["ctrl_secs"] if ctrl_secs is None else ctrl_secs)
+    n_rows = len(peaks)
+    return pd.DataFrame({
+        ConditionKeys.FILE: shortname,
+        ConditionKeys.WELL: well_of(shortname),
+        ConditionKeys.SUBSTANCE: meta["substance"],
+        ConditionKeys.CONCENTRATION: meta["concentration"],
+        ConditionKeys.UNIT: meta["concentration_unit"],
+        ConditionKeys.TENTACLE: np.repeat(peaks.labels, 2),
+        ConditionKeys.TREATED: np.tile([0, 1], n_rows),
+        ConditionKeys.RATE: means.ravel(),
+        ConditionKeys.PEAKS: counts.ravel(),
+    }).dropna(subset=[ConditionKeys.RATE])
+
+
+def load_observations(output_dir: Path):
+    """The observations of every file exported to the output dir."""
+    frames = []
+    for path in sorted(Path(output_dir).glob(f"*{PEAKS_ARRAYS_SUFFIX}")):
+        if path.name.startswith("."):
+            continue
+        with np.load(path) as arrays:
+            if f"{META_PREFIX}.ctrl_secs" not in arrays:
+                LOGGER.warning(f"{path.name} has no conditions metadata (exported by an older version), skipping it")
+                continue
+            frames.append(file_observations(path.name.removesuffix(PEAKS_ARRAYS_SUFFIX), arrays))
+    return pd.concat(frames, ignore_index=True) if frames else None
+
+
+def paired_differences(obs: pd.DataFrame):
+    """Treated minus control rate of every (file, tentacle) with rates on both sides."""
+    keys = [ConditionKeys.FILE, ConditionKeys.WELL, ConditionKeys.TENTACLE]
+    rates = obs.pivot_table(index=keys, columns=ConditionKeys.TREATED, values=ConditionKeys.RATE)
+    if not {0, 1} <= set(rates.columns):
+        return pd.DataFrame(columns=[*keys, DIFF])
+    return (rates[1] - rates[0]).dropna().rename(DIFF).reset_index()
+
+
+def bootstrap_effect(wells: np.ndarray, diffs: np.ndarray, n_boot: int, rng, ci: float = 0.95):
+    """Cluster bootstrap of the mean paired difference, resampling whole wells.
+
+    the resamples are one (n_boot, n_wells) index array, the sums of the
+    picked wells are gathered at once. returns the effect and the percentile
+    interval, NaNs if there's nothing to resample.
+    """
+    codes, uniques = pd.factorize(wells)
+    n_wells = len(uniques)
+    if n_boot <= 0 or n_wells == 0:
+        return np.nan, np.nan, np.nan
+    sums = np.bincount(codes, weights=diffs, minlength=n_wells)
+    counts = np.bincount(codes, minlength=n_wells)
+    effect = sums.sum() / counts.sum()
+
+    picks = rng.integers(0, n_wells, size=(n_boot, n_wells))
+    effects = sums[picks].sum(axis=1) / counts[picks].sum(axis=1)  # every well has a difference
+    alpha = (1 - ci) / 2
+    low, high = np.quantile(effects, [alpha, 1 - alpha])
+    return effect, low, high
+
+
+def fit_effect(diffs: pd.DataFrame):
+    """The mean paired difference of a condition, a mixed model with a random intercept per well.
+
+    the intercept of the differences is the treatment slope, so the well
+    intercept is a random treatment slope per well.
+    """
+    import statsmodels.formula.api as smf
+
+    formula = f"{DIFF} ~ 1"
+    if diffs[ConditionKeys.WELL].nunique() > 1:
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")  # convergence warnings, reported in the table instead
+                result = smf.mixedlm(formula, diffs, groups=diffs[ConditionKeys.WELL]).fit(reml=True)
+            if np.isfinite(result.bse[EFFECT_PARAM]):
+                return Models.MIXED, bool(result.converged), result
+        except (ValueError, np.linalg.LinAlgError) as e:
+            LOGGER.warning(f"mixed model failed ({e}), falling back to ols")
+    return Models.OLS, True, smf.ols(formula, diffs).fit()
+
+
+def compare_condition(condition: tuple, obs: pd.DataFrame, n_boot: int, seed, ci: float = 0.95):
+    """The results row of one condition."""
+    treated = obs[ConditionKeys.TREATED].to_numpy()
+    rates = obs[ConditionKeys.RATE].to_numpy()
+    diffs = paired_differences(obs)
+    row = dict(zip(ConditionKeys.CONDITION, condition))
+    row.update({
+        ResultKeys.FILES: obs[ConditionKeys.FILE].nunique(),
+        ResultKeys.WELLS: obs[ConditionKeys.WELL].nunique(),
+        ResultKeys.PAIRS: len(diffs),
+        ResultKeys.CONTROL_RATE: rates[treated == 0].mean() if (treated == 0).any() else np.nan,
+        ResultKeys.TREATED_RATE: rates[treated == 1].mean() if (treated == 1).any() else np.nan,
+        ResultKeys.MODEL: Models.NONE,
+        ResultKeys.CONVERGED: False,
+    })
+    if len(diffs) > 1:
+        model, converged, result = fit_effect(diffs)
+        low, high = result.conf_int(alpha=1 - ci).loc[EFFECT_PARAM]
+        row.update({
+            ResultKeys.MODEL: model,
+            ResultKeys.CONVERGED: converged,
+            ResultKeys.EFFECT: result.params[EFFECT_PARAM],
+            ResultKeys.EFFECT_SE: result.bse[EFFECT_PARAM],
+            ResultKeys.P_VALUE: result.pvalues[EFFECT_PARAM],
+            ResultKeys.CI_LOW: low,
+            ResultKeys.CI_HIGH: high,
+        })
+
+    boot_effect, boot_low, boot_high = bootstrap_effect(
+        diffs[ConditionKeys.WELL].to_numpy(), diffs[DIFF].to_numpy(dtype=float), n_boot,
+        np.random.default_rng(seed), ci=ci,
+    )
+    row.update({
+        ResultKeys.BOOT_EFFECT: boot_effect,
+        ResultKeys.BOOT_CI_LOW: boot_low,
+        ResultKeys.BOOT_CI_HIGH: boot_high,
+        ResultKeys.BOOTSTRAPS: n_boot,
+    })
+    return row
+
+
+def compare_conditions(obs: pd.DataFrame, n_boot: int = 2000, ci: float = 0.95, seed: int = 0, workers: int = None):
+    """The results table, a row per condition, the conditions fitted in parallel.
+
+    every condition gets its own seed (in the sorted conditions order), so the
+    intervals don't depend on the number of workers.
+    """
+    groups = list(obs.groupby(ConditionKeys.CONDITION, sort=True))
+    seeds = np.random.SeedSequence(seed).spawn(len(groups))
+    workers = min(len(groups), workers or os.cpu_count())
+    if workers <= 1:
+        rows = [compare_condition(c, g, n_boot, s, ci) for (c, g), s in zip(groups, seeds)]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=init_worker_logging, initargs=(get_log_queue(),)
+        ) as pool:
+            futures = [pool.submit(compare_condition, c, g, n_boot, s, ci) for (c, g), s in zip(groups, seeds)]
+            rows = [future.result() for future in futures]
+    return pd.DataFrame(rows, columns=[*ConditionKeys.CONDITION, *ResultKeys.ALL])
+
+
+def compare_output_dir(output_dir: Path, n_boot: int = 2000, ci: float = 0.95, seed: int = 0, workers: int = None):
+    """Writes the conditions table of the files exported to the output dir, returns its path (None if no files)."""
+    obs = load_observations(output_dir)
+    if obs is None or obs.empty:
+        LOGGER.info("no pulse rates to compare the conditions of")
+        return None
+    table = compare_conditions(obs, n_boot=n_boot, ci=ci, seed=seed, workers=workers)
+    output_path = Path(output_dir, CONDITIONS_NAME)
+    with atomic_output(output_path) as tmp_path:
+        table.to_csv(tmp_path, index=False)
+    LOGGER.info(f"compared {len(table)} conditions of {obs[ConditionKeys.FILE].nunique()} files")
+    return output_path
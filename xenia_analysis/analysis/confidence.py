@@ -0,0 +1,39 @@
+"""Masking of the low confidence points of the tracks, by the SLEAP point / instance scores."""
+
+import numpy as np
+
+
+def low_confidence(
+    point_scores: np.ndarray,
+    instance_scores: np.ndarray = None,
+    min_point_score: float = None,
+    min_instance_score: float = None,
+):
+    """Boolean (node, frame) mask of the points scored under the thresholds.
+
+    a frame whose instance score is under `min_instance_score` has all its
+    points masked. NaN scores (missing points) are never under a threshold.
+    """
+    low = np.zeros(point_scores.shape, dtype=bool)
+    with np.errstate(invalid="ignore"):
+        if min_point_score is not None:
+            low |= point_scores < min_point_score
+        if min_instance_score is not None and instance_scores is not None:
+            low |= (instance_scores < min_instance_score)[np.newaxis, :]
+    return low
+
+
+def mask_points(coords: np.ndarray, low: np.ndarray):
+    """NaN the `low` points of the (x/y, node, frame) coords, into a new array.
+
+    returns the masked coords, the percent of frames of each node that got
+    masked (points that were already missing don't count) and the share of
+    all the points that are left usable.
+    """
+    present = ~np.isnan(coords).any(axis=0)
+    masked = low & present
+    n_frames = coords.shape[-1]
+    masked_percent = np.count_nonzero(masked, axis=-1) * 100 / n_frames if n_frames else np.zeros(len(masked))
+    usable = present & ~masked
+    usable_share = np.count_nonzero(usable) / usable.size if usable.size else 0.0
+    return np.where(masked, np.nan, coords), masked_percent, usable_share
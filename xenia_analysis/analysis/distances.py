@@ -0,0 +1,66 @@
+"""Euclidean node distances computed straight on the (2, node, frame) tracks block."""
+
+import numpy as np
+
+
+PAIRS_BLOCK_SIZE = 64
+
+
+def _norm(dx: np.ndarray, dy: np.ndarray):
+    # √(dx²+dy²) in place into dx, in the order of the pandas version so the distances
+    # match it bit for bit (np.hypot differs in the last bits)
+    np.multiply(dx, dx, out=dx)
+    np.multiply(dy, dy, out=dy)
+    dx += dy
+    return np.sqrt(dx, out=dx)
+
+
+def reference_distances(coords: np.ndarray, ref: int = 0):
+    """Distance of every node from the `ref` node, shape (node - 1, frame), ref row skipped."""
+    _, n_nodes, n_frames = coords.shape
+    if not -n_nodes <= ref < n_nodes:
+        raise IndexError(f"{ref=} out of range for {n_nodes} nodes")
+    ref = ref % n_nodes
+
+    dx = np.empty((n_nodes - 1, n_frames), dtype=float)
+    dy = np.empty_like(dx)
+    # nodes before and after the ref node are contiguous slices, no fancy-index copies
+    for dst, src in [(slice(0, ref), slice(0, ref)), (slice(ref, None), slice(ref + 1, None))]:
+        np.subtract(coords[0, src], coords[0, ref], out=dx[dst])
+        np.subtract(coords[1, src], coords[1, ref], out=dy[dst])
+    return _norm(dx, dy)
+
+
+def all_node_pairs(n_nodes: int, skip: tuple = ()):
+    """Every unordered pair of nodes (i < j), shape (pairs, 2), optionally skipping some nodes."""
+    i, j = np.triu_indices(n_nodes, k=1)
+    keep = ~(np.isin(i, skip) | np.isin(j, skip))
+    return np.stack([i[keep], j[keep]], axis=1)
+
+
+def pair_distances(coords: np.ndarray, pairs: np.ndarray, block_size: int = PAIRS_BLOCK_SIZE):
+    """Distance between the nodes of each (i, j) pair, shape (pairs, frame).
+
+    pairs are gathered in blocks so the only scratch memory is two
+    (block_size, frame) buffers regardless of how many pairs are asked for.
+    """
+    pairs = np.asarray(pairs, dtype=int).reshape(-1, 2)
+    n_frames = coords.shape[-1]
+    out = np.empty((len(pairs), n_frames), dtype=float)
+    block_size = max(1, min(block_size, len(pairs)))
+    scratch_a = np.empty((block_size, n_frames), dtype=float)
+    scratch_b = np.empty_like(scratch_a)
+
+    for start in range(0, len(pairs), block_size):
+        i, j = pairs[start : start + block_size].T
+        dx = out[start : start + block_size]
+        dy, tmp = scratch_a[: len(i)], scratch_b[: len(i)]
+
+        np.take(coords[0], i, axis=0, out=dx)
+        np.take(coords[0], j, axis=0, out=tmp)
+        dx -= tmp
+        np.take(coords[1], i, axis=0, out=dy)
+        np.take(coords[1], j, axis=0, out=tmp)
+        dy -= tmp
+        _norm(dx, dy)
+    return out
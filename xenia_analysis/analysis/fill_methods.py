@@ -0,0 +1,9 @@
+"""Gap filling method names, apart from gapfill so the cli can offer them without importing numpy."""
+
+
+class FillMethod:
+    FFILL = "ffill"
+    LINEAR = "linear"
+    CUBIC = "cubic"
+
+    ALL = [FFILL, LINEAR, CUBIC]
@@ -0,0 +1,91 @@
+"""Array native gap filling of tracks, all coordinates and nodes in one pass."""
+
+import numpy as np
+
+from .fill_methods import FillMethod
+
+
+def _neighbours(valid: np.ndarray):
+    # index of the last valid value at or before each frame (-1 if none), and of
+    # the next valid value at or after it (n if none), along the last axis
+    n = valid.shape[-1]
+    frames = np.arange(n)
+    prev_idx = np.maximum.accumulate(np.where(valid, frames, -1), axis=-1)
+    next_idx = np.minimum.accumulate(np.where(valid, frames, n)[..., ::-1], axis=-1)[..., ::-1]
+    return frames, prev_idx, next_idx
+
+
+def _take(a: np.ndarray, idx: np.ndarray):
+    return np.take_along_axis(a, np.clip(idx, 0, a.shape[-1] - 1), axis=-1)
+
+
+def _cubic(a, frames, prev_idx, next_idx, linear):
+    # 4 point (lagrange) cubic through the two valid values on each side of the
+    # gap, gaps at the edges of the data fall back to linear
+    n = a.shape[-1]
+    prev2_idx = _take(prev_idx, prev_idx - 1)
+    prev2_idx = np.where(prev_idx > 0, prev2_idx, -1)
+    next2_idx = _take(next_idx, next_idx + 1)
+    next2_idx = np.where(next_idx < n - 1, next2_idx, n)
+    has_support = (prev2_idx >= 0) & (next2_idx < n)
+
+    xs = [prev2_idx, prev_idx, next_idx, next2_idx]
+    ys = [_take(a, x) for x in xs]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cubic = np.zeros(a.shape, dtype=float)
+        for i, (xi, yi) in enumerate(zip(xs, ys)):
+            basis = np.ones(a.shape, dtype=float)
+            for j, xj in enumerate(xs):
+                if i != j:
+                    basis *= (frames - xj) / (xi - xj)
+            cubic += yi * basis
+    return np.where(has_support, cubic, linear)
+
+
+def fill_gaps(
+    a: np.ndarray,
+    method: str = FillMethod.FFILL,
+    limit: int = 2,
+    max_gap: int = None,
+):
+    """Fill NaN gaps along the last (frames) axis of `a`, e.g. a (2, node, frame) block.
+
+    Only gaps surrounded by valid values are filled, and of each gap only the
+    first `limit` values (like pandas' `limit`, `limit_area="inside"`). gaps
+    longer than `max_gap` are left untouched. the defaults match
+    `df.ffill(axis=1, limit=2, limit_area="inside")`.
+
+    returns the filled array and the nan scores (percent of missing frames,
+    shape `a.shape[:-1] + (2,)`, before and after filling).
+    """
+    if method not in FillMethod.ALL:
+        raise ValueError(f"unknown {method=}, expected one of {FillMethod.ALL}")
+
+    a = np.asarray(a, dtype=float)
+    n = a.shape[-1]
+    valid = ~np.isnan(a)
+    frames, prev_idx, next_idx = _neighbours(valid)
+
+    fill_mask = ~valid & (prev_idx >= 0) & (next_idx < n)
+    if limit is not None:
+        fill_mask &= (frames - prev_idx) <= limit
+    if max_gap is not None:
+        fill_mask &= (next_idx - prev_idx - 1) <= max_gap
+
+    prev_vals = _take(a, prev_idx)
+    if method == FillMethod.FFILL:
+        fill_vals = prev_vals
+    else:
+        next_vals = _take(a, next_idx)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            weight = (frames - prev_idx) / (next_idx - prev_idx)
+        fill_vals = prev_vals + (next_vals - prev_vals) * weight
+        if method == FillMethod.CUBIC:
+            fill_vals = _cubic(a, frames, prev_idx, next_idx, fill_vals)
+
+    filled = np.where(fill_mask, fill_vals, a)
+
+    missing_before = np.count_nonzero(~valid, axis=-1)
+    missing_after = missing_before - np.count_nonzero(fill_mask, axis=-1)
+    nan_scores = np.stack([missing_before, missing_after], axis=-1) * 100 / n
+    return filled, nan_scores
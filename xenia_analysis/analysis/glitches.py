@@ -0,0 +1,59 @@
+"""Tracking glitches: single frame jumps of a node (e.g. to the other side of the well) and right back."""
+
+import warnings
+
+import numpy as np
+import pandas as pd
+
+MAD_TO_STD = 1.4826  # MAD of a normal distribution to its std
+
+
+def rolling_median_scale(values: np.ndarray, window: int):
+    """Centered rolling median and robust scale (MAD * 1.4826) of every row of a (row, frame) array.
+
+    NaNs are skipped. the rolling medians are pandas' (a skiplist per row),
+    so the cost is linear in the frames for a given window. a still stretch
+    has a near 0 MAD, the scale is floored at the row's whole recording scale.
+    """
+    rolling = dict(window=window, center=True, min_periods=max(1, window // 4))
+    df = pd.DataFrame(values.T)  # frames on the rows, rolling runs down all the columns at once
+    median = df.rolling(**rolling).median()
+    scale = (df - median).abs().rolling(**rolling).median().to_numpy().T * MAD_TO_STD
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all NaN rows
+        row_median = np.nanmedian(values, axis=-1, keepdims=True)
+        row_scale = np.nanmedian(np.abs(values - row_median), axis=-1, keepdims=True) * MAD_TO_STD
+    return median.to_numpy().T, np.fmax(scale, row_scale)
+
+
+def find_glitches(coords: np.ndarray, window: int, threshold: float, min_step: float = 0):
+    """Boolean (node, frame) mask of the glitches in the (x/y, node, frame) coords.
+
+    a point is a glitch when the step into it and the step out of it both
+    have a robust z-score (against the rolling median and MAD of the node's
+    steps) over `threshold`, while the step over it (the frames before and
+    after) doesn't: the node jumped away and came right back. both steps
+    must also be at least `min_step` (pixels), a still node's subpixel
+    jitter has a tiny MAD and its few pixels wobbles would score high.
+    """
+    n_frames = coords.shape[-1]
+    glitches = np.zeros(coords.shape[1:], dtype=bool)
+    if n_frames < 3:
+        return glitches
+
+    steps = np.hypot(*np.diff(coords, axis=-1))  # steps[:, t] is frame t to t + 1
+    over = np.hypot(*(coords[..., 2:] - coords[..., :-2]))  # frame t - 1 to t + 1
+    median, scale = rolling_median_scale(steps, window)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = (steps - median) / scale
+        # the step over frame t is compared to the steps around it
+        z_over = (over - median[:, :-1]) / scale[:, :-1]
+    jump = (z > threshold) & (steps >= min_step)
+    glitches[:, 1:-1] = jump[:, :-1] & jump[:, 1:] & ~(z_over > threshold)
+    return glitches
+
+
+def mask_glitches(coords: np.ndarray, window: int, threshold: float, min_step: float = 0):
+    """The coords with the glitches NaN-ed (a new array) and the number of glitches of each node."""
+    glitches = find_glitches(coords, window, threshold, min_step=min_step)
+    return np.where(glitches, np.nan, coords), np.count_nonzero(glitches, axis=-1)
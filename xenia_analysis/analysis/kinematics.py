@@ -0,0 +1,58 @@
+"""Skeleton kinematics of the (2, node, frame) tracks block, along the file's edges (edge_inds)."""
+
+import numpy as np
+
+
+def segment_lengths(coords: np.ndarray, edges: np.ndarray):
+    """Length of every (src, dst) edge, shape (edge, frame), both ends gathered at once."""
+    edges = np.asarray(edges, dtype=int).reshape(-1, 2)
+    ends = coords[:, edges]  # (x/y, edge, src/dst, frame)
+    return np.hypot(*(ends[:, :, 1] - ends[:, :, 0]))
+
+
+def edge_joints(edges: np.ndarray):
+    """The (shared node, other end of a, other end of b) of every consecutive pair of edges a, b.
+
+    edges are consecutive if they share a node and no edge between them (in
+    the edges order) touches it, e.g. a chain's neighboring segments or the
+    neighboring spokes of a star.
+    """
+    edges = np.asarray(edges, dtype=int).reshape(-1, 2)
+    # every edge at both of its nodes, sorted by node then by edge
+    nodes = edges.ravel()
+    others = edges[:, ::-1].ravel()
+    order = np.lexsort((np.repeat(np.arange(len(edges)), 2), nodes))
+    nodes, others = nodes[order], others[order]
+    consecutive = nodes[1:] == nodes[:-1]
+    return np.stack([nodes[1:][consecutive], others[:-1][consecutive], others[1:][consecutive]], axis=1)
+
+
+def bend_angles(coords: np.ndarray, joints: np.ndarray):
+    """Signed angle (degrees, -180..180] from the joint's first segment to its second, (joint, frame).
+
+    a straight chain bends 180 degrees at a joint.
+    """
+    joints = np.asarray(joints, dtype=int).reshape(-1, 3)
+    points = coords[:, joints]  # (x/y, joint, shared/a/b, frame)
+    a = points[:, :, 1] - points[:, :, 0]
+    b = points[:, :, 2] - points[:, :, 0]
+    cross = a[0] * b[1] - a[1] * b[0]
+    dot = a[0] * b[0] + a[1] * b[1]
+    return np.degrees(np.arctan2(cross, dot))
+
+
+def node_derivatives(coords: np.ndarray, fs: float, window: int, polyorder: int = 2):
+    """Speed and acceleration magnitude of every node, two (node, frame) arrays.
+
+    the x and y of all the nodes are differentiated in one Savitzky-Golay
+    pass per derivative, along the frames. a window touching a NaN is NaN.
+    """
+    from scipy.signal import savgol_filter
+
+    window = max(window | 1, (polyorder + 1) | 1)  # odd and > polyorder
+    if coords.shape[-1] < window:
+        nans = np.full(coords.shape[1:], np.nan)
+        return nans, nans.copy()
+    velocity = savgol_filter(coords, window, polyorder, deriv=1, delta=1 / fs, axis=-1, mode="nearest")
+    acceleration = savgol_filter(coords, window, polyorder, deriv=2, delta=1 / fs, axis=-1, mode="nearest")
+    return np.hypot(*velocity), np.hypot(*acceleration)
@@ -0,0 +1,95 @@
+"""Min/max pyramid of long time series, to plot any time range at a bounded number of points.
+
+level k holds the min and max of every bucket of 2**k frames, each level built
+from the one below it. a pyramid is a dir of .npy files (memory mapped when
+read, only the requested window is touched) and a meta.json.
+"""
+
+import json
+from pathlib import Path
+
+import numpy as np
+
+META_NAME = "meta.json"
+DTYPE = np.float32  # plenty for plotting, halves the size
+
+
+def minmax_levels(values: np.ndarray):
+    """Yields (bucket, mins, maxs) of the (row, frame) values for buckets of 2, 4, 8.. frames.
+
+    NaNs are ignored (fmin/fmax), an all NaN bucket is NaN. the last bucket of
+    a level may be partial. stops once a level is a single bucket.
+    """
+    mins = maxs = values
+    bucket = 1
+    while mins.shape[-1] > 1:
+        if mins.shape[-1] % 2:
+            pad = np.full((*mins.shape[:-1], 1), np.nan, dtype=mins.dtype)
+            mins = np.concatenate([mins, pad], axis=-1)
+            maxs = np.concatenate([maxs, pad], axis=-1)
+        mins = np.fmin(mins[..., ::2], mins[..., 1::2])
+        maxs = np.fmax(maxs[..., ::2], maxs[..., 1::2])
+        bucket *= 2
+        yield bucket, mins, maxs
+
+
+def level_name(group: str, bucket: int):
+    return f"{group}.{bucket}.npy"
+
+
+def write_pyramid(dir_path: Path, groups: dict, framerate: float, start_secs: float = 0):
+    """Writes the pyramid of every group, {group: (row labels, (row, frame) values)}."""
+    dir_path = Path(dir_path)
+    dir_path.mkdir(parents=True, exist_ok=True)
+    meta = dict(framerate=framerate, start_secs=start_secs, groups={})
+    for group, (labels, values) in groups.items():
+        values = np.asarray(values, dtype=DTYPE)
+        np.save(dir_path.joinpath(level_name(group, 1)), values)  # level 0, min == max
+        buckets = [1]
+        for bucket, mins, maxs in minmax_levels(values):
+            np.save(dir_path.joinpath(level_name(group, bucket)), np.stack([mins, maxs]))
+            buckets.append(bucket)
+        meta["groups"][group] = dict(labels=list(labels), frames=values.shape[-1], buckets=buckets)
+    with open(dir_path.joinpath(META_NAME), "w") as f:
+        json.dump(meta, f, indent=True)
+    return meta
+
+
+class Pyramid:
+    def __init__(self, dir_path: Path):
+        self.dir_path = Path(dir_path)
+        with open(self.dir_path.joinpath(META_NAME)) as f:
+            self.meta = json.load(f)
+        self.framerate = self.meta["framerate"]
+        self.start_secs = self.meta["start_secs"]
+        self.groups = self.meta["groups"]
+
+    def pick_bucket(self, group: str, frames: int, max_points: int):
+        """The finest bucket showing `frames` frames in at most `max_points` points (2 per min/max bucket)."""
+        buckets = self.groups[group]["buckets"]
+        for bucket in buckets:
+            points = frames if bucket == 1 else 2 * -(-frames // bucket)
+            if points <= max_points:
+                return bucket
+        return buckets[-1]
+
+    def window(self, group: str, start_secs: float = None, stop_secs: float = None, max_points: int = 2000):
+        """The level matching the time range, cut to it.
+
+        returns the bucket, the time of every bucket (secs) and the (row, bucket)
+        mins and maxs (the same array at the full resolution).
+        """
+        frames = self.groups[group]["frames"]
+        start = 0 if start_secs is None else int(np.floor((start_secs - self.start_secs) * self.framerate))
+        stop = frames if stop_secs is None else int(np.ceil((stop_secs - self.start_secs) * self.framerate)) + 1
+        start, stop = max(0, min(start, frames)), max(0, min(stop, frames))
+        stop = max(start, stop)
+
+        bucket = self.pick_bucket(group, stop - start, max_points)
+        level = np.load(self.dir_path.joinpath(level_name(group, bucket)), mmap_mode="r")
+        first, last = start // bucket, -(-stop // bucket)
+        times = self.start_secs + np.arange(first, last) * bucket / self.framerate
+        if bucket == 1:
+            values = np.asarray(level[:, first:last])
+            return bucket, times, values, values
+        return bucket, times, np.asarray(level[0, :, first:last]), np.asarray(level[1, :, first:last])
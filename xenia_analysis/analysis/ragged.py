@@ -0,0 +1,115 @@
+"""Ragged arrays: variable length rows (e.g. the peaks of every tentacle) in one array."""
+
+from collections.abc import Mapping
+
+import numpy as np
+
+
+class Ragged(Mapping):
+    """One contiguous `data` array, row i is data[offsets[i]:offsets[i + 1]].
+
+    a read only mapping of label -> row (a view), so it can stand in for the
+    {tentacle: array} dicts. slicing rows shares the data, the offsets
+    don't have to start at 0 for that.
+    """
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray, labels: list):
+        self.data = np.asarray(data)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.labels = list(labels)
+        if len(self.offsets) != len(self.labels) + 1:
+            raise ValueError(f"{len(self.labels)} labels need {len(self.labels) + 1} offsets, got {len(self.offsets)}")
+        self._rows = {label: i for i, label in enumerate(self.labels)}
+
+    @classmethod
+    def from_dict(cls, rows: dict, dtype=float):
+        arrays = [np.asarray(v, dtype=dtype) for v in rows.values()]
+        offsets = np.concatenate([[0], np.cumsum([len(a) for a in arrays], dtype=np.int64)])
+        data = np.concatenate(arrays) if arrays else np.empty(0, dtype=dtype)
+        return cls(data, offsets, list(rows))
+
+    def with_data(self, data: np.ndarray):
+        """Same rows and labels over other (e.g. derived, per peak) values."""
+        if len(data) != self.offsets[-1] - self.offsets[0]:
+            raise ValueError(f"expected {self.offsets[-1] - self.offsets[0]} values, got {len(data)}")
+        return Ragged(data, self.offsets - self.offsets[0], self.labels)
+
+    def __getitem__(self, label):
+        i = self._rows[label]
+        return self.data[self.offsets[i] : self.offsets[i + 1]]
+
+    def __iter__(self):
+        return iter(self.labels)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __repr__(self):
+        return f"Ragged({len(self.labels)} rows, {self.lengths().sum()} values)"
+
+    def __getstate__(self):
+        # only what's in use, a slice doesn't pickle the values of the other rows
+        flat = self.flat()
+        return dict(data=flat, offsets=self.offsets - self.offsets[0], labels=self.labels)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def flat(self):
+        """The values of all the rows (a view)."""
+        return self.data[self.offsets[0] : self.offsets[-1]]
+
+    def row_ids(self):
+        """The row index of every value of `flat()`."""
+        return np.repeat(np.arange(len(self.labels)), self.lengths())
+
+    def slice(self, start: int = None, stop: int = None):
+        """Rows [start, stop), sharing the data."""
+        start, stop, _ = slice(start, stop).indices(len(self.labels))
+        stop = max(start, stop)
+        return Ragged(self.data, self.offsets[start : stop + 1], self.labels[start:stop])
+
+    @classmethod
+    def concat(cls, raggeds: list, keys: list = None):
+        """The rows of all the raggeds, with (key, label) labels if `keys`.
+
+        not a view, the values are copied once (O(total values)): flat(),
+        row_ids() and the bincounts over them need one contiguous array, over
+        a list of chunks every flat() would copy instead. the rows and slices
+        of the result are views again.
+        """
+        if not raggeds:
+            return cls(np.empty(0), np.zeros(1, dtype=np.int64), [])
+        lengths = [r.lengths() for r in raggeds]
+        offsets = np.concatenate([[0], np.cumsum(np.concatenate(lengths), dtype=np.int64)])
+        labels = [
+            (key, label) if keys is not None else label
+            for key, r in zip(keys if keys is not None else [None] * len(raggeds), raggeds)
+            for label in r.labels
+        ]
+        return cls(np.concatenate([r.flat() for r in raggeds]), offsets, labels)
+
+    def to_frame(self, value_name: str = "value"):
+        """Long format, a (label, value) row per value."""
+        import pandas as pd
+
+        labels = np.empty(len(self.labels), dtype=object)
+        labels[:] = self.labels
+        return pd.DataFrame({"label": labels[self.row_ids()], value_name: self.flat()})
+
+    def to_arrays(self, prefix: str):
+        """The arrays to np.savez the ragged with, under `prefix`."""
+        return {
+            f"{prefix}.data": self.flat(),
+            f"{prefix}.offsets": self.offsets - self.offsets[0],
+            f"{prefix}.labels": np.asarray(self.labels, dtype=str),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix: str):
+        labels = arrays[f"{prefix}.labels"]
+        labels = [tuple(label) for label in labels.tolist()] if labels.ndim == 2 else labels.tolist()
+        return cls(arrays[f"{prefix}.data"], arrays[f"{prefix}.offsets"], labels)
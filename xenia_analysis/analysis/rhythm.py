@@ -0,0 +1,61 @@
+"""Batched pulse rate (rhythm) of all tentacles on a shared uniform time grid."""
+
+import numpy as np
+
+
+def instantaneous_rates(peaks: list, c: int = 3):
+    """Pulse rate at each peak, c / (ts[i + c] - ts[i]), for all the peak
+    arrays at once.
+
+    like `H5Processor._calc_rhythms`, the last c peaks of each array (which
+    have no window) get the last computed rate. returns the flat peak times,
+    flat rates and the offsets of each array in them.
+    """
+    lengths = np.array([len(p) for p in peaks], dtype=int)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    if offsets[-1] == 0:
+        return np.empty(0), np.empty(0), offsets
+
+    flat = np.concatenate([np.asarray(p, dtype=float) for p in peaks])
+    row = np.repeat(np.arange(len(peaks)), lengths)
+    row_start, row_end = offsets[:-1][row], offsets[1:][row]
+
+    idx = np.arange(len(flat))
+    has_window = idx + c < row_end
+    ahead = flat[np.where(has_window, idx + c, idx)]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rates = np.where(has_window, c / (ahead - flat), np.nan)
+
+    # pad with the last value for the c missing values due to the c window
+    last_windowed = row_end - c - 1
+    can_pad = ~has_window & (last_windowed >= row_start)
+    rates = np.where(can_pad, rates[np.clip(last_windowed, 0, None)], rates)
+    return flat, rates, offsets
+
+
+def rhythm_grid(peaks: list, duration: float, bin_secs: float = 1.0, c: int = 3):
+    """Instantaneous pulse rate of all the peak arrays sampled on one uniform grid.
+
+    the rate at time t is the rate of the last peak at or before t, and NaN
+    before the first peak or after the last one. returns the grid times
+    (secs) and a (len(peaks), bins) array.
+    """
+    grid = np.arange(0, duration, bin_secs)
+    flat, rates, offsets = instantaneous_rates(peaks, c=c)
+    if len(flat) == 0:
+        return grid, np.full((len(peaks), len(grid)), np.nan)
+
+    # shift each array to its own time span, so a single searchsorted over the
+    # flat (sorted) peak times looks up every row and grid point at once
+    span = max(duration, flat.max()) + bin_secs + 1
+    row = np.repeat(np.arange(len(peaks)), np.diff(offsets))
+    keys = flat + row * span
+    queries = grid[None, :] + (np.arange(len(peaks)) * span)[:, None]
+    idx = np.searchsorted(keys, queries, side="right") - 1
+
+    starts, ends = offsets[:-1, None], offsets[1:, None]
+    inside = (idx >= starts) & (ends > starts)
+    last_peak = flat[np.clip(ends - 1, 0, len(flat) - 1)]
+    inside &= grid[None, :] <= last_peak
+    values = np.where(inside, rates[np.clip(idx, 0, len(rates) - 1)], np.nan)
+    return grid, values
@@ -0,0 +1,95 @@
+"""Spectral pulse rate: dominant frequency of every row over sliding windows (Welch)."""
+
+from dataclasses import dataclass
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+PULSE_BAND_HZ = (0.1, 2.0)
+BLOCK_WINDOWS = 32  # windows per block, bounds the memory of the transforms
+
+
+@dataclass
+class SpectralRhythm:
+    times: np.ndarray  # window centers (secs), (windows,)
+    freqs: np.ndarray  # dominant frequency (Hz), (rows, windows)
+    power_ratio: np.ndarray  # dominant peak power / mean band power, (rows, windows)
+
+
+def _dominant(psd: np.ndarray, freqs: np.ndarray):
+    # argmax refined by a parabola through the log power around it. a peak on a band
+    # edge has no neighbour on one side, it's reported as the edge frequency as is
+    k = np.argmax(psd, axis=-1)
+    edge = (k == 0) | (k == psd.shape[-1] - 1)
+    inner = np.clip(k, 1, psd.shape[-1] - 2)
+    take = lambda off: np.log(np.take_along_axis(psd, (inner + off)[..., None], axis=-1)[..., 0])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        left, mid, right = take(-1), take(0), take(1)
+        denom = left - 2 * mid + right
+        shift = np.where((denom < 0) & ~edge, 0.5 * (left - right) / denom, 0.0)
+        ratio = np.take_along_axis(psd, k[..., None], axis=-1)[..., 0] / psd.mean(axis=-1)
+    df = freqs[1] - freqs[0]
+    return freqs[k] + np.clip(shift, -0.5, 0.5) * df, ratio
+
+
+def spectral_rhythm(
+    x: np.ndarray,
+    fs: float,
+    window_secs: float = 60,
+    step_secs: float = 10,
+    segment_secs: float = 20,
+    band: tuple = PULSE_BAND_HZ,
+    block_windows: int = BLOCK_WINDOWS,
+):
+    """Dominant (pulse) frequency of every row of x (rows, frame) in each sliding window.
+
+    each window's spectrum is the Welch average of its half overlapping
+    segments. segments of all rows are transformed together in one batched
+    rfft per block of windows, so memory depends on the window (and block)
+    size, not on the recording length.
+    """
+    from scipy import fft as sfft
+    from scipy import signal as sig
+
+    x = np.asarray(x, dtype=float)
+    n_rows, n_frames = x.shape
+    win = int(window_secs * fs)
+    step = max(1, int(step_secs * fs))
+    seg = max(4, min(int(segment_secs * fs), win))
+    hop = max(1, seg // 2)
+    nfft = sfft.next_fast_len(4 * seg)  # zero padded, finer frequency grid
+    freqs = sfft.rfftfreq(nfft, 1 / fs)
+    in_band = (freqs >= band[0]) & (freqs <= band[1])
+    taper = sig.get_window("hann", seg)
+
+    starts = np.arange(0, n_frames - win + 1, step) if n_frames >= win else np.empty(0, dtype=int)
+    out_freqs = np.full((n_rows, len(starts)), np.nan)
+    out_ratio = np.full((n_rows, len(starts)), np.nan)
+
+    for b in range(0, len(starts), block_windows):
+        block = starts[b : b + block_windows]
+        span = x[:, block[0] : block[-1] + win]
+        span = span - np.nanmean(span, axis=-1, keepdims=True)
+        span = np.nan_to_num(span, nan=0.0)
+
+        # segments on a hop grid starting at the block start, (rows, segs, seg) view
+        segments = sliding_window_view(span, seg, axis=-1)[:, ::hop]
+        segments = segments - segments.mean(axis=-1, keepdims=True)
+        psd = np.abs(sfft.rfft(segments * taper, n=nfft, axis=-1)[..., in_band]) ** 2
+
+        # welch average of the segments in each window, via cumulative sums
+        csum = np.concatenate([np.zeros_like(psd[:, :1]), np.cumsum(psd, axis=1)], axis=1)
+        seg_starts = np.arange(psd.shape[1]) * hop
+        first = np.searchsorted(seg_starts, block - block[0], side="left")
+        last = np.searchsorted(seg_starts, block - block[0] + win - seg, side="right")
+        counts = np.maximum(last - first, 1)[None, :, None]
+        welch = (csum[:, last] - csum[:, first]) / counts
+
+        f, ratio = _dominant(welch, freqs[in_band])
+        out_freqs[:, b : b + len(block)] = f
+        out_ratio[:, b : b + len(block)] = ratio
+
+    silent = ~np.isfinite(out_ratio)
+    out_freqs[silent] = np.nan
+    return SpectralRhythm(times=(starts + win / 2) / fs, freqs=out_freqs, power_ratio=out_ratio)
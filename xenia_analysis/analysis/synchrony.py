@@ -0,0 +1,141 @@
+"""Cross tentacle synchrony: phase locking (hilbert phase) and coherence of all
+tentacle pairs over sliding windows, from batched FFTs of the node x frame matrix."""
+
+from dataclasses import dataclass
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from .distances import all_node_pairs
+
+
+SYNC_BAND_HZ = (0.1, 2.0)  # pulses are roughly 0.3-1 Hz
+
+
+@dataclass
+class SynchronyResult:
+    times: np.ndarray  # window centers (secs), (windows,)
+    pairs: np.ndarray  # (pairs, 2) node indices, i < j
+    plv: np.ndarray  # phase locking value, (pairs, windows)
+    coherence: np.ndarray  # band averaged magnitude squared coherence, (pairs, windows)
+
+    def plv_matrix(self, n_nodes: int):
+        return self._to_matrix(self.plv, n_nodes)
+
+    def coherence_matrix(self, n_nodes: int):
+        return self._to_matrix(self.coherence, n_nodes)
+
+    def _to_matrix(self, values: np.ndarray, n_nodes: int):
+        # per window symmetric (windows, node, node) matrix, ones on the diagonal
+        m = np.ones((values.shape[-1], n_nodes, n_nodes))
+        i, j = self.pairs.T
+        m[:, i, j] = values.T
+        m[:, j, i] = values.T
+        return m
+
+    def synchrony_index(self):
+        # mean over all the pairs, per window
+        return np.nanmean(self.plv, axis=0), np.nanmean(self.coherence, axis=0)
+
+
+def _centered(x: np.ndarray):
+    x = x - np.nanmean(x, axis=-1, keepdims=True)
+    return np.nan_to_num(x, nan=0.0)  # gaps don't add any phase/power
+
+
+def band_analytic_signal(x: np.ndarray, fs: float, band: tuple = SYNC_BAND_HZ):
+    """Band limited analytic signal of every row of x, (node, frame), from one batched FFT."""
+    from scipy import fft as sfft
+
+    n = x.shape[-1]
+    nfft = sfft.next_fast_len(n)
+    spec = sfft.fft(_centered(x), n=nfft, axis=-1)
+    freqs = sfft.fftfreq(nfft, 1 / fs)
+    # hilbert: double the positive frequencies, drop the negative ones (and the
+    # ones out of band)
+    gain = np.where((freqs >= band[0]) & (freqs <= band[1]), 2.0, 0.0)
+    spec *= gain
+    return sfft.ifft(spec, axis=-1, overwrite_x=True)[..., :n]
+
+
+def window_starts(n_frames: int, win: int, step: int):
+    if n_frames < win:
+        return np.empty(0, dtype=int)
+    return np.arange(0, n_frames - win + 1, step)
+
+
+def phase_locking(x: np.ndarray, pairs: np.ndarray, fs: float, win: int, step: int, band=SYNC_BAND_HZ):
+    """|mean(exp(i(phase_a - phase_b)))| of each pair over every window, (pairs, windows)."""
+    analytic = band_analytic_signal(x, fs, band)
+    mag = np.abs(analytic)
+    z = np.divide(analytic, mag, out=np.zeros_like(analytic), where=mag > 0)
+
+    i, j = pairs.T
+    locked = z[i] * np.conj(z[j])
+    # window sums of all pairs at once through a cumulative sum over frames
+    csum = np.concatenate(
+        [np.zeros((len(pairs), 1), dtype=locked.dtype), np.cumsum(locked, axis=-1)], axis=-1
+    )
+    starts = window_starts(x.shape[-1], win, step)
+    return np.abs(csum[:, starts + win] - csum[:, starts]) / win
+
+
+def coherence(x: np.ndarray, pairs: np.ndarray, fs: float, win: int, step: int, seg: int, band=SYNC_BAND_HZ):
+    """Welch magnitude squared coherence of each pair over every window,
+    averaged over the band, (pairs, windows).
+
+    all the (half overlapping) segments of all nodes are transformed in one
+    rfft, each window then sums the cross spectra of the segments inside it.
+    """
+    from scipy import fft as sfft
+    from scipy import signal as sig
+
+    seg = min(seg, win)
+    hop = max(1, seg // 2)
+    segments = sliding_window_view(_centered(x), seg, axis=-1)[:, ::hop]  # (node, segs, seg), a view
+    spec = sfft.rfft(segments * sig.get_window("hann", seg), axis=-1)
+    freqs = sfft.rfftfreq(seg, 1 / fs)
+    spec = spec[..., (freqs >= band[0]) & (freqs <= band[1])]
+
+    i, j = pairs.T
+    cross = spec[i] * np.conj(spec[j])  # (pairs, segs, freqs)
+    auto = np.abs(spec) ** 2  # (node, segs, freqs)
+
+    def window_sums(a):
+        csum = np.concatenate([np.zeros_like(a[:, :1]), np.cumsum(a, axis=1)], axis=1)
+        return csum[:, seg_end] - csum[:, seg_start]
+
+    seg_starts = np.arange(segments.shape[1]) * hop
+    starts = window_starts(x.shape[-1], win, step)
+    seg_start = np.searchsorted(seg_starts, starts, side="left")
+    seg_end = np.searchsorted(seg_starts, starts + win - seg, side="right")
+
+    sxy = window_sums(cross)  # (pairs, windows, freqs)
+    sxx = window_sums(auto)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        msc = np.abs(sxy) ** 2 / (sxx[i] * sxx[j])
+    return np.nanmean(msc, axis=-1) if msc.shape[-1] else np.full(msc.shape[:2], np.nan)
+
+
+def synchrony(
+    x: np.ndarray,
+    fs: float,
+    window_secs: float = 60,
+    step_secs: float = 10,
+    segment_secs: float = 10,
+    band: tuple = SYNC_BAND_HZ,
+):
+    """PLV and coherence of all the row pairs of x (node, frame) over sliding windows."""
+    x = np.asarray(x, dtype=float)
+    pairs = all_node_pairs(x.shape[0])
+    win = int(window_secs * fs)
+    step = max(1, int(step_secs * fs))
+    seg = max(2, int(segment_secs * fs))
+
+    starts = window_starts(x.shape[-1], win, step)
+    return SynchronyResult(
+        times=(starts + win / 2) / fs,
+        pairs=pairs,
+        plv=phase_locking(x, pairs, fs, win, step, band),
+        coherence=coherence(x, pairs, fs, win, step, seg, band),
+    )
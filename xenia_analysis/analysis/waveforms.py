@@ -0,0 +1,54 @@
+"""Peak aligned (event triggered) average waveforms of the tentacles distances."""
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def peak_windows(values: np.ndarray, peaks: list, half_width: int):
+    """The (2 * half_width + 1) frames long windows of `values` centered on the peaks.
+
+    `values` is (row, frame) and `peaks[i]` the peak frames of row i. the
+    windows are picked by fancy indexing into a strided view of the windows at
+    every frame, so only the picked windows are copied. peaks too close to
+    the ends for a full window are dropped. returns the (peak, lag) windows
+    and the row of each of them.
+    """
+    width = 2 * half_width + 1
+    n_frames = values.shape[-1]
+    rows = np.repeat(np.arange(len(peaks)), [len(p) for p in peaks])
+    if n_frames < width or len(rows) == 0:
+        return np.empty((0, width), dtype=values.dtype), np.empty(0, dtype=int)
+
+    starts = np.concatenate([np.asarray(p, dtype=int) for p in peaks]) - half_width
+    full = (starts >= 0) & (starts + width <= n_frames)
+    rows, starts = rows[full], starts[full]
+    windows = sliding_window_view(values, width, axis=-1)  # (row, start, lag), no copy
+    return windows[rows, starts], rows
+
+
+def peak_waveforms(values: np.ndarray, peaks: list, half_width: int):
+    """Mean and SEM waveform of every row around its peaks.
+
+    NaN points are left out of the lag they're at. returns the lags (frames)
+    and the (row, lag) mean, SEM and number of peaks averaged.
+    """
+    windows, rows = peak_windows(values, peaks, half_width)
+    n_rows, width = len(peaks), 2 * half_width + 1
+    present = ~np.isnan(windows)
+    filled = np.where(present, windows, 0)
+
+    # per row sums of the windows, all rows at once
+    n = np.zeros((n_rows, width))
+    sums = np.zeros((n_rows, width))
+    squares = np.zeros((n_rows, width))
+    np.add.at(n, rows, present)
+    np.add.at(sums, rows, filled)
+    np.add.at(squares, rows, filled**2)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = sums / n
+        var = np.clip(squares - n * mean**2, 0, None) / (n - 1)
+        sem = np.sqrt(var / n)
+    mean[n == 0] = np.nan
+    sem[n < 2] = np.nan
+    return np.arange(-half_width, half_width + 1), mean, sem, n
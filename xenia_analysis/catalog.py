@@ -0,0 +1,444 @@
+"""Indexed (sqlite) catalog of the h5 analysis files found under a data tree."""
+
+import os
+import re
+import json
+import sqlite3
+from pathlib import Path
+from datetime import datetime
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+
+from logger import getLogger, get_log_queue, init_worker_logging
+from xenio import JSON_KEYS, INPUT_CONFIG_JSON_NAME, GenDetailsFileScript
+
+LOGGER = getLogger(__name__)
+
+
+H5_SUFFIX = ".analysis.h5"
+DEFAULT_DB_PATH = Path(__file__, "..", "..", "data", "catalog.sqlite").resolve()
+# of the h5 (or its tracks) attributes and of its provenance json
+FRAMERATE_KEYS = ["fps", "framerate", "frame_rate", "framerate_fps"]
+# per frame times (seconds) datasets, the framerate is 1 / their median step
+TIMESTAMPS_DATASETS = ["frame_timestamps", "timestamps", "frame_times"]
+# --where conditions, "<column> <op> <value>", the value is passed as a parameter
+WHERE_REGEX = re.compile(r"^\s*(?P<column>\w+)\s*(?P<op><=|>=|!=|<>|=|<|>|like(?=\s))\s*(?P<value>.*?)\s*$", re.IGNORECASE)
+
+
+class CatalogKeys:
+    PATH = "path"
+    DIR = "dir"
+    FILENAME = "filename"
+    MTIME = "mtime"
+    SIZE = "size"
+    N_TRACKS = "n_tracks"
+    N_NODES = "n_nodes"
+    N_FRAMES = "n_frames"
+    NODE_NAMES = "node_names"
+    VIDEO_PATH = "video_path"
+    PROVENANCE = "provenance"
+    FRAMERATE = "framerate_fps"
+    SUBSTANCE = "substance"
+    CONCENTRATION = "concentration"
+    CONCENTRATION_UNIT = "concentration_unit"
+    SCANNED_AT = "scanned_at"
+
+
+CATALOG_COLUMNS = [v for k, v in vars(CatalogKeys).items() if not k.startswith("_")]
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS files (
+    {CatalogKeys.PATH} TEXT PRIMARY KEY,
+    {CatalogKeys.DIR} TEXT NOT NULL,
+    {CatalogKeys.FILENAME} TEXT NOT NULL,
+    {CatalogKeys.MTIME} REAL NOT NULL,
+    {CatalogKeys.SIZE} INTEGER NOT NULL,
+    {CatalogKeys.N_TRACKS} INTEGER,
+    {CatalogKeys.N_NODES} INTEGER,
+    {CatalogKeys.N_FRAMES} INTEGER,
+    {CatalogKeys.NODE_NAMES} TEXT,
+    {CatalogKeys.VIDEO_PATH} TEXT,
+    {CatalogKeys.PROVENANCE} TEXT,
+    {CatalogKeys.FRAMERATE} REAL,
+    {CatalogKeys.SUBSTANCE} TEXT,
+    {CatalogKeys.CONCENTRATION} TEXT,
+    {CatalogKeys.CONCENTRATION_UNIT} TEXT,
+    {CatalogKeys.SCANNED_AT} TEXT
+);
+CREATE INDEX IF NOT EXISTS files_condition ON files (
+    {CatalogKeys.SUBSTANCE}, {CatalogKeys.CONCENTRATION}, {CatalogKeys.CONCENTRATION_UNIT}
+);
+CREATE INDEX IF NOT EXISTS files_dir ON files ({CatalogKeys.DIR});
+CREATE INDEX IF NOT EXISTS files_frames ON files ({CatalogKeys.N_FRAMES});
+"""
+
+
+def _decode(value):
+    if isinstance(value, bytes):
+        return value.decode(errors="replace")
+    return None if value is None else str(value)
+
+
+def _framerate_of(mapping):
+    for key in FRAMERATE_KEYS:
+        if key in mapping:
+            try:
+                return float(mapping[key])
+            except (TypeError, ValueError):
+                pass
+    return None
+
+
+def _framerate_from_provenance(provenance: str):
+    try:
+        data = json.loads(provenance)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(data, dict):
+        return None
+    return _framerate_of(data)
+
+
+def _framerate_from_timestamps(f):
+    import numpy as np
+
+    for name in TIMESTAMPS_DATASETS:
+        if name in f and f[name].ndim == 1 and len(f[name]) > 1:
+            step = np.nanmedian(np.diff(f[name][:].astype(float)))
+            if step > 0:
+                return float(1 / step)
+    return None
+
+
+@lru_cache(maxsize=256)
+def _details_framerates(details_path: Path, mtime: float):
+    # filename -> framerate of a details.json, cached per (dir, version) for the scanned files next to it
+    try:
+        with open(details_path) as f:
+            inputs = json.load(f)[JSON_KEYS.INPUTS]
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+    return {
+        Path(i[JSON_KEYS.FILENAME]).name: float(i[JSON_KEYS.FRAMERATE])
+        for i in inputs
+        if isinstance(i, dict) and JSON_KEYS.FILENAME in i and i.get(JSON_KEYS.FRAMERATE)
+    }
+
+
+def _framerate_from_details(path: Path):
+    details_path = Path(path).parent.joinpath(INPUT_CONFIG_JSON_NAME)
+    try:
+        mtime = details_path.stat().st_mtime
+    except OSError:
+        return None
+    return _details_framerates(details_path, mtime).get(Path(path).name)
+
+
+def read_framerate(f, path: str, provenance: str = None):
+    """The framerate of an open h5 file, None if unknown.
+
+    from the file's (or its tracks') attributes, its provenance, its frame
+    timestamps or else the details.json next to it, in that order. SLEAP
+    analysis files usually have none of the first three.
+    """
+    return (
+        _framerate_of(f.attrs)
+        or _framerate_of(f["tracks"].attrs)
+        or _framerate_from_provenance(provenance)
+        or _framerate_from_timestamps(f)
+        or _framerate_from_details(path)
+    )
+
+
+def parse_condition(text: str):
+    """The (sql clause, parameter) of a `<column> <op> <value>` --where condition, raises ValueError."""
+    match = WHERE_REGEX.match(text)
+    if not match:
+        raise ValueError(f"bad condition {text!r}, expected <column> <op> <value>, e.g. \"n_nodes = 9\"")
+    column, op, value = match.group("column"), match.group("op").upper(), match.group("value")
+    if column not in CATALOG_COLUMNS:
+        raise ValueError(f"unknown column {column!r}, expected one of {CATALOG_COLUMNS}")
+    if len(value) > 1 and value[0] == value[-1] and value[0] in "'\"":
+        value = value[1:-1]  # quoted, as is
+    else:
+        for number in (int, float):
+            try:
+                value = number(value)
+                break
+            except ValueError:
+                pass
+    return f"{column} {op} ?", value
+
+
+def read_h5_header(path: str):
+    """Read the catalog entry of a single file, touching only small datasets
+    and the `tracks` shape (never its data)."""
+    stat = os.stat(path)
+    entry = {
+        CatalogKeys.PATH: path,
+        CatalogKeys.DIR: str(Path(path).parent),
+        CatalogKeys.FILENAME: Path(path).name,
+        CatalogKeys.MTIME: stat.st_mtime,
+        CatalogKeys.SIZE: stat.st_size,
+    }
+    import h5py  # in the scan workers only, queries don't need it
+
+    with h5py.File(path, "r") as f:
+        # tracks shape: (tracks, x/y, nodes, frames)
+        n_tracks, _, n_nodes, n_frames = f["tracks"].shape
+        node_names = [_decode(n) for n in f["node_names"][:]]
+        video_path = _decode(f["video_path"][()]) if "video_path" in f else None
+        provenance = _decode(f["provenance"][()]) if "provenance" in f else None
+        framerate = read_framerate(f, path, provenance)
+
+    details = GenDetailsFileScript().gen_file_data(Path(path))
+    concentration = details[JSON_KEYS.CONCENTRATION]
+    entry.update({
+        CatalogKeys.N_TRACKS: n_tracks,
+        CatalogKeys.N_NODES: n_nodes,
+        CatalogKeys.N_FRAMES: n_frames,
+        CatalogKeys.NODE_NAMES: json.dumps(node_names),
+        CatalogKeys.VIDEO_PATH: video_path,
+        CatalogKeys.PROVENANCE: provenance,
+        CatalogKeys.FRAMERATE: framerate,
+        CatalogKeys.SUBSTANCE: details[JSON_KEYS.SUBSTANCE],
+        CatalogKeys.CONCENTRATION: str(concentration[JSON_KEYS.CONCENTRATION_VALUE]),
+        CatalogKeys.CONCENTRATION_UNIT: concentration[JSON_KEYS.CONCENTRATION_UNIT],
+        CatalogKeys.SCANNED_AT: datetime.now().isoformat(timespec="seconds"),
+    })
+    return entry
+
+
+def _safe_read_h5_header(path: str):
+    try:
+        return read_h5_header(path)
+    except Exception as e:
+        return {CatalogKeys.PATH: path, "error": repr(e)}
+
+
+class H5Catalog:
+    def __init__(self, db_path: Path = DEFAULT_DB_PATH):
+        self.db_path = Path(db_path)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _known(self, root: Path):
+        # a plain prefix compare, LIKE would take the _ and % of the path as wildcards
+        prefix = f"{root}{os.sep}"
+        rows = self.conn.execute(
+            f"SELECT {CatalogKeys.PATH}, {CatalogKeys.MTIME}, {CatalogKeys.SIZE} FROM files "
+            f"WHERE substr({CatalogKeys.PATH}, 1, length(?)) = ?",
+            (prefix, prefix),
+        )
+        return {r[0]: (r[1], r[2]) for r in rows}
+
+    def scan(self, root: Path, workers: int = None):
+        """Incrementally (by mtime and size) sync the catalog with the h5 files under root."""
+        root = Path(root).resolve()
+        known = self._known(root)
+
+        found = {}
+        for dirpath, _, filenames in os.walk(root):
+            for name in filenames:
+                if name.endswith(H5_SUFFIX):
+                    path = os.path.join(dirpath, name)
+                    stat = os.stat(path)
+                    found[path] = (stat.st_mtime, stat.st_size)
+
+        changed = [p for p, sig in found.items() if known.get(p) != sig]
+        removed = [p for p in known if p not in found]
+        LOGGER.info(
+            f"scanning {root}: {len(found)} files, {len(changed)} new/changed, {len(removed)} removed"
+        )
+
+        entries = []
+        if changed:
+            with ProcessPoolExecutor(
+                max_workers=workers, initializer=init_worker_logging, initargs=(get_log_queue(),)
+            ) as pool:
+                for entry in pool.map(_safe_read_h5_header, changed, chunksize=8):
+                    if "error" in entry:
+                        LOGGER.warning(f"failed to read {entry[CatalogKeys.PATH]}: {entry['error']}")
+                        continue
+                    entries.append(entry)
+
+        with self.conn:
+            if entries:
+                cols = list(entries[0])
+                self.conn.executemany(
+                    f"INSERT OR REPLACE INTO files ({', '.join(cols)}) "
+                    f"VALUES ({', '.join(':' + c for c in cols)})",
+                    entries,
+                )
+            self.conn.executemany(
+                f"DELETE FROM files WHERE {CatalogKeys.PATH} = ?", [(p,) for p in removed]
+            )
+        return len(entries), len(removed)
+
+    def query(
+        self,
+        substance: str = None,
+        concentration: str = None,
+        unit: str = None,
+        name_filter: str = None,
+        min_frames: int = None,
+        where: list = None,
+    ):
+        """The matching rows, `where` are extra `<column> <op> <value>` conditions (see parse_condition)."""
+        clauses, params = [], []
+        for col, value in [
+            (CatalogKeys.SUBSTANCE, substance),
+            (CatalogKeys.CONCENTRATION, concentration),
+            (CatalogKeys.CONCENTRATION_UNIT, unit),
+        ]:
+            if value is not None:
+                clauses.append(f"{col} = ? COLLATE NOCASE")
+                params.append(str(value))
+        if name_filter:
+            clauses.append(f"{CatalogKeys.FILENAME} LIKE ?")
+            params.append(f"%{name_filter}%")
+        if min_frames is not None:
+            clauses.append(f"{CatalogKeys.N_FRAMES} >= ?")
+            params.append(min_frames)
+        for condition in where or []:
+            clause, value = parse_condition(condition)
+            clauses.append(clause)
+            params.append(value)
+
+        sql = "SELECT * FROM files"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += f" ORDER BY {CatalogKeys.PATH}"
+        return [dict(r) for r in self.conn.execute(sql, params)]
+
+    @staticmethod
+    def to_details_json(rows: list, details_dir: Path):
+        """Build a details.json for the rows, files outside details_dir are
+        referenced by absolute path."""
+        details_dir = Path(details_dir).resolve()
+        inputs = []
+        for row in rows:
+            path = Path(row[CatalogKeys.PATH])
+            entry = GenDetailsFileScript.build_file_data(
+                path,
+                substance=row[CatalogKeys.SUBSTANCE],
+                concentration=row[CatalogKeys.CONCENTRATION],
+                unit=row[CatalogKeys.CONCENTRATION_UNIT],
+            )
+            if path.parent != details_dir:
+                entry[JSON_KEYS.FILENAME] = path.as_posix()
+            if row[CatalogKeys.FRAMERATE]:
+                entry[JSON_KEYS.FRAMERATE] = row[CatalogKeys.FRAMERATE]
+            else:
+                LOGGER.warning(f"unknown framerate of {path.name}, using {entry[JSON_KEYS.FRAMERATE]} fps, check it")
+            inputs.append(entry)
+        return {JSON_KEYS.INPUTS: inputs}
+
+
+def condition_arg(value: str):
+    from argparse import ArgumentTypeError
+
+    try:
+        parse_condition(value)
+    except ValueError as e:
+        raise ArgumentTypeError(str(e))
+    return value
+
+
+class CatalogScript:
+    SCRIPT_NAME = "h5 catalog"
+    description = f"""
+        \nExamples:
+        \tpython {Path(__file__).name} -i data/  # scan (incrementally) all the h5 files under data/
+        \tpython {Path(__file__).name} --substance tubocurarine --concentration 100 --unit micromolar  # list matching files
+        \tpython {Path(__file__).name} --substance tubocurarine --details-out data/tubo/  # write a details.json for the query
+    """
+
+    def parseArgs(self):
+        from argparse import ArgumentParser, RawDescriptionHelpFormatter
+
+        parser = ArgumentParser(
+            prog=self.SCRIPT_NAME,
+            formatter_class=RawDescriptionHelpFormatter,
+            description=self.description,
+        )
+        # fmt: off
+        parser.add_argument("--db",
+            default=DEFAULT_DB_PATH, type=Path,
+            help="path of the catalog sqlite file",
+        )
+        parser.add_argument("-i", "--input",
+            help="data tree to scan into the catalog before querying",
+        )
+        parser.add_argument("-j", "--workers",
+            default=None, type=int,
+            help="number of scanning processes, defaults to cpu count",
+        )
+        parser.add_argument("--substance")
+        parser.add_argument("--concentration")
+        parser.add_argument("--unit")
+        parser.add_argument("--name-filter",
+            help="only files with this string in their name",
+        )
+        parser.add_argument("--min-frames",
+            default=None, type=int,
+        )
+        parser.add_argument("--where",
+            action="append", type=condition_arg,
+            help="extra condition <column> <op> <value> (ops: = != < <= > >= like), e.g. \"n_nodes = 9\", can repeat",
+        )
+        parser.add_argument("--details-out",
+            help=f"dir to write a {INPUT_CONFIG_JSON_NAME} of the query result into",
+        )
+        # fmt: on
+        return parser.parse_args()
+
+    def main(self):
+        args = self.parseArgs()
+        LOGGER.info(f"starting execution of {self.SCRIPT_NAME} with {args=}")
+
+        with H5Catalog(args.db) as catalog:
+            if args.input:
+                if not Path(args.input).is_dir():
+                    return print("please provide a path to a dir")
+                updated, removed = catalog.scan(Path(args.input), workers=args.workers)
+                LOGGER.info(f"catalog updated: {updated} files (re)scanned, {removed} removed")
+
+            rows = catalog.query(
+                substance=args.substance,
+                concentration=args.concentration,
+                unit=args.unit,
+                name_filter=args.name_filter,
+                min_frames=args.min_frames,
+                where=args.where,
+            )
+
+        for row in rows:
+            print(
+                f"{row[CatalogKeys.SUBSTANCE]} {row[CatalogKeys.CONCENTRATION]}{row[CatalogKeys.CONCENTRATION_UNIT]}"
+                f"\t{row[CatalogKeys.N_FRAMES]} frames\t{row[CatalogKeys.PATH]}"
+            )
+        LOGGER.info(f"{len(rows)} matching files")
+
+        if args.details_out:
+            details_dir = Path(args.details_out)
+            details_dir.mkdir(parents=True, exist_ok=True)
+            with open(details_dir.joinpath(INPUT_CONFIG_JSON_NAME), "w") as f:
+                json.dump(H5Catalog.to_details_json(rows, details_dir), f, indent=True)
+            LOGGER.info(f"wrote {INPUT_CONFIG_JSON_NAME} to {details_dir}")
+
+        LOGGER.info(f"done execution of {self.SCRIPT_NAME}")
+
+
+if __name__ == "__main__":
+    CatalogScript().main()
@@ -3,7 +3,11 @@ import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
 from logger import getLogger
+from analysis.pyramid import write_pyramid
 from .shared import BaseExporter
+from .templates import figure_template
+
+pd.options.plotting.backend = "plotly"
 
 LOGGER = getLogger(__name__)
 
@@ -14,7 +18,7 @@ class ExportUnifiedPlot(BaseExporter):
     X_AXIS_TITLE = "Time [min]"
 
     def _graph_title(self, processor):
-        return f"Tentacles distance from Mouth over Time ({processor.substance} {processor.concentration} {processor.concentration_unit})"
+        return f"Tentacles distance from {processor.reference_node_name} over Time ({processor.substance} {processor.concentration} {processor.concentration_unit})"
 
     def _export(self, processor, df: pd.DataFrame, name: str):
         xaxis = processor.processed.time_axis[:] / 60 # convert to minutes
@@ -44,28 +48,24 @@ class ExportUnifiedPlot(BaseExporter):
 
 
 class ExportInteractivePlot(BaseExporter):
+    COSTLY = True
     EXT = "multi-plot"
     Y_AXIS_TITLE = "Distance(t,m) [pixels]"
     X_AXIS_TITLE = "Time [min]"
     AXIS_FONT_SIZE = 12
 
     def _graph_title(self, processor):
-        return f"Tentacles distance from Mouth over Time ({processor.substance} {processor.concentration} {processor.concentration_unit})"
-
-    def _export(self, processor, df: pd.DataFrame, name: str):
-        xaxis = processor.processed.time_axis[:] / 60 # convert to minutes
+        return f"Tentacles distance from {processor.reference_node_name} over Time ({processor.substance} {processor.concentration} {processor.concentration_unit})"
 
+    def _build_template(self, titles: list):
         fig = make_subplots(
             rows=4,
             cols=2,
-            subplot_titles=df.columns,
+            subplot_titles=titles,
         )
-        for i, col in enumerate(df.columns):
+        for i in range(len(titles)):
             row_i = 1 + (i // 2)
             col_i = 1 + (i % 2)
-            fig.add_trace(go.Scatter(y=df[col], x=xaxis), row=row_i, col=col_i)
-            LOGGER.debug(f"placing plot of {col=} in ({row_i}, {col_i})")
-
             next(fig.select_yaxes(row=row_i, col=col_i)).update(
                 title=dict(text=self.Y_AXIS_TITLE, font=dict(size=self.AXIS_FONT_SIZE)),
                 matches="y",
@@ -74,17 +74,30 @@ class ExportInteractivePlot(BaseExporter):
                 title=dict(text=self.X_AXIS_TITLE, font=dict(size=self.AXIS_FONT_SIZE)),
                 matches="x",
             )
-        fig.update_layout(
-            showlegend=False,
-            title=dict(
-                text=self._graph_title(processor),
-                subtitle=dict(text=name)
+        return fig
+
+    def _export(self, processor, df: pd.DataFrame, name: str):
+        xaxis = processor.processed.time_axis[:] / 60 # convert to minutes
+
+        titles = list(df.columns)
+        with figure_template((type(self).__name__, *titles), lambda: self._build_template(titles)) as fig:
+            for i, col in enumerate(df.columns):
+                row_i = 1 + (i // 2)
+                col_i = 1 + (i % 2)
+                fig.add_trace(go.Scatter(y=df[col], x=xaxis), row=row_i, col=col_i)
+                LOGGER.debug("placing plot of col=%r in (%d, %d)", col, row_i, col_i)
+
+            fig.update_layout(
+                showlegend=False,
+                title=dict(
+                    text=self._graph_title(processor),
+                    subtitle=dict(text=name)
+                )
             )
-        )
 
-        if self.show_plot:
-            fig.show()
-        self.save_fig(processor, fig, node_name=f"{name}.multi-plot")
+            if self.show_plot:
+                fig.show()
+            self.save_fig(processor, fig, node_name=f"{name}.multi-plot")
 
     def export(self, processor):
         self._export(
@@ -92,3 +105,21 @@ class ExportInteractivePlot(BaseExporter):
             df=processor.processed.dists_full_normed_df,
             name="normalized-post-interpolation",
         )
+
+
+class ExportDistsPyramid(BaseExporter):
+    """Min/max pyramids of the normalized distances and their aggs, for viewer.py."""
+
+    EXT = "pyramid"
+    GROUPS = {
+        "tentacles": "dists_full_normed_df",
+        "aggs": "dists_sum_aggs",
+    }
+
+    def export(self, processor):
+        groups = {}
+        for group, field in self.GROUPS.items():
+            df: pd.DataFrame = getattr(processor.processed, field)
+            groups[group] = (list(df.columns), df.to_numpy().T)
+        with self.atomic_output_path(processor, ext=self.EXT) as dir_path:
+            write_pyramid(dir_path, groups, framerate=processor.framerate)
@@ -1,4 +1,3 @@
-import xlsxwriter
 import pandas as pd
 
 from logger import getLogger
@@ -9,13 +8,17 @@ LOGGER = getLogger(__name__)
 
 class ExportGeneralDfsToExcel(BaseExporter):
     def export(self, processor):
-        output_path = self.get_output_full_path(processor, ext="xlsx", name="general")
         outs = {
             "x-values-missing-percentage": processor.processed.xdf_nan_score,
             "y-values-missing-percentage": processor.processed.ydf_nan_score,
         }
+        if processor.processed.glitches_df is not None:
+            outs["glitches"] = processor.processed.glitches_df
 
-        with pd.ExcelWriter(output_path, engine="xlsxwriter") as writer:
+        with (
+            self.atomic_output_path(processor, ext="xlsx", name="general") as output_path,
+            pd.ExcelWriter(output_path, engine="xlsxwriter") as writer,
+        ):
             for sheet_name, df in outs.items():
                 LOGGER.debug(f"trying to add {sheet_name=}")
                 try:
@@ -26,14 +29,16 @@ class ExportGeneralDfsToExcel(BaseExporter):
 
 class ExportAggsDictsToExcel(BaseExporter):
     def export(self, processor):
-        output_path = self.get_output_full_path(
-            processor, ext="xlsx", name="aggs"
-        )
         outs = {
             "aggs-peaks-timestamp": processor.processed.aggs_peaks_timestamps_dict,
             "aggs-pulse-rate": processor.processed.aggs_rhythms_dict,
         }
-        with xlsxwriter.Workbook(output_path) as workbook:
+        import xlsxwriter  # only needed with --gen-csv
+
+        with (
+            self.atomic_output_path(processor, ext="xlsx", name="aggs") as output_path,
+            xlsxwriter.Workbook(output_path) as workbook,
+        ):
             # save dicts
             for sheet_name, data in outs.items():
                 LOGGER.debug(f"trying to add {sheet_name=}")
@@ -57,6 +62,8 @@ class ExportAggsDictsToExcel(BaseExporter):
 
 
 class ExportByTentacleToExcel(BaseExporter):
+    COSTLY = True
+
     def export(self, processor):
         time_axis = {
             "time axis (secs)": pd.Series(processor.processed.time_axis),
@@ -66,10 +73,10 @@ class ExportByTentacleToExcel(BaseExporter):
         self._export_peaks(processor, time_axis)
 
     def _export_dists(self, processor, time_axis: dict):
-        output_path = self.get_output_full_path(
-            processor, ext="xlsx", name="by-tentacle-dist"
-        )
-        with pd.ExcelWriter(output_path, engine="xlsxwriter") as writer:
+        with (
+            self.atomic_output_path(processor, ext="xlsx", name="by-tentacle-dist") as output_path,
+            pd.ExcelWriter(output_path, engine="xlsxwriter") as writer,
+        ):
             writer_helper = PandasExcelUtils(writer)
 
             # sheet for dist agg
@@ -83,6 +90,16 @@ class ExportByTentacleToExcel(BaseExporter):
             })
             writer_helper.to_excel(data=df, sheet_name=sheet_name)
 
+            # sheet for node to node distances, if requested
+            pair_dists_df = processor.processed.pair_dists_df
+            if pair_dists_df is not None:
+                sheet_name = "node-pairs"
+                df = pd.DataFrame({
+                    **time_axis,
+                    **{col: pair_dists_df[col] for col in pair_dists_df.columns},
+                })
+                writer_helper.to_excel(data=df, sheet_name=sheet_name)
+
             # sheet per tentacle
             for tentacle in processor.processed.dists_df.columns:
                 sheet_name = tentacle
@@ -118,10 +135,10 @@ class ExportByTentacleToExcel(BaseExporter):
         return data
 
     def _export_peaks(self, processor, time_axis: dict):
-        output_path = self.get_output_full_path(
-            processor, ext="xlsx", name="by-tentacle-peaks"
-        )
-        with pd.ExcelWriter(output_path, engine="xlsxwriter") as writer:
+        with (
+            self.atomic_output_path(processor, ext="xlsx", name="by-tentacle-peaks") as output_path,
+            pd.ExcelWriter(output_path, engine="xlsxwriter") as writer,
+        ):
             writer_helper = PandasExcelUtils(writer)
 
             # sheet for peaks agg
@@ -130,13 +147,24 @@ class ExportByTentacleToExcel(BaseExporter):
                 **self._gen_peaks_agg_sheet_data(processor),
             }), sheet_name=sheet_name)
 
+            # sheet for the pulse rates of all tentacles and aggs on a uniform grid
+            sheet_name = "pulse-rate-grid (hz)"
+            grid_df = pd.concat(
+                [processor.processed.aggs_rhythms_grid_df, processor.processed.rhythms_grid_df],
+                axis=1,
+            )
+            grid_df.insert(0, "time (mins)", grid_df.index / 60)
+            grid_df.index.name = "time (secs)"
+            writer_helper.to_excel(data=grid_df, sheet_name=sheet_name)
+
             # sheet per tentacle
             for tentacle in processor.processed.peaks_timestamps_dict:
                 sheet_name = tentacle
+                peaks = processor.processed.peaks_timestamps_dict[tentacle]
                 df = pd.DataFrame({
-                    "peaks timestamp (secs)": pd.Series(processor.processed.peaks_timestamps_dict[tentacle]),
-                    "peaks (mins)": pd.Series(processor.processed.peaks_timestamps_dict[tentacle])/60,
-                    "pulse rate (hz)": pd.Series(processor.processed.rhythms_dict[tentacle]),
+                    "peaks timestamp (secs)": peaks,
+                    "peaks (mins)": peaks / 60,
+                    "pulse rate (hz)": processor.processed.rhythms_dict[tentacle],
                 })
 
                 LOGGER.debug(f"trying to add {sheet_name=}")
@@ -2,19 +2,6 @@ import logging
 
 from .shared import BaseExporter
 
-from .dist_exporters import (
-    ExportInteractivePlot,
-)
-
-from .peak_exporters import (
-    ExportRhythmsMultiPlot,
-    ExportRhythmVsDistMultiPlot
-)
-
-from .excel_exporters import (
-    ExportByTentacleToExcel,
-)
-
 from logger import getLogger, log_runtime
 
 
@@ -22,19 +9,56 @@ LOGGER = getLogger(__name__)
 
 
 class SingleH5Exporter(BaseExporter):
-    def export(self, processor):
+    def export(self, processor, checkpoint_name=None):
+        # imported here, plotly (and xlsxwriter) are slow to import and only needed once exporting
+        from .dist_exporters import ExportInteractivePlot, ExportDistsPyramid
+        from .peak_exporters import (
+            ExportRhythmsMultiPlot,
+            ExportRhythmVsDistMultiPlot,
+            ExportRhythmEstimatorsMultiPlot,
+            ExportPeakWaveformsPlot,
+            ExportPeaksArrays,
+        )
+        from .synchrony_exporters import ExportSynchronyPlot
+        from .kinematics_exporters import ExportKinematicsPlot
+
         exporters = [
             lambda: ExportInteractivePlot(self.output_manager),
             lambda: ExportRhythmsMultiPlot(self.output_manager),
             lambda: ExportRhythmVsDistMultiPlot(self.output_manager),
+            lambda: ExportSynchronyPlot(self.output_manager) if processor.synchrony else None,
+            lambda: ExportRhythmEstimatorsMultiPlot(self.output_manager) if processor.spectral else None,
+            lambda: ExportPeakWaveformsPlot(self.output_manager) if processor.waveforms else None,
+            lambda: ExportPeaksArrays(self.output_manager),
+            lambda: ExportKinematicsPlot(self.output_manager) if processor.kinematics else None,
+            lambda: ExportDistsPyramid(self.output_manager) if self.output_manager.pyramids else None,
         ]
         if self.gen_csv:
+            from .excel_exporters import ExportByTentacleToExcel
+
             exporters.extend([
                 lambda: ExportByTentacleToExcel(self.output_manager),
             ])
+        if processor.masking or processor.glitch_z is not None or processor.low_quality:
+            # the missing / masked points percentages and glitch counts, the only place they're saved (and
+            # to see why the rest was skipped), small enough to not wait for --gen-csv
+            from .excel_exporters import ExportGeneralDfsToExcel
+
+            exporters.append(lambda: ExportGeneralDfsToExcel(self.output_manager))
+        checkpoints = self.output_manager.checkpoints if checkpoint_name else None
         for i, exporter_getter in enumerate(exporters):
             exporter = exporter_getter()
             if not exporter:
                 continue
+            step = f"export-{type(exporter).__name__}"
+            if exporter.COSTLY and processor.low_quality:
+                LOGGER.info(f"skipping {type(exporter).__name__}, too few usable points in {processor.shortname}")
+                continue
+            if checkpoints and checkpoints.is_done(checkpoint_name, step):
+                LOGGER.debug(f"exporter[{i}] already done, skipping")
+                continue
+            # an unfinished exporter is simply rerun, its artifacts are rewritten from scratch
             exporter.export(processor)
+            if checkpoints:
+                checkpoints.mark_done(checkpoint_name, step)
             LOGGER.debug(f"exporter[{i}] done")
@@ -0,0 +1,82 @@
+import pandas as pd
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+from logger import getLogger
+from .shared import BaseExporter
+from .excel_exporters import PandasExcelUtils
+
+LOGGER = getLogger(__name__)
+
+
+class ExportKinematicsPlot(BaseExporter):
+    COSTLY = True
+    EXT = "kinematics"
+    MAIN_TITLE = "Skeleton Kinematics over Time"
+    X_AXIS_TITLE = "Time [min]"
+    BIN_SECS = 1  # the series are plotted as per bin means, all frames of a dozen series are too heavy for the html
+    # field -> (subplot and sheet title, y axis title)
+    SERIES = {
+        "segment_lengths_df": ("Segment length", "Length [pixels]"),
+        "bend_angles_df": ("Bend angle", "Angle [deg]"),
+        "node_speed_df": ("Node speed", "Speed [pixels/sec]"),
+        "node_accel_df": ("Node acceleration", "Acceleration [pixels/sec²]"),
+    }
+
+    def _graph_title(self, processor):
+        return f"{self.MAIN_TITLE} ({processor.substance} {processor.concentration} {processor.concentration_unit})"
+
+    def _binned(self, processor):
+        # frame columns are 1.. (frame 0 is dropped), binned on the time axis
+        binned = {}
+        for field, (title, _) in self.SERIES.items():
+            df: pd.DataFrame = getattr(processor.processed, field)
+            if df is None or df.shape[1] == 0:
+                continue
+            bins = (df.index.to_numpy() - 1) // (processor.framerate * self.BIN_SECS)
+            binned[title] = df.groupby(bins).mean().rename_axis(f"time ({self.BIN_SECS} sec bins)")
+        return binned
+
+    def export(self, processor):
+        binned = self._binned(processor)
+        if not binned:
+            LOGGER.warning(f"no kinematics for {processor.shortname}, the file has no edges?")
+            return
+
+        y_titles = {title: y_title for title, y_title in self.SERIES.values()}
+        fig = make_subplots(rows=len(binned), cols=1, subplot_titles=list(binned), shared_xaxes=True)
+        for i, (title, df) in enumerate(binned.items()):
+            xaxis = df.index * self.BIN_SECS / 60  # convert to minutes
+            for col in df.columns:
+                fig.add_trace(go.Scatter(y=df[col], x=xaxis, name=col, legendgroup=title), row=i + 1, col=1)
+            fig.update_yaxes(title_text=y_titles[title], row=i + 1, col=1)
+        fig.update_xaxes(title_text=self.X_AXIS_TITLE, row=len(binned), col=1)
+        fig.update_layout(
+            **self.base_fig_layout(),
+            title=dict(
+                text=self._graph_title(processor),
+                subtitle=dict(text=f"means of {self.BIN_SECS} sec bins"),
+            ),
+            height=350 * len(binned),
+        )
+
+        if self.show_plot:
+            fig.show()
+        self.save_fig(processor, fig, node_name=self.EXT)
+
+        if self.gen_csv:
+            self._export_excel(processor, binned)
+
+    def _export_excel(self, processor, binned: dict):
+        with (
+            self.atomic_output_path(processor, ext="xlsx", name=self.EXT) as output_path,
+            pd.ExcelWriter(output_path, engine="xlsxwriter") as writer,
+        ):
+            writer_helper = PandasExcelUtils(writer)
+            for title, df in binned.items():
+                sheet_name = title.lower().replace(" ", "-")
+                LOGGER.debug(f"trying to add {sheet_name=}")
+                try:
+                    writer_helper.to_excel(data=df, sheet_name=sheet_name)
+                except Exception:
+                    LOGGER.error(f"failed to add {sheet_name=}", exc_info=True)
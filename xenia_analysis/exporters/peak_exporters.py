@@ -3,8 +3,12 @@ import numpy as np
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 from logger import getLogger
+from analysis.ragged import Ragged
+from analysis.conditions import META_PREFIX
 
 from .shared import BaseExporter
+from .templates import figure_template
+from .excel_exporters import PandasExcelUtils
 
 LOGGER = getLogger(__name__)
 
@@ -22,21 +26,11 @@ class ExportRhythmsMultiPlot(BaseExporter):
     def _graph_title(self, processor):
         return f"{self.MAIN_TITLE} ({processor.substance} {processor.concentration} {processor.concentration_unit})"
 
-    def export(self, processor):
-        xdata: dict = processor.processed.peaks_timestamps_dict
-        ydata: dict = processor.processed.rhythms_dict
-        name = to_ext_name(self.MAIN_TITLE)
-
-        fig = make_subplots(rows=4, cols=2, subplot_titles=list(xdata))
-        for i, col in enumerate(xdata):
+    def _build_template(self, titles: list):
+        fig = make_subplots(rows=4, cols=2, subplot_titles=titles)
+        for i in range(len(titles)):
             row_i = 1 + (i // 2)
             col_i = 1 + (i % 2)
-
-            xaxis = pd.Series(xdata[col][:]) / 60  # convert to minutes
-            yaxis = pd.Series(ydata[col])
-            fig.add_trace(go.Scatter(y=yaxis, x=xaxis), row=row_i, col=col_i)
-            LOGGER.debug(f"placing plot of {col=} in ({row_i}, {col_i})")
-
             next(fig.select_yaxes(row=row_i, col=col_i)).update(
                 title=dict(text=self.Y_AXIS_TITLE, font=dict(size=self.AXIS_FONT_SIZE)),
                 matches="y",
@@ -45,14 +39,33 @@ class ExportRhythmsMultiPlot(BaseExporter):
                 title=dict(text=self.X_AXIS_TITLE, font=dict(size=self.AXIS_FONT_SIZE)),
                 matches="x",
             )
-        fig.update_layout(title_text=self._graph_title(processor), showlegend=False)
+        return fig
 
-        if self.show_plot:
-            fig.show()
-        self.save_fig(processor, fig, node_name=f"{name}.multi-plot")
+    def export(self, processor):
+        xdata: dict = processor.processed.peaks_timestamps_dict
+        ydata: dict = processor.processed.rhythms_dict
+        name = to_ext_name(self.MAIN_TITLE)
+
+        titles = list(xdata)
+        with figure_template((type(self).__name__, *titles), lambda: self._build_template(titles)) as fig:
+            for i, col in enumerate(xdata):
+                row_i = 1 + (i // 2)
+                col_i = 1 + (i % 2)
+
+                xaxis = pd.Series(xdata[col][:]) / 60  # convert to minutes
+                yaxis = pd.Series(ydata[col])
+                fig.add_trace(go.Scatter(y=yaxis, x=xaxis), row=row_i, col=col_i)
+                LOGGER.debug("placing plot of col=%r in (%d, %d)", col, row_i, col_i)
+
+            fig.update_layout(title_text=self._graph_title(processor), showlegend=False)
+
+            if self.show_plot:
+                fig.show()
+            self.save_fig(processor, fig, node_name=f"{name}.multi-plot")
 
 
 class ExportRhythmVsDistMultiPlot(BaseExporter):
+    COSTLY = True
     MAIN_TITLE = "Distance and Rhythm over Time per Tentacle"
     X_TITLE = "Time [min]"
 
@@ -64,14 +77,36 @@ class ExportRhythmVsDistMultiPlot(BaseExporter):
 
     AXIS_FONT_SIZE = 12
 
+    def _build_template(self, titles: list, num_cols: int, num_rhythms: int):
+        fig = make_subplots(rows=2, cols=num_cols, subplot_titles=titles)
+        for row, n, y_title in [
+            (1, num_cols, self.TOP_Y_TITLE),
+            (2, num_rhythms, self.BOTTOM_Y_TITLE),
+        ]:
+            for col_i in range(1, n + 1):
+                next(fig.select_yaxes(row=row, col=col_i)).update(
+                    title=dict(text=y_title, font=dict(size=self.AXIS_FONT_SIZE)),
+                    matches="y",
+                )
+                next(fig.select_xaxes(row=row, col=col_i)).update(
+                    title=dict(text=self.X_TITLE, font=dict(size=self.AXIS_FONT_SIZE)),
+                    matches="x",
+                )
+        fig.update_layout(
+            showlegend=False,
+            height=1000,
+            width=1000 * num_cols,
+        )
+        return fig
+
     def _export(
         self,
         processor,
         name: str,
         dist_x: np.ndarray,
         dist_y: pd.DataFrame,
-        rhythm_x: dict,
-        rhythm_y: dict,
+        rhythm_x: Ragged,
+        rhythm_y: Ragged,
     ):
         num_cols = len(dist_y.columns)
         name = to_ext_name(f"{self.MAIN_TITLE} ({name})")
@@ -83,54 +118,29 @@ class ExportRhythmVsDistMultiPlot(BaseExporter):
             start=[],
         )
 
-        fig = make_subplots(rows=2, cols=num_cols, subplot_titles=titles)
+        with figure_template(
+            (type(self).__name__, num_cols, len(rhythm_x), *titles),
+            lambda: self._build_template(titles, num_cols, len(rhythm_x)),
+        ) as fig:
+            # dist data in first row
+            row = 1
+            for c, col in enumerate(dist_y.columns):
+                col_i = c + 1
+                fig.add_trace(go.Scatter(y=dist_y[col], x=dist_x), row=row, col=col_i)
+                LOGGER.debug("placing plot of col=%r in (%d, %d)", col, row, col_i)
 
-        # dist data in first row
-        row = 1
-        for c, col in enumerate(dist_y.columns):
-            col_i = c + 1
-            fig.add_trace(go.Scatter(y=dist_y[col], x=dist_x), row=row, col=col_i)
-            LOGGER.debug(f"placing plot of {col=} in ({row}, {col_i})")
+            # rhythm data in second row
+            row = 2
+            for c, col in enumerate(rhythm_x):
+                col_i = c + 1
 
-            next(fig.select_yaxes(row=row, col=col_i)).update(
-                title=dict(text=self.TOP_Y_TITLE, font=dict(size=self.AXIS_FONT_SIZE)),
-                matches="y",
-            )
-            next(fig.select_xaxes(row=row, col=col_i)).update(
-                title=dict(text=self.X_TITLE, font=dict(size=self.AXIS_FONT_SIZE)),
-                matches="x",
-            )
+                xaxis = rhythm_x[col] / 60  # convert to minutes
+                fig.add_trace(go.Scatter(y=rhythm_y[col], x=xaxis), row=row, col=col_i)
+                LOGGER.debug("placing plot of col=%r in (%d, %d)", col, row, col_i)
 
-        # rhythm data in second row
-        row = 2
-        for c, col in enumerate(rhythm_x):
-            col_i = c + 1
-
-            xaxis = pd.Series(rhythm_x[col][:]) / 60  # convert to minutes
-            yaxis = pd.Series(rhythm_y[col])
-            fig.add_trace(go.Scatter(y=yaxis, x=xaxis), row=row, col=col_i)
-            LOGGER.debug(f"placing plot of {col=} in ({row}, {col_i})")
-
-            next(fig.select_yaxes(row=row, col=col_i)).update(
-                title=dict(
-                    text=self.BOTTOM_Y_TITLE, font=dict(size=self.AXIS_FONT_SIZE)
-                ),
-                matches="y",
-            )
-            next(fig.select_xaxes(row=row, col=col_i)).update(
-                title=dict(text=self.X_TITLE, font=dict(size=self.AXIS_FONT_SIZE)),
-                matches="x",
-            )
-
-        fig.update_layout(
-            showlegend=False,
-            height=1000,
-            width=1000 * num_cols,
-        )
-
-        if self.show_plot:
-            fig.show()
-        self.save_fig(processor, fig, node_name=f"{name}.multi-plot")
+            if self.show_plot:
+                fig.show()
+            self.save_fig(processor, fig, node_name=f"{name}.multi-plot")
 
     def export(self, processor):
         time_axis = processor.processed.time_axis[:] / 60  # convert to minutes
@@ -152,3 +162,213 @@ class ExportRhythmVsDistMultiPlot(BaseExporter):
             rhythm_x=processor.processed.aggs_peaks_timestamps_dict,
             rhythm_y=processor.processed.aggs_rhythms_dict,
         )
+
+
+class ExportPeaksArrays(BaseExporter):
+    """The peaks and pulse rates of the tentacles and aggs as raggeds, in one npz.
+
+    read back with Ragged.from_arrays(np.load(path), prefix) for every one of
+    PREFIXES, e.g. to concat the peaks of many files. the file's condition is
+    under meta.*, for the run level comparison (analysis.conditions).
+    """
+
+    EXT = "peaks"
+    PREFIXES = {
+        "peaks": "peaks_timestamps_dict",
+        "rhythms": "rhythms_dict",
+        "aggs-peaks": "aggs_peaks_timestamps_dict",
+        "aggs-rhythms": "aggs_rhythms_dict",
+    }
+
+    def export(self, processor):
+        arrays = {}
+        for prefix, field in self.PREFIXES.items():
+            arrays.update(getattr(processor.processed, field).to_arrays(prefix))
+        arrays.update({
+            f"{META_PREFIX}.substance": np.asarray(processor.substance),
+            f"{META_PREFIX}.concentration": np.asarray(processor.concentration),
+            f"{META_PREFIX}.concentration_unit": np.asarray(processor.concentration_unit),
+            f"{META_PREFIX}.ctrl_secs": np.asarray(processor.max_ctrl_frame / processor.framerate),
+        })
+        with self.atomic_output_path(processor, ext="npz", name=self.EXT) as output_path:
+            np.savez(output_path, **arrays)
+
+
+class ExportRhythmEstimatorsMultiPlot(BaseExporter):
+    COSTLY = True
+    MAIN_TITLE = "Rhythm Estimators over Time"
+    Y_AXIS_TITLE = "Pulse [Hz]"
+    X_AXIS_TITLE = "Time [min]"
+    PEAKS_NAME = "peaks"
+    SPECTRAL_NAME = "spectral"
+    AXIS_FONT_SIZE = 12
+
+    def _graph_title(self, processor):
+        return f"{self.MAIN_TITLE} ({processor.substance} {processor.concentration} {processor.concentration_unit})"
+
+    @staticmethod
+    def _peaks_per_window(grid_df: pd.DataFrame, times: np.ndarray, window_secs: float):
+        # mean of the peak based grid rates inside each spectral window, nan aware
+        grid = grid_df.index.to_numpy()
+        lo = np.searchsorted(grid, times - window_secs / 2, side="left")
+        hi = np.searchsorted(grid, times + window_secs / 2, side="left")
+        vals = grid_df.to_numpy()
+        zeros = np.zeros((1, vals.shape[1]))
+        sums = np.concatenate([zeros, np.cumsum(np.nan_to_num(vals), axis=0)])
+        counts = np.concatenate([zeros, np.cumsum(~np.isnan(vals), axis=0)])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            means = (sums[hi] - sums[lo]) / (counts[hi] - counts[lo])
+        return pd.DataFrame(means, index=times, columns=grid_df.columns)
+
+    def _estimators(self, processor):
+        spectral = pd.concat(
+            [processor.processed.spectral_rhythms_df, processor.processed.aggs_spectral_rhythms_df],
+            axis=1,
+        )
+        grid = pd.concat(
+            [processor.processed.rhythms_grid_df, processor.processed.aggs_rhythms_grid_df],
+            axis=1,
+        )
+        peaks = self._peaks_per_window(grid, spectral.index.to_numpy(), processor.spectral_window_secs)
+        return peaks, spectral
+
+    def export(self, processor):
+        peaks, spectral = self._estimators(processor)
+        name = to_ext_name(self.MAIN_TITLE)
+        xaxis = spectral.index / 60  # convert to minutes
+
+        cols = 2
+        rows = max(1, -(-len(spectral.columns) // cols))
+        fig = make_subplots(rows=rows, cols=cols, subplot_titles=list(spectral.columns))
+        for i, col in enumerate(spectral.columns):
+            row_i = 1 + (i // cols)
+            col_i = 1 + (i % cols)
+            for trace_name, df in {self.PEAKS_NAME: peaks, self.SPECTRAL_NAME: spectral}.items():
+                fig.add_trace(
+                    go.Scatter(
+                        y=df[col], x=xaxis, name=trace_name, legendgroup=trace_name,
+                        showlegend=i == 0,
+                    ),
+                    row=row_i, col=col_i,
+                )
+            LOGGER.debug("placing plot of col=%r in (%d, %d)", col, row_i, col_i)
+
+            next(fig.select_yaxes(row=row_i, col=col_i)).update(
+                title=dict(text=self.Y_AXIS_TITLE, font=dict(size=self.AXIS_FONT_SIZE)),
+                matches="y",
+            )
+            next(fig.select_xaxes(row=row_i, col=col_i)).update(
+                title=dict(text=self.X_AXIS_TITLE, font=dict(size=self.AXIS_FONT_SIZE)),
+                matches="x",
+            )
+        fig.update_layout(
+            **self.base_fig_layout(),
+            title_text=self._graph_title(processor),
+            height=300 * rows,
+        )
+
+        if self.show_plot:
+            fig.show()
+        self.save_fig(processor, fig, node_name=f"{name}.multi-plot")
+
+        if self.gen_csv:
+            self._export_excel(processor, name, peaks, spectral)
+
+    def _export_excel(self, processor, name, peaks: pd.DataFrame, spectral: pd.DataFrame):
+        df = pd.DataFrame({
+            "window center (mins)": spectral.index / 60,
+            **{
+                f"{col} {estimator} (hz)": estimates[col]
+                for col in spectral.columns
+                for estimator, estimates in {self.PEAKS_NAME: peaks, self.SPECTRAL_NAME: spectral}.items()
+            },
+        }).rename_axis("window center (secs)")
+        with (
+            self.atomic_output_path(processor, ext="xlsx", name=name) as output_path,
+            pd.ExcelWriter(output_path, engine="xlsxwriter") as writer,
+        ):
+            PandasExcelUtils(writer).to_excel(data=df, sheet_name="pulse-rate")
+
+
+class ExportPeakWaveformsPlot(BaseExporter):
+    MAIN_TITLE = "Peak Aligned Waveforms"
+    Y_AXIS_TITLE = "Normalized distance"
+    X_AXIS_TITLE = "Time from peak [sec]"
+    AXIS_FONT_SIZE = 12
+    BAND_OPACITY = 0.2
+
+    def _graph_title(self, processor):
+        return f"{self.MAIN_TITLE} ({processor.substance} {processor.concentration} {processor.concentration_unit})"
+
+    def _waveforms(self, processor):
+        # (stat, tentacle/agg) columns of both, the aggs after the tentacles
+        return pd.concat(
+            [processor.processed.peak_waveforms_df, processor.processed.aggs_peak_waveforms_df],
+            axis=1,
+        )
+
+    def export(self, processor):
+        if processor.processed.peak_waveforms_df is None:
+            return
+        df = self._waveforms(processor)
+        mean, sem, n = df["mean"], df["sem"], df["n"]
+        name = to_ext_name(self.MAIN_TITLE)
+        lags = df.index.to_numpy()
+
+        cols = 2
+        rows = max(1, -(-len(mean.columns) // cols))
+        titles = [f"{col} ({int(n[col].max())} peaks)" for col in mean.columns]
+        fig = make_subplots(rows=rows, cols=cols, subplot_titles=titles)
+        for i, col in enumerate(mean.columns):
+            row_i = 1 + (i // cols)
+            col_i = 1 + (i % cols)
+            upper, lower = mean[col] + sem[col], mean[col] - sem[col]
+            # sem band, as a closed shape: the upper edge and back along the lower one
+            fig.add_trace(
+                go.Scatter(
+                    x=np.concatenate([lags, lags[::-1]]),
+                    y=np.concatenate([upper.to_numpy(), lower.to_numpy()[::-1]]),
+                    fill="toself", opacity=self.BAND_OPACITY, line=dict(width=0),
+                    hoverinfo="skip", name="sem", legendgroup="sem", showlegend=i == 0,
+                ),
+                row=row_i, col=col_i,
+            )
+            fig.add_trace(
+                go.Scatter(x=lags, y=mean[col], name="mean", legendgroup="mean", showlegend=i == 0),
+                row=row_i, col=col_i,
+            )
+            LOGGER.debug("placing plot of col=%r in (%d, %d)", col, row_i, col_i)
+
+            next(fig.select_yaxes(row=row_i, col=col_i)).update(
+                title=dict(text=self.Y_AXIS_TITLE, font=dict(size=self.AXIS_FONT_SIZE)),
+            )
+            next(fig.select_xaxes(row=row_i, col=col_i)).update(
+                title=dict(text=self.X_AXIS_TITLE, font=dict(size=self.AXIS_FONT_SIZE)),
+                matches="x",
+            )
+        fig.update_layout(
+            **self.base_fig_layout(),
+            title_text=self._graph_title(processor),
+            height=300 * rows,
+        )
+
+        if self.show_plot:
+            fig.show()
+        self.save_fig(processor, fig, node_name=f"{name}.multi-plot")
+
+        if self.gen_csv:
+            self._export_excel(processor, name, df)
+
+    def _export_excel(self, processor, name, df: pd.DataFrame):
+        with (
+            self.atomic_output_path(processor, ext="xlsx", name=name) as output_path,
+            pd.ExcelWriter(output_path, engine="xlsxwriter") as writer,
+        ):
+            writer_helper = PandasExcelUtils(writer)
+            for stat in df.columns.unique(level="stat"):
+                sheet_name = f"waveform-{stat}"
+                LOGGER.debug(f"trying to add {sheet_name=}")
+                try:
+                    writer_helper.to_excel(data=df[stat], sheet_name=sheet_name)
+                except Exception:
+                    LOGGER.error(f"failed to add {sheet_name=}", exc_info=True)
@@ -1,4 +1,5 @@
 from logger import getLogger
+from xenio import atomic_output
 
 LOGGER = getLogger(__name__)
 
@@ -18,6 +19,8 @@ class Extensions:
         }
 
 class BaseExporter:
+    COSTLY = False  # skipped for files with too few usable points (H5Processor.low_quality)
+
     def __init__(self, output_manager):
         self.output_manager = output_manager
         self.gen_csv = output_manager.gen_csv
@@ -31,6 +34,10 @@ class BaseExporter:
         name = f"{processor.shortname}.{name}" if len(name) > 0 else processor.shortname
         return self.output_manager.get_output_full_path(f"{name}.{ext}")
 
+    def atomic_output_path(self, processor, ext, name=""):
+        # write to the yielded temp path, it's renamed to the output path once done
+        return atomic_output(self.get_output_full_path(processor, ext=ext, name=name))
+
     def base_fig_layout(self):
         return dict(
             legend_title_text=None,
@@ -44,6 +51,7 @@ class BaseExporter:
                 continue
             LOGGER.debug(f"trying to export to {ext=}")
             try:
-                exporter(self.get_output_full_path(processor, name=node_name, ext=ext))
+                with atomic_output(self.get_output_full_path(processor, name=node_name, ext=ext)) as tmp_path:
+                    exporter(tmp_path)
             except Exception:
                 LOGGER.error(f"export failed for {ext=}", exc_info=True)
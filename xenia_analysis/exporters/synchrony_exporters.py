@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+from logger import getLogger
+from .shared import BaseExporter
+from .excel_exporters import PandasExcelUtils
+
+LOGGER = getLogger(__name__)
+
+
+class ExportSynchronyPlot(BaseExporter):
+    COSTLY = True
+    EXT = "synchrony"
+    MAIN_TITLE = "Tentacles Synchrony over Time"
+    X_AXIS_TITLE = "Time [min]"
+    INDEX_Y_TITLE = "Synchrony index"
+    PAIRS_Y_TITLE = "Tentacle pair"
+    MATRIX_TITLE = "Mean phase locking"
+
+    def _graph_title(self, processor):
+        return f"{self.MAIN_TITLE} ({processor.substance} {processor.concentration} {processor.concentration_unit})"
+
+    def export(self, processor):
+        index_df: pd.DataFrame = processor.processed.sync_index_df
+        plv_df: pd.DataFrame = processor.processed.sync_plv_df
+        if index_df is None or len(index_df) == 0:
+            LOGGER.warning(f"no synchrony windows for {processor.shortname}, recording too short?")
+            return
+
+        xaxis = index_df.index / 60  # convert to minutes
+        fig = make_subplots(
+            rows=2, cols=2,
+            column_widths=[0.75, 0.25],
+            specs=[[{"colspan": 2}, None], [{}, {}]],
+            subplot_titles=[self.INDEX_Y_TITLE, "Phase locking per pair", self.MATRIX_TITLE],
+            vertical_spacing=0.12,
+        )
+        for col in index_df.columns:
+            fig.add_trace(go.Scatter(y=index_df[col], x=xaxis, name=col), row=1, col=1)
+        fig.add_trace(
+            go.Heatmap(z=plv_df.T.to_numpy(), x=xaxis, y=list(plv_df.columns), zmin=0, zmax=1),
+            row=2, col=1,
+        )
+        matrix = self._mean_matrix(plv_df)
+        fig.add_trace(
+            go.Heatmap(
+                z=matrix.to_numpy(), x=list(matrix.columns), y=list(matrix.index),
+                zmin=0, zmax=1, showscale=False,
+            ),
+            row=2, col=2,
+        )
+
+        fig.update_yaxes(title_text=self.INDEX_Y_TITLE, range=[0, 1], row=1, col=1)
+        fig.update_yaxes(title_text=self.PAIRS_Y_TITLE, row=2, col=1)
+        fig.update_xaxes(title_text=self.X_AXIS_TITLE, row=1, col=1)
+        fig.update_xaxes(title_text=self.X_AXIS_TITLE, matches="x", row=2, col=1)
+        fig.update_layout(
+            **self.base_fig_layout(),
+            title_text=self._graph_title(processor),
+            height=1000,
+        )
+
+        if self.show_plot:
+            fig.show()
+        self.save_fig(processor, fig, node_name=self.EXT)
+
+        if self.gen_csv:
+            self._export_excel(processor)
+
+    @staticmethod
+    def _mean_matrix(pairs_df: pd.DataFrame):
+        # pairs columns ("a:b") to a symmetric node x node matrix of the mean over time
+        pairs = [col.split(":") for col in pairs_df.columns]
+        nodes = list(dict.fromkeys(sum(pairs, start=[])))
+        matrix = pd.DataFrame(np.eye(len(nodes)), index=nodes, columns=nodes)
+        for (a, b), val in zip(pairs, pairs_df.mean().to_numpy()):
+            matrix.loc[a, b] = matrix.loc[b, a] = val
+        return matrix
+
+    def _export_excel(self, processor):
+        windows = {
+            "synchrony-index": processor.processed.sync_index_df,
+            "phase-locking": processor.processed.sync_plv_df,
+            "coherence": processor.processed.sync_coherence_df,
+        }
+        outs = {
+            **{name: df.rename_axis("window center (secs)") for name, df in windows.items()},
+            "mean-phase-locking-matrix": self._mean_matrix(processor.processed.sync_plv_df),
+            "mean-coherence-matrix": self._mean_matrix(processor.processed.sync_coherence_df),
+        }
+        with (
+            self.atomic_output_path(processor, ext="xlsx", name=self.EXT) as output_path,
+            pd.ExcelWriter(output_path, engine="xlsxwriter") as writer,
+        ):
+            writer_helper = PandasExcelUtils(writer)
+            for sheet_name, df in outs.items():
+                LOGGER.debug(f"trying to add {sheet_name=}")
+                try:
+                    writer_helper.to_excel(data=df, sheet_name=sheet_name)
+                except Exception:
+                    LOGGER.error(f"failed to add {sheet_name=}", exc_info=True)
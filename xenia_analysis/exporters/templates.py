@@ -0,0 +1,32 @@
+from contextlib import contextmanager
+
+from logger import getLogger
+
+LOGGER = getLogger(__name__)
+
+
+# (exporter, subplot titles..) -> figure with the subplots grid and axes set up
+_TEMPLATES = {}
+
+
+@contextmanager
+def figure_template(key: tuple, build):
+    """Yields the figure `build()` makes for `key`, built once, emptied of its traces on exit.
+
+    make_subplots and the per subplot axes setup only depend on the exporter and
+    the node names, so the figure is reused for every file with only the traces
+    (and the per file titles) replaced. copying a figure instead would reorder
+    its layout, and the html wouldn't be the same. the traces are dropped when
+    the block exits, so a cached template doesn't keep the last file's data
+    alive. a template is used by one export at a time (exporters run
+    sequentially within a process).
+    """
+    fig = _TEMPLATES.get(key)
+    if fig is None:
+        LOGGER.debug(f"building figure template {key[0]}")
+        fig = _TEMPLATES[key] = build()
+    fig.data = []
+    try:
+        yield fig
+    finally:
+        fig.data = []
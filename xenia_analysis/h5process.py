@@ -1,16 +1,25 @@
+import os
 import re
 import logging
+import threading
 from pathlib import Path
+from collections import OrderedDict
 from dataclasses import dataclass
 
-import h5py
 import pandas as pd
 import numpy as np
-from scipy import signal as sig
 
 from logger import getLogger
-
-pd.options.plotting.backend = "plotly"
+from analysis.gapfill import FillMethod, fill_gaps
+from analysis.distances import reference_distances, all_node_pairs, pair_distances
+from analysis.rhythm import rhythm_grid, instantaneous_rates
+from analysis.synchrony import synchrony
+from analysis.spectral import spectral_rhythm
+from analysis.confidence import low_confidence, mask_points
+from analysis.glitches import mask_glitches
+from analysis.waveforms import peak_waveforms
+from analysis.kinematics import segment_lengths, edge_joints, bend_angles, node_derivatives
+from analysis.ragged import Ragged
 
 LOGGER = getLogger(__name__)
 
@@ -18,6 +27,9 @@ LOGGER = getLogger(__name__)
 class H5Keys:
     TRACKS = "tracks"
     NODES = "node_names"
+    POINT_SCORES = "point_scores"
+    INSTANCE_SCORES = "instance_scores"
+    EDGES = "edge_inds"
 
 
 class TentacleH5DataKeys:
@@ -26,6 +38,17 @@ class TentacleH5DataKeys:
     VARIANCE = "Variance"
 
 
+class WaveformKeys:
+    MEAN = "mean"
+    SEM = "sem"
+    N = "n"
+
+
+class SyncKeys:
+    PLV = "Phase Locking"
+    COHERENCE = "Coherence"
+
+
 @dataclass
 class TentacleH5DataFrames:
     # data
@@ -39,16 +62,46 @@ class TentacleH5DataFrames:
     dists_sum_aggs: pd.DataFrame
 
     time_axis: np.ndarray
-    peaks_timestamps_dict: dict[str, np.ndarray]
-    rhythms_dict: dict[str, np.ndarray]
+    # tentacle -> peaks (secs) / pulse rate at each peak, the rates share the peaks' offsets
+    peaks_timestamps_dict: Ragged
+    rhythms_dict: Ragged
 
-    aggs_peaks_timestamps_dict: dict[str, np.ndarray]
-    aggs_rhythms_dict: dict[str, np.ndarray]
+    aggs_peaks_timestamps_dict: Ragged
+    aggs_rhythms_dict: Ragged
 
     # metadata
     xdf_nan_score: pd.DataFrame
     ydf_nan_score: pd.DataFrame
 
+    # per node count and percent of frames of the masked tracking glitches, if masking them
+    glitches_df: pd.DataFrame = None
+
+    # optional, node to node distances of the requested pairs
+    pair_dists_df: pd.DataFrame = None
+
+    # pulse rate of every tentacle/agg on a uniform time grid
+    rhythms_grid_df: pd.DataFrame = None
+    aggs_rhythms_grid_df: pd.DataFrame = None
+
+    # cross tentacle synchrony, per tentacle pair and sliding window
+    sync_plv_df: pd.DataFrame = None
+    sync_coherence_df: pd.DataFrame = None
+    sync_index_df: pd.DataFrame = None
+
+    # spectral (dominant frequency) pulse rate per sliding window
+    spectral_rhythms_df: pd.DataFrame = None
+    aggs_spectral_rhythms_df: pd.DataFrame = None
+
+    # mean/sem/n waveform around the peaks, (stat, tentacle/agg) per lag (secs)
+    peak_waveforms_df: pd.DataFrame = None
+    aggs_peak_waveforms_df: pd.DataFrame = None
+
+    # skeleton kinematics along the file's edges, None if it has no edges
+    segment_lengths_df: pd.DataFrame = None
+    bend_angles_df: pd.DataFrame = None
+    node_speed_df: pd.DataFrame = None
+    node_accel_df: pd.DataFrame = None
+
     def transpose(self):
         return TentacleH5DataFrames(
             xdf=self.xdf.T,
@@ -61,7 +114,22 @@ class TentacleH5DataFrames:
             dists_sum_aggs=self.dists_sum_aggs.T,
             xdf_nan_score=self.xdf_nan_score.T,
             ydf_nan_score=self.ydf_nan_score.T,
-            # can't transpose vector and dicts:
+            glitches_df=None if self.glitches_df is None else self.glitches_df.T,
+            pair_dists_df=None if self.pair_dists_df is None else self.pair_dists_df.T,
+            rhythms_grid_df=None if self.rhythms_grid_df is None else self.rhythms_grid_df.T,
+            aggs_rhythms_grid_df=None if self.aggs_rhythms_grid_df is None else self.aggs_rhythms_grid_df.T,
+            sync_plv_df=None if self.sync_plv_df is None else self.sync_plv_df.T,
+            sync_coherence_df=None if self.sync_coherence_df is None else self.sync_coherence_df.T,
+            sync_index_df=None if self.sync_index_df is None else self.sync_index_df.T,
+            spectral_rhythms_df=None if self.spectral_rhythms_df is None else self.spectral_rhythms_df.T,
+            aggs_spectral_rhythms_df=None if self.aggs_spectral_rhythms_df is None else self.aggs_spectral_rhythms_df.T,
+            peak_waveforms_df=None if self.peak_waveforms_df is None else self.peak_waveforms_df.T,
+            aggs_peak_waveforms_df=None if self.aggs_peak_waveforms_df is None else self.aggs_peak_waveforms_df.T,
+            segment_lengths_df=None if self.segment_lengths_df is None else self.segment_lengths_df.T,
+            bend_angles_df=None if self.bend_angles_df is None else self.bend_angles_df.T,
+            node_speed_df=None if self.node_speed_df is None else self.node_speed_df.T,
+            node_accel_df=None if self.node_accel_df is None else self.node_accel_df.T,
+            # can't transpose vector and raggeds:
             time_axis=self.time_axis,
             peaks_timestamps_dict=self.peaks_timestamps_dict,
             rhythms_dict=self.rhythms_dict,
@@ -70,6 +138,8 @@ class TentacleH5DataFrames:
         )
 
     def log_shape(self, level=logging.DEBUG):
+        if not LOGGER.isEnabledFor(level):
+            return
         LOGGER.log(level, f"{self.xdf.shape=}")
         LOGGER.log(level, f"{self.ydf.shape=}")
         LOGGER.log(level, f"{self.xdf_fuller.shape=}")
@@ -88,8 +158,91 @@ class TentacleH5DataFrames:
         LOGGER.log(level, f"{len(self.aggs_rhythms_dict.keys())=}")
 
 
+class TracksCache:
+    """LRU of the tracks read from the h5 files, bounded by their size in bytes.
+
+    entries are keyed by path, mtime and size (and a tag of what was read), so
+    a rewritten file is read again. the cached arrays are read only, the
+    pipeline copies before changing them.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(path: Path, tag: str):
+        stat = os.stat(path)
+        return (str(Path(path).resolve()), stat.st_mtime_ns, stat.st_size, tag)
+
+    def get(self, path: Path, loader, tag: str = H5Keys.TRACKS):
+        # loader(path) returns a tuple, its arrays count towards the cache size
+        key = self._key(path, tag)
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+
+        value = loader(path)
+        arrays = [v for v in value if isinstance(v, np.ndarray)]
+        for a in arrays:
+            a.setflags(write=False)
+        nbytes = sum(a.nbytes for a in arrays)
+        with self._lock:
+            self.misses += 1
+            if nbytes <= self.max_bytes and key not in self._entries:
+                self._entries[key] = (value, nbytes)
+                self.nbytes += nbytes
+                while self.nbytes > self.max_bytes:
+                    _, (_, evicted) = self._entries.popitem(last=False)
+                    self.nbytes -= evicted
+        return value
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                entries=len(self._entries),
+                nbytes=self.nbytes,
+                hits=self.hits,
+                misses=self.misses,
+            )
+
+
 class H5Processor:
-    def __init__(self, dirpath, file_details):
+    def __init__(
+        self,
+        dirpath,
+        file_details,
+        fill_method: str = FillMethod.FFILL,
+        fill_limit: int = 2,
+        fill_max_gap: int = None,
+        reference_node=0,
+        node_pairs=None,
+        rhythm_bin_secs: float = 1.0,
+        synchrony: bool = False,
+        sync_window_secs: float = 60,
+        sync_step_secs: float = 10,
+        spectral: bool = False,
+        spectral_window_secs: float = 60,
+        spectral_step_secs: float = 10,
+        waveforms: bool = False,
+        waveform_half_secs: float = 2,
+        kinematics: bool = False,
+        kinematics_window_secs: float = 0.25,
+        spill_store=None,
+        tracks_cache: TracksCache = None,
+        min_point_score: float = None,
+        min_instance_score: float = None,
+        min_usable_percent: float = None,
+        glitch_z: float = None,
+        glitch_window_secs: float = 2,
+        glitch_min_px: float = 10,
+    ):
         self.substance = file_details["substance"]
         self.concentration = file_details["concentration"]["value"]
         self.concentration_unit = file_details["concentration"]["unit"]
@@ -98,6 +251,32 @@ class H5Processor:
         self.filename = file_details["filename"]
         self.fullpath = Path(self.dirpath, self.filename)
         self.shortname = self._get_shortname()
+        self.fill_method = fill_method
+        self.fill_limit = fill_limit
+        self.fill_max_gap = fill_max_gap
+        self.reference_node = reference_node  # node name or index
+        self.node_pairs = node_pairs  # None, "all" or ["node-a:node-b", ...]
+        self.reference_node_name = None
+        self.rhythm_bin_secs = rhythm_bin_secs
+        self.synchrony = synchrony  # the costly tentacles synchrony is opt in
+        self.sync_window_secs = sync_window_secs
+        self.sync_step_secs = sync_step_secs
+        self.spectral = spectral  # the spectral pulse rate estimator too, opt in
+        self.spectral_window_secs = spectral_window_secs
+        self.spectral_step_secs = spectral_step_secs
+        self.waveforms = waveforms  # the peak aligned waveforms, opt in
+        self.waveform_half_secs = waveform_half_secs
+        self.kinematics = kinematics  # the segment lengths, bend angles and node speeds, opt in
+        self.kinematics_window_secs = kinematics_window_secs  # of the Savitzky-Golay derivatives
+        self.spill_store = spill_store  # xenio.SpillStore, if large arrays should be memory mapped
+        self.tracks_cache = tracks_cache  # shared by the processors of a long running process (server.py)
+        self.min_point_score = min_point_score
+        self.min_instance_score = min_instance_score
+        self.min_usable_percent = min_usable_percent
+        self.usable_percent = None  # of the points not missing after all the masking
+        self.glitch_z = glitch_z  # None to keep the single frame jumps
+        self.glitch_window_secs = glitch_window_secs
+        self.glitch_min_px = glitch_min_px
 
         self.max_ctrl_frame = self.framerate * 60 * 4  # look at control part, upto 4 mins
         self.processed: TentacleH5DataFrames = None
@@ -106,7 +285,7 @@ class H5Processor:
         def fmt(exp_num, exp_well, substance, con, con_unit=""):
             return f"{exp_num}_{exp_well}_{substance}_{con}{con_unit}"
 
-        shortname = self.filename
+        shortname = Path(self.filename).name  # filename may be a full path (see catalog.py)
         try:
             shortname = shortname.removeprefix("labels.xenia").removesuffix(".analysis.h5")
             parts = shortname.split('_')[5:]
@@ -116,30 +295,199 @@ class H5Processor:
             LOGGER.warning(f'failed to parse shortname out of {self.filename}, best effort-ing is {shortname=}')
         return shortname
 
-    def process(self):
-        with h5py.File(self.fullpath, "r") as f:
+    def __getstate__(self):
+        # pickled for the checkpoints, without the (process wide) cache
+        state = self.__dict__.copy()
+        state["tracks_cache"] = None
+        return state
+
+    @staticmethod
+    def _read_tracks(path: Path):
+        import h5py
+
+        with h5py.File(path, "r") as f:
             tracks = f[H5Keys.TRACKS][:]
             index = [
                 node_name.decode().replace("_", "-") for node_name in f[H5Keys.NODES][:]
             ]
+        return tracks[0], index  # (x/y, node, frame)
 
-        xdf = pd.DataFrame(tracks[0][0], index=index)
-        ydf = pd.DataFrame(tracks[0][1], index=index)
-        time_axis = np.arange(len(xdf.columns) - 1) / self.framerate
-        dists_df = H5Processor._calc_dists_df(xdf, ydf)
+    def _load_tracks(self):
+        if self.tracks_cache is not None:
+            coords, index = self.tracks_cache.get(self.fullpath, H5Processor._read_tracks)
+        else:
+            coords, index = H5Processor._read_tracks(self.fullpath)
+        ref = self._node_index(self.reference_node, index)
+        self.reference_node_name = index[ref]
+        return coords, index, ref
+
+    @staticmethod
+    def _read_scores(path: Path):
+        import h5py
+
+        with h5py.File(path, "r") as f:
+            if H5Keys.POINT_SCORES not in f:
+                return None, None
+            point_scores = f[H5Keys.POINT_SCORES][0]  # (node, frame)
+            instance_scores = (
+                f[H5Keys.INSTANCE_SCORES][0] if H5Keys.INSTANCE_SCORES in f else None
+            )
+        return point_scores, instance_scores
+
+    def _load_scores(self):
+        # only read when masking, the scores are as big as a coordinate of the tracks
+        if self.tracks_cache is not None:
+            return self.tracks_cache.get(self.fullpath, H5Processor._read_scores, tag=H5Keys.POINT_SCORES)
+        return H5Processor._read_scores(self.fullpath)
 
-        xdf_fuller, xdf_nan_score = H5Processor._smooth_missing_data_points(xdf)
-        ydf_fuller, ydf_nan_score = H5Processor._smooth_missing_data_points(ydf)
-        dists_fuller_df = H5Processor._calc_dists_df(xdf_fuller, ydf_fuller)
-        dists_full_normed_df = self._normalize_df(dists_fuller_df)
+    @staticmethod
+    def _read_edges(path: Path):
+        import h5py
+
+        with h5py.File(path, "r") as f:
+            if H5Keys.EDGES not in f:
+                return (None,)
+            return (f[H5Keys.EDGES][:].astype(int).reshape(-1, 2),)  # (edge, src/dst) node indices
+
+    def _load_edges(self):
+        if self.tracks_cache is not None:
+            return self.tracks_cache.get(self.fullpath, H5Processor._read_edges, tag=H5Keys.EDGES)[0]
+        return H5Processor._read_edges(self.fullpath)[0]
+
+    @property
+    def masking(self):
+        return self.min_point_score is not None or self.min_instance_score is not None
+
+    @property
+    def low_quality(self):
+        return (
+            self.min_usable_percent is not None
+            and self.usable_percent is not None
+            and self.usable_percent < self.min_usable_percent
+        )
+
+    def _mask_low_confidence(self, coords: np.ndarray):
+        """The coords with the low confidence points NaN-ed, and the percent masked of each node."""
+        if not self.masking:
+            return coords, None
+
+        point_scores, instance_scores = self._load_scores()
+        if point_scores is None:
+            LOGGER.warning(f"{self.filename} has no {H5Keys.POINT_SCORES}, not masking")
+            return coords, None
+
+        low = low_confidence(
+            point_scores,
+            instance_scores,
+            min_point_score=self.min_point_score,
+            min_instance_score=self.min_instance_score,
+        )
+        masked, masked_percent, _ = mask_points(coords, low)
+        LOGGER.info(f"{self.shortname}: masked {masked_percent.mean():.2f}% of the points")
+        return masked, masked_percent
+
+    def _check_usable(self, coords: np.ndarray):
+        # the points left for the gap filling, missing in the file or masked by any of the stages
+        present = ~np.isnan(coords).any(axis=0)
+        self.usable_percent = np.count_nonzero(present) * 100 / present.size if present.size else 0.0
+        if self.low_quality:
+            LOGGER.warning(
+                f"{self.shortname}: only {self.usable_percent:.2f}% of the points are usable "
+                f"(< {self.min_usable_percent}%), the costly exporters will be skipped"
+            )
+        else:
+            LOGGER.debug(f"{self.shortname}: {self.usable_percent:.2f}% of the points are usable")
+
+    def _mask_glitches(self, coords: np.ndarray):
+        """The coords with the single frame jumps NaN-ed, and the number of them of each node."""
+        if self.glitch_z is None:
+            return coords, None
+        masked, counts = mask_glitches(
+            coords,
+            window=max(3, int(round(self.glitch_window_secs * self.framerate))),
+            threshold=self.glitch_z,
+            min_step=self.glitch_min_px,
+        )
+        LOGGER.info(f"{self.shortname}: masked {counts.sum()} tracking glitches")
+        return masked, counts
+
+    def _spill(self, name: str, df: pd.DataFrame):
+        if self.spill_store is None:
+            return df
+        return self.spill_store.spill(name, df)
+
+    def normalized_dists(self):
+        # the pipeline up to the normalized distances and their aggs, without
+        # the analyses on top of them (e.g. for the peaks params sweep)
+        coords, index, ref = self._load_tracks()
+        coords, _ = self._mask_low_confidence(coords)
+        coords, _ = self._mask_glitches(coords)
+        self._check_usable(coords)
+        filled, _ = self._fill_tracks(coords, index)
+        dists_full_normed_df = self._normalize_df(H5Processor._calc_dists_df(filled, index, ref))
+        return dists_full_normed_df, self._calc_dists_aggs(dists_full_normed_df)
+
+    def process(self):
+        coords, index, ref = self._load_tracks()
+
+        xdf = self._spill("xdf", pd.DataFrame(coords[0], index=index))
+        ydf = self._spill("ydf", pd.DataFrame(coords[1], index=index))
+        time_axis = np.arange(len(xdf.columns) - 1) / self.framerate
+        dists_df = self._spill("dists_df", H5Processor._calc_dists_df(coords, index, ref))
+
+        masked, masked_percent = self._mask_low_confidence(coords)
+        masked, glitch_counts = self._mask_glitches(masked)
+        self._check_usable(masked)
+        filled, (xdf_nan_score, ydf_nan_score) = self._fill_tracks(masked, index)
+        if masked_percent is not None:
+            # missing "before" the filling counts the masked points (and glitches) too
+            xdf_nan_score["masked"] = ydf_nan_score["masked"] = masked_percent
+        glitches_df = None
+        if glitch_counts is not None:
+            glitches_df = pd.DataFrame(
+                {"count": glitch_counts, "percent of frames": glitch_counts * 100 / max(1, masked.shape[-1])},
+                index=index,
+            )
+        xdf_fuller = self._spill("xdf_fuller", pd.DataFrame(filled[0], index=index))
+        ydf_fuller = self._spill("ydf_fuller", pd.DataFrame(filled[1], index=index))
+        dists_fuller_df = self._spill("dists_fuller_df", H5Processor._calc_dists_df(filled, index, ref))
+        pair_dists_df = self._spill("pair_dists_df", self._calc_pair_dists_df(filled, index, ref))
+        segment_lengths_df = bend_angles_df = node_speed_df = node_accel_df = None
+        if self.kinematics:
+            segment_lengths_df, bend_angles_df, node_speed_df, node_accel_df = (
+                self._spill(name, df)
+                for name, df in zip(
+                    ["segment_lengths_df", "bend_angles_df", "node_speed_df", "node_accel_df"],
+                    self._calc_kinematics(filled, index),
+                )
+            )
+        del coords, masked, filled  # all spilled (if spilling), don't hold the raw blocks
+        dists_full_normed_df = self._spill("dists_full_normed_df", self._normalize_df(dists_fuller_df))
 
         peaks_timestamps_dict = self._find_peak_timestamps(dists_full_normed_df)
         rhythms_dict = self._calc_rhythms(peaks_timestamps_dict)
 
-        dists_sum_aggs = self._calc_dists_aggs(dists_full_normed_df)
+        dists_sum_aggs = self._spill("dists_sum_aggs", self._calc_dists_aggs(dists_full_normed_df))
         aggs_peaks_timestamps_dict = self._find_peak_timestamps(dists_sum_aggs)
         aggs_rhythms_dict = self._calc_rhythms(aggs_peaks_timestamps_dict)
 
+        duration = time_axis[-1] if len(time_axis) else 0
+        rhythms_grid_df = self._calc_rhythms_grid(peaks_timestamps_dict, duration)
+        aggs_rhythms_grid_df = self._calc_rhythms_grid(aggs_peaks_timestamps_dict, duration)
+
+        sync_plv_df = sync_coherence_df = sync_index_df = None
+        if self.synchrony:
+            sync_plv_df, sync_coherence_df, sync_index_df = self._calc_synchrony(dists_full_normed_df)
+        spectral_rhythms_df = aggs_spectral_rhythms_df = None
+        if self.spectral:
+            spectral_rhythms_df, aggs_spectral_rhythms_df = self._calc_spectral_rhythms(
+                dists_full_normed_df, dists_sum_aggs
+            )
+        peak_waveforms_df = aggs_peak_waveforms_df = None
+        if self.waveforms:
+            peak_waveforms_df = self._calc_peak_waveforms(dists_full_normed_df, peaks_timestamps_dict)
+            aggs_peak_waveforms_df = self._calc_peak_waveforms(dists_sum_aggs, aggs_peaks_timestamps_dict)
+
         self.processed = TentacleH5DataFrames(
             xdf=xdf,
             ydf=ydf,
@@ -156,35 +504,112 @@ class H5Processor:
             rhythms_dict=rhythms_dict,
             xdf_nan_score=xdf_nan_score,
             ydf_nan_score=ydf_nan_score,
+            glitches_df=glitches_df,
+            pair_dists_df=pair_dists_df,
+            rhythms_grid_df=rhythms_grid_df,
+            aggs_rhythms_grid_df=aggs_rhythms_grid_df,
+            sync_plv_df=sync_plv_df,
+            sync_coherence_df=sync_coherence_df,
+            sync_index_df=sync_index_df,
+            spectral_rhythms_df=spectral_rhythms_df,
+            aggs_spectral_rhythms_df=aggs_spectral_rhythms_df,
+            peak_waveforms_df=peak_waveforms_df,
+            aggs_peak_waveforms_df=aggs_peak_waveforms_df,
+            segment_lengths_df=segment_lengths_df,
+            bend_angles_df=bend_angles_df,
+            node_speed_df=node_speed_df,
+            node_accel_df=node_accel_df,
         ).transpose()  # plotting is better on long matrix rather than wide
 
         return self
 
     @staticmethod
-    def _calc_dists_df(xdf: pd.DataFrame, ydf: pd.DataFrame):
+    def _node_index(node, index: list):
+        if isinstance(node, (int, np.integer)) or str(node).lstrip("-").isdigit():
+            return int(node) % len(index)
+        name = str(node).replace("_", "-")
+        if name not in index:
+            raise ValueError(f"unknown node {node!r}, file has nodes {index}")
+        return index.index(name)
+
+    @staticmethod
+    def _calc_dists_df(coords: np.ndarray, index: list, ref: int = 0):
         # calculating Euclidean distances: d(x,y) = √((x1-x0)²+(y1-y0)²)
+        # of every node from the reference node (by default row zero: mouth row),
+        # skipping the first frame, as the time axis does
+        dists = reference_distances(coords[..., 1:], ref)
+        return pd.DataFrame(
+            dists,
+            index=[name for i, name in enumerate(index) if i != ref],
+            columns=pd.RangeIndex(1, coords.shape[-1]),
+        )
 
-        # get tentacle rows, skipping row zero: mouth row
-        dx = xdf.iloc[1:] - xdf.iloc[0]  # delta x, matrix - vector subtraction
-        dy = ydf.iloc[1:] - ydf.iloc[0]  # delta y, similarly
+    def _calc_pair_dists_df(self, coords: np.ndarray, index: list, ref: int):
+        if not self.node_pairs:
+            return None
+        if self.node_pairs == "all":
+            pairs = all_node_pairs(len(index), skip=(ref,))  # e.g. tentacle to tentacle
+        else:
+            pairs = [
+                [self._node_index(node, index) for node in pair.split(":")]
+                for pair in self.node_pairs
+            ]
+        pairs = np.asarray(pairs, dtype=int).reshape(-1, 2)
+        return pd.DataFrame(
+            pair_distances(coords[..., 1:], pairs),
+            index=[f"{index[i]}:{index[j]}" for i, j in pairs],
+            columns=pd.RangeIndex(1, coords.shape[-1]),
+        )
 
-        dists = np.sqrt(dx**2 + dy**2)
-        return pd.DataFrame(dists, columns=xdf.columns[1:])
+    def _calc_kinematics(self, coords: np.ndarray, index: list):
+        # segment lengths, bend angles and node speed/acceleration, frame 0 dropped like the dists
+        edges = self._load_edges()
+        if edges is None or len(edges) == 0:
+            LOGGER.warning(f"{self.filename} has no {H5Keys.EDGES}, skipping the kinematics")
+            return None, None, None, None
+        columns = pd.RangeIndex(1, coords.shape[-1])
+        joints = edge_joints(edges)
+        speed, accel = node_derivatives(
+            coords, fs=self.framerate, window=int(round(self.kinematics_window_secs * self.framerate))
+        )
+        return (
+            pd.DataFrame(
+                segment_lengths(coords[..., 1:], edges),
+                index=[f"{index[i]}:{index[j]}" for i, j in edges],
+                columns=columns,
+            ),
+            pd.DataFrame(
+                bend_angles(coords[..., 1:], joints),
+                index=[f"{index[a]}:{index[n]}:{index[b]}" for n, a, b in joints],
+                columns=columns,
+            ),
+            pd.DataFrame(speed[:, 1:], index=index, columns=columns),
+            pd.DataFrame(accel[:, 1:], index=index, columns=columns),
+        )
+
+    def _fill_tracks(self, coords: np.ndarray, index: list):
+        # x and y of all the nodes, (2, node, frame), filled in a single pass
+        filled, nan_scores = fill_gaps(
+            coords,
+            method=self.fill_method,
+            limit=self.fill_limit,
+            max_gap=self.fill_max_gap,
+        )
+        nan_score_dfs = [
+            pd.DataFrame(nan_scores[i], index=index, columns=["before", "after"])
+            for i in range(len(nan_scores))
+        ]
+        return filled, nan_score_dfs
 
     @staticmethod
     def _smooth_missing_data_points(df: pd.DataFrame):
-        nan_score_calc = lambda d: d.isna().sum(axis=1) * 100 / d.shape[1]
-        fuller = df.ffill(
-            axis=1,  # fill rows
-            limit=2,  # fill gaps of up to 2 NaN values
-            limit_area="inside",  # interpolate - only fill NaNs surrounded by valid values
+        # single coordinate version of _fill_tracks, same as
+        # df.ffill(axis=1, limit=2, limit_area="inside")
+        fuller, nan_score = fill_gaps(df.to_numpy())
+        return (
+            pd.DataFrame(fuller, index=df.index, columns=df.columns),
+            pd.DataFrame(nan_score, index=df.index, columns=["before", "after"]),
         )
-        nan_score = pd.concat(
-            list(map(nan_score_calc, [df, fuller])),
-            keys=["before", "after"],
-            axis=1,
-        )
-        return fuller, nan_score
 
     def _normalize_df(self, df: pd.DataFrame):
         data = {}
@@ -205,49 +630,111 @@ class H5Processor:
         normed = pd.DataFrame(data).T
         return normed
 
-    def _find_peak_timestamps(self, dist_df: pd.DataFrame):
+    def peak_params(self):
         avg_window = int(0.5 * self.framerate)
-        percent = 95
-        prominence = 0.1
-        distance = self.framerate  # assuming pulse take at least a second
-        # ⬇️ og width=0.5*fps, but avg_window=0.5*fps so assuming related
-        width = avg_window
+        return dict(
+            percent=95,
+            prominence=0.1,
+            distance=self.framerate,  # assuming pulse take at least a second
+            # ⬇️ og width=0.5*fps, but avg_window=0.5*fps so assuming related
+            width=avg_window,
+        )
 
-        data = {}
-        for tentacle in dist_df.index:
-            moving_avg = (
+    def _peaks_moving_avgs(self, dist_df: pd.DataFrame):
+        avg_window = int(0.5 * self.framerate)
+        return {
+            tentacle: (
                 pd.Series(dist_df.loc[tentacle])
                 .rolling(window=avg_window, min_periods=2)
                 .mean()
                 .to_numpy()
             )
-            moving_avg_normalized = moving_avg / np.nanpercentile(moving_avg, percent)
-            peaks, _ = sig.find_peaks(
-                moving_avg_normalized,
-                distance=distance,
-                prominence=prominence,
-                width=width,
-            )
-            assert isinstance(peaks, np.ndarray)
-            data[tentacle] = peaks / self.framerate
-        return data
+            for tentacle in dist_df.index
+        }
 
-    def _calc_rhythms(self, peaks_timestamps: dict):
-        data = {}
-        c = 3
-        for tentacle, timestamps in peaks_timestamps.items():
-            ts:np.ndarray = timestamps
-            ts = c / (ts[c:] - ts[:-c])
-
-            # pad with the last value for the c missing values due to c avg
-            ts = pd.Series(np.concatenate([ts, [np.nan]*c])).ffill(
-                limit=c*2,  # how many consecutive NaNs to fill
-                limit_area='outside',  # extrapolate
-            )
-
-            data[tentacle] = ts
+    @staticmethod
+    def _detect_peaks(moving_avg: np.ndarray, percent, prominence, distance, width):
+        from scipy import signal as sig
+
+        moving_avg_normalized = moving_avg / np.nanpercentile(moving_avg, percent)
+        peaks, _ = sig.find_peaks(
+            moving_avg_normalized,
+            distance=distance,
+            prominence=prominence,
+            width=width,
+        )
+        assert isinstance(peaks, np.ndarray)
+        return peaks
 
-        return data
+    def _find_peak_timestamps(self, dist_df: pd.DataFrame):
+        params = self.peak_params()
+        return Ragged.from_dict({
+            tentacle: self._detect_peaks(moving_avg, **params) / self.framerate
+            for tentacle, moving_avg in self._peaks_moving_avgs(dist_df).items()
+        })
+
+    def _calc_rhythms(self, peaks_timestamps: Ragged, c: int = 3):
+        # c / (ts[i + c] - ts[i]) of all the tentacles at once, the last c peaks
+        # of each (which have no window) get its last computed rate
+        _, rates, _ = instantaneous_rates(list(peaks_timestamps.values()), c=c)
+        return peaks_timestamps.with_data(rates)
+
+    def _calc_rhythms_grid(self, peaks_timestamps: Ragged, duration: float, c: int = 3):
+        # same rates as _calc_rhythms, held from each peak to the next, sampled on
+        # a shared grid so tentacles can be compared point by point
+        grid, values = rhythm_grid(
+            list(peaks_timestamps.values()), duration, bin_secs=self.rhythm_bin_secs, c=c
+        )
+        return pd.DataFrame(values, index=list(peaks_timestamps), columns=grid)
+
+    def _calc_synchrony(self, dists_df: pd.DataFrame):
+        result = synchrony(
+            dists_df.to_numpy(),
+            fs=self.framerate,
+            window_secs=self.sync_window_secs,
+            step_secs=self.sync_step_secs,
+        )
+        tentacles = list(dists_df.index)
+        pair_names = [f"{tentacles[i]}:{tentacles[j]}" for i, j in result.pairs]
+        plv_df = pd.DataFrame(result.plv, index=pair_names, columns=result.times)
+        coherence_df = pd.DataFrame(result.coherence, index=pair_names, columns=result.times)
+        index_df = pd.DataFrame(
+            np.stack(result.synchrony_index()),
+            index=[SyncKeys.PLV, SyncKeys.COHERENCE],
+            columns=result.times,
+        )
+        return plv_df, coherence_df, index_df
+
+    def _calc_spectral_rhythms(self, dists_df: pd.DataFrame, aggs_df: pd.DataFrame):
+        # tentacles and aggs in one batch, split back after
+        result = spectral_rhythm(
+            np.concatenate([dists_df.to_numpy(), aggs_df.to_numpy()]),
+            fs=self.framerate,
+            window_secs=self.spectral_window_secs,
+            step_secs=self.spectral_step_secs,
+        )
+        rhythms = pd.DataFrame(
+            result.freqs, index=[*dists_df.index, *aggs_df.index], columns=result.times
+        )
+        return rhythms.iloc[: len(dists_df)], rhythms.iloc[len(dists_df) :]
+
+    def _calc_peak_waveforms(self, dists_df: pd.DataFrame, peaks_timestamps: Ragged):
+        # the peak timestamps are positions in the dists columns (frame 0 is dropped)
+        peaks = [
+            np.round(peaks_timestamps[tentacle] * self.framerate).astype(int)
+            for tentacle in dists_df.index
+        ]
+        lags, mean, sem, n = peak_waveforms(
+            dists_df.to_numpy(),
+            peaks,
+            half_width=int(self.waveform_half_secs * self.framerate),
+        )
+        stats = {WaveformKeys.MEAN: mean, WaveformKeys.SEM: sem, WaveformKeys.N: n}
+        return pd.DataFrame(
+            np.concatenate(list(stats.values())),
+            index=pd.MultiIndex.from_product([list(stats), dists_df.index], names=["stat", "node"]),
+            columns=pd.Index(lags / self.framerate, name="lag (secs)"),
+        )
 
     def _calc_dists_aggs(self, dists_df: pd.DataFrame):
         def _norm_vector(v: pd.Series):
@@ -1,39 +1,158 @@
+import sys
+import json
+import queue
+import atexit
 import logging
-import logging.config
+import logging.handlers
 from datetime import datetime
 from pathlib import Path
 
-LOGGING = {
-    "version": 1,
-    "disable_existing_loggers": False,
-    "formatters": {
-        "base": {
-            "style": "{",
-            "format": "{asctime} [{levelname}] {filename}:{lineno}: {message}",
-            "datefmt": "%Y-%m-%dT%H:%M:%S"
-        }
-    },
-    "handlers": {
-        "console": {
-            "class": "logging.StreamHandler",
-            "stream": "ext://sys.stdout",
-            "level": logging.INFO,
-            "formatter": "base",
-        },
-        "file_log": {
-            "class": "logging.handlers.RotatingFileHandler",
-            "level": logging.DEBUG,
-            "formatter": "base",
-            "filename": Path(__file__, '..', '..', 'log', 'xenianalysis.log').resolve(),
-            "mode": "a",
-            "maxBytes": 1024 * 5
+LOG_DIR = Path(__file__, '..', '..', 'log').resolve()
+LOG_FILE_MAX_BYTES = 10 * 1024 * 1024
+LOG_FILE_BACKUPS = 5
+JSON_LOG_MAX_BYTES = 50 * 1024 * 1024
+JSON_LOG_BACKUPS = 2
+
+FORMAT = dict(
+    style="{",
+    fmt="{asctime} [{levelname}] {filename}:{lineno}: {message}",
+    datefmt="%Y-%m-%dT%H:%M:%S",
+)
+
+
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "file": record.filename,
+            "line": record.lineno,
+            "process": record.process,
+            "message": record.getMessage(),
         }
-    },
-    "loggers": {"": {"handlers": ["console", "file_log"], "level": "DEBUG"}},
-}
+        if record.exc_text or record.exc_info:
+            entry["exc"] = record.exc_text or self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def _console_handler():
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setLevel(logging.INFO)
+    handler.setFormatter(logging.Formatter(**FORMAT))
+    return handler
+
+
+def _file_handler():
+    LOG_DIR.mkdir(exist_ok=True)
+    handler = logging.handlers.RotatingFileHandler(
+        LOG_DIR.joinpath("xenianalysis.log"),
+        mode="a",
+        maxBytes=LOG_FILE_MAX_BYTES,
+        backupCount=LOG_FILE_BACKUPS,
+    )
+    handler.setLevel(logging.DEBUG)
+    handler.setFormatter(logging.Formatter(**FORMAT))
+    return handler
+
+
+# records are only put on a queue by the logging thread (and by forked workers,
+# which inherit it), a single listener thread of the main process formats them
+# and does the I/O. the queue is a plain (threads only) queue until a process
+# pool asks for one (get_log_queue), so importing the logger (e.g. for --help)
+# doesn't start multiprocessing's queue feeder
+_queue = None
+_listener = None
+_console = None
+
+
+def _is_worker():
+    # spawned workers import multiprocessing to bootstrap, don't import it just to ask
+    mp = sys.modules.get("multiprocessing")
+    return mp is not None and mp.parent_process() is not None
+
+
+def _listen(log_queue, handlers):
+    global _queue, _listener
+
+    _queue = log_queue
+    _listener = logging.handlers.QueueListener(_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    logging.getLogger().handlers = [logging.handlers.QueueHandler(_queue)]
+
+
+def _stop_listener():
+    _listener.stop()  # flushes what's left in the queue
+
+
+def _setup():
+    global _console
+
+    root = logging.getLogger()
+    root.setLevel(logging.DEBUG)  # the handlers filter, the console shows INFO up, the file log everything
+    if _is_worker():
+        # a spawned worker, logs to the console until init_worker_logging gives it the main queue
+        root.handlers = [_console_handler()]
+        return
+
+    _console = _console_handler()
+    _listen(queue.SimpleQueue(), (_console, _file_handler()))
+    atexit.register(_stop_listener)
+
+
+_setup()
+
+
+def get_log_queue():
+    """A process safe queue of the main process' listener, for init_worker_logging."""
+    if _is_listening() and isinstance(_queue, queue.SimpleQueue):
+        import multiprocessing
+
+        # moves the listener to a multiprocessing queue, once, after draining the plain one
+        handlers = _listener.handlers
+        _listener.stop()
+        _listen(multiprocessing.Queue(-1), handlers)
+        # atexit runs last registered first, stop before multiprocessing's exit closes the queue
+        atexit.unregister(_stop_listener)
+        atexit.register(_stop_listener)
+    return _queue
+
+
+def init_worker_logging(queue, level=None):
+    """Process pool initializer, sends the worker's records to the main process' listener."""
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(queue)]
+    if level is not None:
+        root.setLevel(level)
+
+
+def _is_listening():
+    return _listener is not None and not _is_worker()
+
+
+def enable_json_log(path: Path):
+    """Also write the records as json lines to `path` (a per run log)."""
+    handler = logging.handlers.RotatingFileHandler(
+        path, mode="a", maxBytes=JSON_LOG_MAX_BYTES, backupCount=JSON_LOG_BACKUPS
+    )
+    handler.setLevel(logging.DEBUG)
+    handler.setFormatter(JsonLinesFormatter())
+    if _is_listening():
+        _listener.handlers = (*_listener.handlers, handler)
+    else:
+        logging.getLogger().addHandler(handler)  # a worker, its run only
+    return handler
 
 
-logging.config.dictConfig(LOGGING)
+def disable_json_log(handler: logging.Handler):
+    if _is_listening():
+        # drain what's queued so far into the handler before dropping it
+        _listener.stop()
+        _listener.start()
+        _listener.handlers = tuple(h for h in _listener.handlers if h is not handler)
+    else:
+        logging.getLogger().removeHandler(handler)
+    handler.close()
 
 
 def getLogger(name, level=None):
@@ -56,6 +175,8 @@ def log_runtime(logger, level=logging.DEBUG):
             logger.log(level, f'{status} execution of {func_name} took {dur}')
 
         def func_timing_wrapper(*args, **kwargs):
+            if not logger.isEnabledFor(level):
+                return func(*args, **kwargs)
             logger.log(level, f'starting time monitored execution of {func_name}')
 
             start = datetime.now()
@@ -71,5 +192,6 @@ def log_runtime(logger, level=logging.DEBUG):
 
 
 def set_global_log_level_debug():
-    LOGGING["handlers"]["console"]["level"] = logging.DEBUG
-    logging.config.dictConfig(LOGGING)
\ No newline at end of file
+    logging.getLogger().setLevel(logging.DEBUG)
+    if _console is not None:
+        _console.setLevel(logging.DEBUG)
@@ -1,16 +1,22 @@
 from pathlib import Path
-from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter, ArgumentTypeError
 
-from logger import getLogger, set_global_log_level_debug
-from h5process import H5Processor
-from xenio import InputsLoader, OutputsManager
-from exporters.h5_exporters import SingleH5Exporter
+from logger import getLogger, set_global_log_level_debug, enable_json_log, disable_json_log
+from analysis.fill_methods import FillMethod
+from xenio import InputsLoader, OutputsManager, StageStrategy, Shard, RUN_LOG_NAME
 
 
 LOGGER = getLogger(__name__)
 
 
-def parseArgs():
+def shard_arg(value: str):
+    try:
+        return Shard.parse(value)
+    except ValueError as e:
+        raise ArgumentTypeError(str(e))
+
+
+def parseArgs(argv=None):
     parser = ArgumentParser(
         prog="Xenia analysis", formatter_class=ArgumentDefaultsHelpFormatter
     )
@@ -21,10 +27,15 @@ def parseArgs():
         required=True,
         help="path of the input dir with details.json",
     )
+    parser.add_argument(
+        "--details",
+        default=None, type=Path,
+        help="path of the details json to use instead of the input dir's details.json",
+    )
     parser.add_argument(
         "-o",
         "--output",
-        default=Path(__file__, "..", "..", "outputs").resolve(),
+        default=Path(__file__, "..", "..", "outputs").resolve(), type=Path,
         help="dir to save the output under",
     )
     parser.add_argument(
@@ -34,22 +45,199 @@ def parseArgs():
     parser.add_argument(
         "--copy-inputs",
         default=False, action="store_true",
-        help="don't copy the input dir to the output dir",
+        help="copy the input files (of the shard) into the output dir, with their sha256 checksums",
+    )
+    parser.add_argument(
+        "--stage-inputs",
+        default=StageStrategy.COPY, choices=StageStrategy.ALL,
+        help="how to place the inputs in the output dir when using --copy-inputs. " \
+        "copies are deduped in the outputs' inputs store (and reflinked into it when the filesystem allows it), " \
+        "links fall back to a copy if the filesystem doesn't support them",
     )
     parser.add_argument(
         "--gen-csv",
         default=False, action="store_true",
         help="if to generate csv files for all the generated plots",
     )
+    parser.add_argument(
+        "--fill-method",
+        default=FillMethod.FFILL, choices=FillMethod.ALL,
+        help="how to fill gaps of missing points in the tracks",
+    )
+    parser.add_argument(
+        "--fill-limit",
+        default=2, type=int,
+        help="max number of consecutive missing points to fill in each gap",
+    )
+    parser.add_argument(
+        "--fill-max-gap",
+        default=None, type=int,
+        help="if given, gaps longer than this are left unfilled",
+    )
+    parser.add_argument(
+        "--min-point-score",
+        default=None, type=float,
+        help="points scored (by SLEAP) under this are treated as missing before filling the gaps",
+    )
+    parser.add_argument(
+        "--min-instance-score",
+        default=None, type=float,
+        help="frames whose instance score is under this are treated as missing before filling the gaps",
+    )
+    parser.add_argument(
+        "--min-usable-percent",
+        default=None, type=float,
+        help="files with a lower percent of usable points skip the costly exporters. points missing " \
+        "in the file count as unusable too, so it works without any masking",
+    )
+    parser.add_argument(
+        "--glitch-z",
+        default=None, type=float,
+        help="points a node jumps to for a single frame (tracking glitches) are treated as missing " \
+        "before filling the gaps, if the steps to and from them have a robust z-score over this, e.g. 8",
+    )
+    parser.add_argument(
+        "--glitch-window-secs",
+        default=2, type=float,
+        help="window of the rolling median and MAD of the steps the --glitch-z z-scores are against",
+    )
+    parser.add_argument(
+        "--glitch-min-px",
+        default=10, type=float,
+        help="min size (pixels) of the jumps --glitch-z treats as glitches",
+    )
+    parser.add_argument(
+        "--reference-node",
+        default="0",
+        help="name or index of the node distances are measured from (index 0 is the mouth)",
+    )
+    parser.add_argument(
+        "--node-pairs",
+        default=None, nargs="+",
+        help="also compute node to node distances, 'all' for every pair of " \
+        "non reference nodes, or a list of pairs like Tentacle-1:Tentacle-5",
+    )
+    parser.add_argument(
+        "--rhythm-bin-secs",
+        default=1.0, type=float,
+        help="resolution of the uniform time grid the pulse rates are sampled on",
+    )
+    parser.add_argument(
+        "--synchrony",
+        default=False, action="store_true",
+        help="also compute and export the tentacles synchrony (phase locking and coherence over sliding windows)",
+    )
+    parser.add_argument(
+        "--sync-window-secs",
+        default=60, type=float,
+        help="length of the sliding windows tentacles synchrony is computed over",
+    )
+    parser.add_argument(
+        "--sync-step-secs",
+        default=10, type=float,
+        help="step between consecutive synchrony windows",
+    )
+    parser.add_argument(
+        "--spectral",
+        default=False, action="store_true",
+        help="also estimate the pulse rates from the spectrum of sliding windows, " \
+        "and export them next to the peak based ones",
+    )
+    parser.add_argument(
+        "--spectral-window-secs",
+        default=60, type=float,
+        help="length of the sliding windows of the spectral pulse rate estimator",
+    )
+    parser.add_argument(
+        "--spectral-step-secs",
+        default=10, type=float,
+        help="step between consecutive spectral pulse rate windows",
+    )
+    parser.add_argument(
+        "--waveforms",
+        default=False, action="store_true",
+        help="also export the mean (and sem) waveform of the distances around the peaks of every tentacle",
+    )
+    parser.add_argument(
+        "--waveform-half-secs",
+        default=2, type=float,
+        help="secs before and after every peak averaged into the peak aligned waveforms",
+    )
+    parser.add_argument(
+        "--kinematics",
+        default=False, action="store_true",
+        help="also export the skeleton kinematics: segment lengths, bend angles and the nodes speed and acceleration",
+    )
+    parser.add_argument(
+        "--kinematics-window-secs",
+        default=0.25, type=float,
+        help="window of the Savitzky-Golay filter the nodes speed and acceleration are derived with",
+    )
+    parser.add_argument(
+        "--pyramids",
+        default=False, action="store_true",
+        help="also export min/max pyramids of the distances, to zoom into long recordings with viewer.py",
+    )
+    parser.add_argument(
+        "--conditions",
+        default=False, action="store_true",
+        help="also compare the pulse rates before and after the treatment per condition, " \
+        "over all the files of the run (conditions.csv)",
+    )
+    parser.add_argument(
+        "--n-boot",
+        default=2000, type=int,
+        help="bootstrap resamples of the confidence intervals of --conditions, 0 for the model intervals only",
+    )
+    parser.add_argument(
+        "--spill",
+        default=False, action="store_true",
+        help="keep the large per frame arrays in memory mapped files in the output dir " \
+        "instead of RAM, for long recordings",
+    )
+    parser.add_argument(
+        "--keep-scratch",
+        default=False, action="store_true",
+        help="don't delete the spilled arrays when done (for debugging)",
+    )
+    parser.add_argument(
+        "--shard",
+        default=None, type=shard_arg,
+        help="i/N, only process the i-th (0 based) of N size balanced parts of the " \
+        "inputs, into its own output dir. combine the parts with merge.py",
+    )
+    parser.add_argument(
+        "--resume",
+        default=None, type=Path,
+        help="output dir of an interrupted run to complete, skipping the files and " \
+        "exporters it already finished. pass the same arguments as the original run",
+    )
     parser.add_argument(
         "--show",
         default=False, action="store_true",
         help="if to show the generated plots",
     )
+    parser.add_argument(
+        "--keep-last",
+        default=None, type=int,
+        help="delete the older runs in the outputs dir, except this many latest ones "
+        "(running and interrupted runs are never deleted)",
+    )
+    parser.add_argument(
+        "--keep-days",
+        default=None, type=float,
+        help="delete the runs in the outputs dir older than this many days, "
+        "with --keep-last a run is kept if either keeps it",
+    )
     parser.add_argument(
         "--delete-all-other-outputs",
+        dest="keep_last", action="store_const", const=0,
+        help="same as --keep-last 0",
+    )
+    parser.add_argument(
+        "--json-log",
         default=False, action="store_true",
-        help="if to clear out the outputs dir",
+        help=f"also log the run as json lines to {RUN_LOG_NAME} in the output dir",
     )
     parser.add_argument(
         "-v"
@@ -59,18 +247,15 @@ def parseArgs():
         help="set log level to debug (verbose mode)",
     )
     # fmt: on
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 
-def main():
-    args = parseArgs()
-    if args.set_debug:
-        set_global_log_level_debug()
-
+def run(args, tracks_cache=None):
+    """Processes and exports the inputs, returns the output dir and the files that failed."""
     LOGGER.info(f"starting execution with {args=}")
 
     input_dir = args.input
-    input_loader = InputsLoader(input_dir)
+    input_loader = InputsLoader(input_dir, details_path=args.details)
     output_manager = OutputsManager(
         args.output,
         input_loader=input_loader,
@@ -78,30 +263,134 @@ def main():
         gen_csv=args.gen_csv,
         show_plot=args.show,
         name_suffix=args.out_dir_suffix,
+        stage_strategy=args.stage_inputs,
+        spill=args.spill,
+        keep_scratch=args.keep_scratch,
+        pyramids=args.pyramids,
+        shard=args.shard,
+        resume_dir=args.resume,
     )
+    json_log = None
+    if args.json_log:
+        json_log = enable_json_log(output_manager.get_output_full_path(RUN_LOG_NAME))
+    try:
+        return _process_and_export(args, input_loader, output_manager, tracks_cache)
+    finally:
+        if json_log is not None:
+            disable_json_log(json_log)
+        output_manager.close()
+
 
-    if args.delete_all_other_outputs:
-        output_manager.delete_all_other_outputs()
+def _process_and_export(args, input_loader, output_manager, tracks_cache):
+    # heavy imports (pandas, scipy, h5py, plotly) after parsing, so --help and bad args are quick
+    from h5process import H5Processor
+    from exporters.h5_exporters import SingleH5Exporter
+
+    input_dir = args.input
+    checkpoints = output_manager.checkpoints
+    if args.resume:
+        checkpoints.check_args(vars(args), ignore=("resume", "output", "details", "set_debug", "show", "keep_last", "keep_days"))
+    else:
+        checkpoints.save_args(vars(args))
+
+    if args.keep_last is not None or args.keep_days is not None:
+        output_manager.apply_retention(keep_last=args.keep_last, keep_days=args.keep_days)
 
     inputs = input_loader.get_inputs()
+    if args.shard:
+        inputs = args.shard.select(inputs, input_dir)
+        LOGGER.info(f"processing {args.shard.name}: {len(inputs)} files")
 
     outputs = []
+    failed = []
     LOGGER.info("processing h5...")
     for file_details in inputs:
+        name = Path(file_details["filename"]).name
+        if checkpoints.is_done(name, checkpoints.EXPORTED):
+            LOGGER.info(f"{name} already done, skipping")
+            continue
         try:
-            processor = H5Processor(input_dir, file_details)
-            outputs.append(processor.process())
+            if checkpoints.is_done(name, checkpoints.PROCESSED):
+                LOGGER.info(f"{name} already processed, loading it")
+                outputs.append((name, checkpoints.load_processed(name)))
+                continue
+            processor = H5Processor(
+                input_dir,
+                file_details,
+                fill_method=args.fill_method,
+                fill_limit=args.fill_limit,
+                fill_max_gap=args.fill_max_gap,
+                reference_node=args.reference_node,
+                node_pairs="all" if args.node_pairs == ["all"] else args.node_pairs,
+                rhythm_bin_secs=args.rhythm_bin_secs,
+                synchrony=args.synchrony,
+                sync_window_secs=args.sync_window_secs,
+                sync_step_secs=args.sync_step_secs,
+                spectral=args.spectral,
+                spectral_window_secs=args.spectral_window_secs,
+                spectral_step_secs=args.spectral_step_secs,
+                waveforms=args.waveforms,
+                waveform_half_secs=args.waveform_half_secs,
+                kinematics=args.kinematics,
+                kinematics_window_secs=args.kinematics_window_secs,
+                spill_store=output_manager.new_spill_store(name),
+                tracks_cache=tracks_cache,
+                min_point_score=args.min_point_score,
+                min_instance_score=args.min_instance_score,
+                min_usable_percent=args.min_usable_percent,
+                glitch_z=args.glitch_z,
+                glitch_window_secs=args.glitch_window_secs,
+                glitch_min_px=args.glitch_min_px,
+            )
+            processed = processor.process()
+            if output_manager.spill:
+                # cheap, the large arrays are pickled as references to their scratch files. without
+                # spilling a resumed run processes the file again instead of pickling all of it
+                checkpoints.save_processed(name, processed)
+            outputs.append((name, processed))
         except:
+            failed.append(name)
             LOGGER.error(f"failed to process file: {file_details}", exc_info=True)
 
     LOGGER.info("exporting processed...")
     single_exporter = SingleH5Exporter(output_manager)
-    for i, processed in enumerate(outputs):
-        LOGGER.info(f"[{i}/{len(outputs)}] exporting {processed.filename}")
-        single_exporter.export(processed)
+    try:
+        for i, (name, processed) in enumerate(outputs):
+            LOGGER.info(f"[{i}/{len(outputs)}] exporting {processed.filename}")
+            single_exporter.export(processed, checkpoint_name=name)
+            checkpoints.mark_exported(name)
+            outputs[i] = (name, None)  # drop the memory maps before removing their files
+            del processed
+            output_manager.cleanup_scratch(name)
+    finally:
+        # the scratch files of the files not exported yet stay, their processed checkpoints use them
+        outputs.clear()
+
+    if args.conditions:
+        from analysis.conditions import compare_output_dir
+
+        LOGGER.info("comparing conditions...")
+        try:
+            # of every file exported to the output dir, including by the run being resumed
+            compare_output_dir(output_manager.output_dir_path, n_boot=args.n_boot)
+        except Exception:
+            LOGGER.error("failed to compare the conditions", exc_info=True)
 
+    if failed:
+        LOGGER.warning(f"some files failed, rerun with --resume {output_manager.output_dir_path} to retry them")
+    else:
+        checkpoints.clear()
+        output_manager.cleanup_scratch()
 
     LOGGER.info(f"execution completed, results in {output_manager.output_dir_path}")
+    return output_manager.output_dir_path, failed
+
+
+def main():
+    args = parseArgs()
+    if args.set_debug:
+        set_global_log_level_debug()
+    run(args)
 
 
 if __name__ == "__main__":
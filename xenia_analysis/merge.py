@@ -0,0 +1,189 @@
+"""Merge the output dirs of a sharded run (main.py --shard i/N) into one output dir."""
+
+import re
+import json
+import shutil
+import filecmp
+from pathlib import Path
+
+from logger import getLogger
+from xenio import (
+    JSON_KEYS,
+    INPUTS_CHECKSUMS_NAME,
+    OUTPUT_SUMMARY_JSON_NAME,
+    SCRATCH_DIR_NAME,
+    CHECKPOINTS_DIR_NAME,
+    RUN_LOG_NAME,
+    RUN_LOCK_NAME,
+    TMP_MARK,
+    InputsStager,
+    StageStrategy,
+    RunLock,
+    atomic_output,
+    create_output_dir,
+)
+
+LOGGER = getLogger(__name__)
+
+
+# {timestamp}_{rand key}{.name suffix}.shard-{i}-of-{N}
+SHARD_DIRNAME_REGEX = re.compile(r"^[^_]+_[^.]+(?P<suffix>.*?)\.shard-\d+-of-\d+$")
+CONCAT_EXTS = {".csv"}  # run level tables, every shard contributes rows (same header)
+UNION_NAMES = {INPUTS_CHECKSUMS_NAME, RUN_LOG_NAME}  # every shard contributes lines
+CONDITIONS_NAME = "conditions.csv"  # analysis.conditions, refitted on all the merged files instead
+
+
+class MergeShardsScript:
+    SCRIPT_NAME = "shards merger"
+    description = f"""
+        \nExamples:
+        \tpython {Path(__file__).name} outputs/*.my-run.shard-*  # merge the shards of my-run into a new output dir
+    """
+
+    def parseArgs(self):
+        from argparse import ArgumentParser, RawDescriptionHelpFormatter
+
+        parser = ArgumentParser(
+            prog=self.SCRIPT_NAME,
+            formatter_class=RawDescriptionHelpFormatter,
+            description=self.description,
+        )
+        # fmt: off
+        parser.add_argument("shards",
+            nargs="+", type=Path,
+            help="the shards output dirs",
+        )
+        parser.add_argument("-o", "--output",
+            default=None, type=Path,
+            help="dir to create the merged output dir under, defaults to the shards parent dir",
+        )
+        parser.add_argument("--allow-partial",
+            default=False, action="store_true",
+            help="merge even if some of the shards are missing",
+        )
+        parser.add_argument("--n-boot",
+            default=2000, type=int,
+            help="bootstrap resamples of the refitted conditions comparison (see main.py --n-boot)",
+        )
+        # fmt: on
+        return parser.parse_args()
+
+    @staticmethod
+    def load_shards(shard_dirs: list, allow_partial: bool = False):
+        shards = {}
+        for shard_dir in shard_dirs:
+            with open(shard_dir.joinpath(OUTPUT_SUMMARY_JSON_NAME)) as f:
+                metadata = json.load(f)
+            if JSON_KEYS.SHARD not in metadata:
+                raise ValueError(f"{shard_dir} isn't a shard output dir (no shard in its metadata)")
+            shard = metadata[JSON_KEYS.SHARD]
+            if shard[JSON_KEYS.SHARD_INDEX] in shards:
+                raise ValueError(f"shard {shard[JSON_KEYS.SHARD_INDEX]} given twice")
+            shards[shard[JSON_KEYS.SHARD_INDEX]] = (shard_dir, metadata)
+
+        counts = {m[JSON_KEYS.SHARD][JSON_KEYS.SHARD_COUNT] for _, m in shards.values()}
+        if len(counts) != 1:
+            raise ValueError(f"shards of different runs, shard counts: {counts}")
+        missing = set(range(counts.pop())) - set(shards)
+        if missing:
+            if not allow_partial:
+                raise ValueError(f"missing shards {sorted(missing)}, use --allow-partial to merge anyway")
+            LOGGER.warning(f"merging without shards {sorted(missing)}")
+        return [shards[i] for i in sorted(shards)]
+
+    @staticmethod
+    def merged_metadata(shards: list):
+        metadata = dict(shards[0][1])
+        metadata.pop(JSON_KEYS.SHARD)
+        metadata[JSON_KEYS.MERGED_FROM] = [
+            {**m[JSON_KEYS.SHARD], "dir": shard_dir.name} for shard_dir, m in shards
+        ]
+        return metadata
+
+    @staticmethod
+    def merge_files(shards: list, merged_dir: Path):
+        stager = InputsStager(strategy=StageStrategy.HARDLINK)
+        tables = {}
+        for shard_dir, _ in shards:
+            if RunLock.is_held(shard_dir):
+                LOGGER.warning(f"{shard_dir.name} is still running, its outputs may be missing")
+            elif Path(shard_dir, CHECKPOINTS_DIR_NAME).is_dir():
+                LOGGER.warning(f"{shard_dir.name} didn't complete, finish it with main.py --resume first")
+            for f in sorted(shard_dir.rglob("*")):
+                rel = f.relative_to(shard_dir)
+                if not f.is_file() or rel.parts[0] in (SCRATCH_DIR_NAME, CHECKPOINTS_DIR_NAME, RUN_LOCK_NAME):
+                    continue
+                if any(part.startswith(".") and TMP_MARK in part for part in rel.parts):
+                    continue  # an artifact still being written
+                if rel.as_posix() in (OUTPUT_SUMMARY_JSON_NAME, CONDITIONS_NAME):
+                    continue  # merged separately
+
+                dest = merged_dir.joinpath(rel)
+                if (rel.parent == Path(".") and f.suffix in CONCAT_EXTS) or f.name in UNION_NAMES:
+                    tables.setdefault(dest, []).append(f)
+                elif dest.exists():
+                    if not filecmp.cmp(f, dest, shallow=False):
+                        raise ValueError(f"{rel} differs between the shards")
+                else:
+                    dest.parent.mkdir(parents=True, exist_ok=True)
+                    stager.stage_file(f, dest.parent)  # hardlink, copy if not possible
+
+        for dest, sources in tables.items():
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            with atomic_output(dest) as tmp, open(tmp, "w") as out:
+                if dest.name in UNION_NAMES:
+                    lines = [line for source in sources for line in open(source)]
+                    out.writelines(dict.fromkeys(lines))
+                    continue
+                for i, source in enumerate(sources):
+                    with open(source) as f:
+                        header = f.readline()
+                        if i == 0:
+                            out.write(header)
+                        out.writelines(f)
+
+    @staticmethod
+    def merge_conditions(merged_dir: Path, n_boot: int):
+        # a condition's files may be split between the shards, so their tables can't be concatenated
+        from analysis.conditions import compare_output_dir
+
+        compare_output_dir(merged_dir, n_boot=n_boot)
+
+    def merge(self, shard_dirs: list, output_parent: Path = None, allow_partial: bool = False, n_boot: int = 2000):
+        shards = self.load_shards(shard_dirs, allow_partial)
+
+        # name after the first shard, without its shard suffix
+        first_dir = shards[0][0]
+        match = SHARD_DIRNAME_REGEX.match(first_dir.name)
+        name_suffix = (match.group("suffix") if match else "") + ".merged"
+        output_parent = output_parent or first_dir.parent
+        merged_dir, _, lock = create_output_dir(output_parent, name_suffix)
+
+        try:
+            self.merge_files(shards, merged_dir)
+            if any(Path(shard_dir, CONDITIONS_NAME).is_file() for shard_dir, _ in shards):
+                self.merge_conditions(merged_dir, n_boot)  # the shards were run with --conditions
+            with atomic_output(merged_dir.joinpath(OUTPUT_SUMMARY_JSON_NAME)) as tmp, open(tmp, "w") as f:
+                json.dump(self.merged_metadata(shards), f, indent=True)
+        except Exception:
+            shutil.rmtree(merged_dir, ignore_errors=True)  # don't leave a partial merge behind
+            raise
+        finally:
+            lock.release()
+        return merged_dir
+
+    def main(self):
+        args = self.parseArgs()
+        LOGGER.info(f"starting execution of {self.SCRIPT_NAME} with {args=}")
+
+        shard_dirs = [Path(d).resolve() for d in args.shards]
+        not_dirs = [d for d in shard_dirs if not d.is_dir()]
+        if not_dirs:
+            return print(f"please provide paths to shard dirs, {not_dirs} aren't")
+
+        merged_dir = self.merge(shard_dirs, args.output, args.allow_partial, args.n_boot)
+        LOGGER.info(f"done execution of {self.SCRIPT_NAME}, results in {merged_dir}")
+
+
+if __name__ == "__main__":
+    MergeShardsScript().main()
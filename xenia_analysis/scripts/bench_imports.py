@@ -0,0 +1,118 @@
+"""Import time regression benchmark of the cli entry points.
+
+Each entry module is imported in a fresh interpreter, its import time is the
+median of a few runs, and the heavy libraries it must not pull in are checked.
+Exits with 1 if any entry imports what it shouldn't. Import times depend on the
+machine and its load, they are only reported, unless compared with the times
+of a baseline run on the same machine (--save, then --baseline).
+"""
+
+import sys
+import json
+import statistics
+import subprocess
+from pathlib import Path
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+
+SRC_DIR = Path(__file__, "..", "..").resolve()
+HEAVY_MODULES = ["numpy", "pandas", "scipy", "h5py", "plotly", "xlsxwriter"]
+
+# entry module -> heavy modules it may load at import time
+ENTRIES = {
+    "main": [],
+    "xenio": [],
+    "catalog": [],
+    "merge": [],
+    "server": [],
+    "viewer": [],
+    "sweep": [],
+    "exporters.h5_exporters": [],
+    "h5process": ["numpy", "pandas"],
+}
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+loaded = [m for m in {heavy!r} if m in sys.modules]
+print(elapsed, ",".join(loaded))
+"""
+
+
+def measure(module: str, repeat: int):
+    times, loaded = [], []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY_MODULES)],
+            cwd=SRC_DIR, capture_output=True, text=True, check=True,
+        ).stdout.split()
+        times.append(float(out[0]))
+        loaded = out[1].split(",") if len(out) > 1 else []
+    return statistics.median(times), loaded
+
+
+def parseArgs():
+    parser = ArgumentParser(
+        prog="Imports benchmark",
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        default=7, type=int,
+        help="imports per entry, the median one counts",
+    )
+    parser.add_argument(
+        "--save",
+        default=None, type=Path,
+        help="json file to save the import times to, a baseline for later runs",
+    )
+    parser.add_argument(
+        "--baseline",
+        default=None, type=Path,
+        help="json file of a --save run on the same machine, an entry slower than --tolerance times its time fails",
+    )
+    parser.add_argument(
+        "--tolerance",
+        default=1.5, type=float,
+        help="max ratio of an entry's import time to its baseline time",
+    )
+    parser.add_argument(
+        "entries",
+        nargs="*", default=list(ENTRIES),
+        help="entry modules to measure",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parseArgs()
+    baseline = json.loads(args.baseline.read_text()) if args.baseline else {}
+    times = {}
+    failed = False
+    for module in args.entries:
+        elapsed, loaded = measure(module, args.repeat)
+        times[module] = elapsed
+        allowed = ENTRIES.get(module, [])
+        unexpected = [m for m in loaded if m not in allowed]
+        compared = ""
+        over = False
+        if module in baseline:
+            ratio = elapsed / baseline[module]
+            over = ratio > args.tolerance
+            compared = f"  {ratio:4.2f}x baseline"
+        status = "FAIL" if unexpected or over else "ok"
+        failed |= status == "FAIL"
+        print(f"{status:4} {module:24} {elapsed * 1000:8.1f} ms{compared}  heavy: {','.join(loaded) or '-'}")
+        if unexpected:
+            print(f"     {module} should not import {', '.join(unexpected)}")
+
+    if args.save:
+        args.save.write_text(json.dumps(times, indent=2))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,225 @@
+import os
+import zlib
+import shutil
+import struct
 import zipfile
 import os.path
+import tempfile
 from pathlib import Path
+from datetime import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 
 
-def export_latest(output_dir: Path, name_suffix: str, name_filter: str):
-    print(f"Exporting source and dest: {output_dir}")
+# formats that are already compressed, deflating them again only burns cpu
+STORE_EXTS = {".xlsx", ".png", ".jpg", ".jpeg", ".zip", ".gz", ".mp4"}
+CHUNK_SIZE = 1024 * 1024
+SPOOL_MAX_SIZE = 64 * 1024 * 1024  # compressed members bigger than this spill to disk
+IN_FLIGHT_PER_WORKER = 2  # members compressed ahead of the writer, bounds the spooled memory
 
-    paths = [f for f in output_dir.iterdir() if f.is_dir() and name_filter in f.name]
-    latest = max(paths, key=os.path.getctime)
-    print(f"Exporting dir: {latest.name}")
+# zip format records (APPNOTE.TXT), little endian
+LOCAL_HEADER = struct.Struct("<4sHHHHHLLLHH")
+CENTRAL_HEADER = struct.Struct("<4sHHHHHHLLLHHHHHLL")
+END_RECORD = struct.Struct("<4sHHHHLLH")
+ZIP64_END_RECORD = struct.Struct("<4sQHHLLQQQQ")
+ZIP64_END_LOCATOR = struct.Struct("<4sLQL")
+ZIP64_EXTRA_ID = 0x0001
+UTF8_FLAG = 0x800
+VERSION = 20  # deflate
+ZIP64_VERSION = 45
+MAX_32 = 0xFFFFFFFF
+MAX_16 = 0xFFFF
+
+
+class CompressedMember:
+    def __init__(self, path: Path, arcname: str, compress_type: int):
+        self.path = path
+        self.arcname = arcname
+        self.compress_type = compress_type
+        self.crc = 0
+        self.file_size = 0
+        self.compress_size = 0
+        self.data = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+
+    def compress(self, level: int):
+        # raw deflate stream (no zlib header), as the zip format expects
+        compressor = (
+            zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+            if self.compress_type == zipfile.ZIP_DEFLATED
+            else None
+        )
+        with open(self.path, "rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                self.crc = zlib.crc32(chunk, self.crc)
+                self.file_size += len(chunk)
+                self.data.write(compressor.compress(chunk) if compressor else chunk)
+        if compressor:
+            self.data.write(compressor.flush())
+        self.compress_size = self.data.tell()
+        self.data.seek(0)
+        return self
+
+
+
+def _dos_datetime(timestamp: float):
+    t = datetime.fromtimestamp(timestamp)
+    if t.year < 1980:
+        return 0, (1 << 5) | 1  # 1980-01-01 00:00, the earliest a zip can hold
+    return (t.hour << 11) | (t.minute << 5) | (t.second // 2), ((t.year - 1980) << 9) | (t.month << 5) | t.day
+
+
+class ZipWriter:
+    """Writes a zip of already compressed members, with its own central directory.
+
+    zipfile compresses the data it's given, it can't take members compressed
+    in parallel ahead of time, so the records are written here (zip64 when
+    sizes, offsets or the entries count need it). read it back with zipfile.
+    """
+
+    def __init__(self, path: Path):
+        self.fp = open(path, "wb")
+        self.entries = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            if exc[0] is None:
+                self._write_central_directory()
+        finally:
+            self.fp.close()
+
+    def add(self, member: CompressedMember):
+        name = member.arcname.encode("utf-8")
+        flags = 0 if member.arcname.isascii() else UTF8_FLAG
+        stat = member.path.stat()
+        dos_time, dos_date = _dos_datetime(stat.st_mtime)
+        offset = self.fp.tell()
+
+        zip64 = max(member.file_size, member.compress_size) >= MAX_32
+        extra = struct.pack("<HHQQ", ZIP64_EXTRA_ID, 16, member.file_size, member.compress_size) if zip64 else b""
+        self.fp.write(LOCAL_HEADER.pack(
+            b"PK\x03\x04", ZIP64_VERSION if zip64 else VERSION, flags, member.compress_type,
+            dos_time, dos_date, member.crc,
+            MAX_32 if zip64 else member.compress_size, MAX_32 if zip64 else member.file_size,
+            len(name), len(extra),
+        ))
+        self.fp.write(name + extra)
+        shutil.copyfileobj(member.data, self.fp, CHUNK_SIZE)
+        member.data.close()
+        self.entries.append((name, flags, member, dos_time, dos_date, offset, (stat.st_mode & 0xFFFF) << 16))
+
+    def _write_central_directory(self):
+        start = self.fp.tell()
+        for name, flags, member, dos_time, dos_date, offset, external_attr in self.entries:
+            # the zip64 extra holds only the fields too big for their 32 bits, in this order
+            big = [v for v in (member.file_size, member.compress_size, offset) if v >= MAX_32]
+            extra = struct.pack(f"<HH{len(big)}Q", ZIP64_EXTRA_ID, 8 * len(big), *big) if big else b""
+            version = ZIP64_VERSION if big else VERSION
+            self.fp.write(CENTRAL_HEADER.pack(
+                b"PK\x01\x02", (3 << 8) | version, version, flags, member.compress_type,  # made on unix
+                dos_time, dos_date, member.crc,
+                min(member.compress_size, MAX_32), min(member.file_size, MAX_32),
+                len(name), len(extra), 0, 0, 0, external_attr, min(offset, MAX_32),
+            ))
+            self.fp.write(name + extra)
+        size = self.fp.tell() - start
+        count = len(self.entries)
+
+        if count >= MAX_16 or size >= MAX_32 or start >= MAX_32:
+            zip64_end = self.fp.tell()
+            self.fp.write(ZIP64_END_RECORD.pack(
+                b"PK\x06\x06", ZIP64_END_RECORD.size - 12, ZIP64_VERSION, ZIP64_VERSION, 0, 0, count, count, size, start,
+            ))
+            self.fp.write(ZIP64_END_LOCATOR.pack(b"PK\x06\x07", 0, zip64_end, 1))
+        self.fp.write(END_RECORD.pack(
+            b"PK\x05\x06", 0, 0, min(count, MAX_16), min(count, MAX_16), min(size, MAX_32), min(start, MAX_32), 0,
+        ))
 
-    name_suffix = "." + name_suffix.replace(' ', '-') if len(name_suffix)>0 else ""
-    name = f"{latest.name}{name_suffix}.zip"
-    zip_path = output_dir.joinpath(name)
 
-    with zipfile.ZipFile(zip_path, mode="w") as out:
-        for f in latest.iterdir():
-            if f.name.endswith("json"):
-                continue  # don't export metadata
-            out.write(f, arcname=f.name)
+def iter_members(run_dir: Path):
+    for f in sorted(run_dir.rglob("*")):
+        if not f.is_file():
+            continue
+        if any(part.startswith(".") for part in f.relative_to(run_dir).parts):
+            continue  # run internals (lock, checkpoints, scratch) and artifacts still being written
+        if f.parent == run_dir and f.name.endswith("json"):
+            continue  # don't export metadata
+        compress_type = (
+            zipfile.ZIP_STORED
+            if f.suffix.lower() in STORE_EXTS
+            else zipfile.ZIP_DEFLATED
+        )
+        yield CompressedMember(f, f.relative_to(run_dir).as_posix(), compress_type)
 
-    print(f"done creating {zip_path=}")
+
+def export_dir(run_dir: Path, zip_path: Path, pool: ThreadPoolExecutor, level: int, in_flight: int):
+    print(f"Exporting dir: {run_dir.name}")
+    start = datetime.now()
+
+    # zlib releases the GIL, so members compress in parallel; the archive is
+    # assembled in order as each member becomes ready. only `in_flight`
+    # members are compressed ahead, each holds its compressed data until written
+    members = iter_members(run_dir)
+    pending = deque()
+    count = 0
+    tmp_path = zip_path.with_name(f".{zip_path.name}.{os.getpid()}.tmp")
+    try:
+        with ZipWriter(tmp_path) as out:
+            while True:
+                for member in members:
+                    pending.append(pool.submit(member.compress, level))
+                    if len(pending) >= in_flight:
+                        break
+                if not pending:
+                    break
+                out.add(pending.popleft().result())
+                count += 1
+    except BaseException:
+        for future in pending:
+            future.cancel()
+        tmp_path.unlink(missing_ok=True)
+        raise
+    os.replace(tmp_path, zip_path)  # never a truncated zip under the final name
+
+    print(f"done creating {zip_path=} ({count} files) in {datetime.now() - start}")
+
+
+def get_run_dirs(output_dir: Path, name_filter: str, count: int):
+    paths = [
+        f for f in output_dir.iterdir()
+        if f.is_dir() and not f.name.startswith(".") and name_filter in f.name
+    ]
+    paths = sorted(paths, key=os.path.getctime, reverse=True)
+    return paths if count <= 0 else paths[:count]
+
+
+def export_latest(
+    output_dir: Path,
+    name_suffix: str,
+    name_filter: str,
+    count: int = 1,
+    workers: int = None,
+    level: int = zlib.Z_DEFAULT_COMPRESSION,
+):
+    print(f"Exporting source and dest: {output_dir}")
+
+    run_dirs = get_run_dirs(output_dir, name_filter, count)
+    if len(run_dirs) == 0:
+        print(f"no output dirs matching {name_filter=}")
+        return []
+
+    name_suffix = "." + name_suffix.replace(' ', '-') if len(name_suffix)>0 else ""
+    zip_paths = []
+    workers = workers or os.cpu_count()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for run_dir in run_dirs:
+            zip_path = output_dir.joinpath(f"{run_dir.name}{name_suffix}.zip")
+            export_dir(run_dir, zip_path, pool, level, in_flight=workers * IN_FLIGHT_PER_WORKER)
+            zip_paths.append(zip_path)
+    return zip_paths
 
 
 def parseArgs():
@@ -48,6 +246,24 @@ def parseArgs():
         default="",
         help="a filter of the dirs to look at at the output - look for dirs with this string in name"
     )
+    parser.add_argument(
+        "-c",
+        "--count",
+        default=1, type=int,
+        help="how many of the most recent (filter matching) dirs to export, each to its own zip. 0 exports all matching",
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        default=None, type=int,
+        help="number of compression threads, defaults to cpu count",
+    )
+    parser.add_argument(
+        "-l",
+        "--level",
+        default=zlib.Z_DEFAULT_COMPRESSION, type=int, choices=range(-1, 10),
+        help="deflate compression level, 1 is fastest and 9 smallest",
+    )
     return parser.parse_args()
 
 
@@ -60,7 +276,14 @@ def main():
         print(f"{output_dir} isn't.")
         return
 
-    export_latest(output_dir, args.name_suffix, args.name_filter)
+    export_latest(
+        output_dir,
+        args.name_suffix,
+        args.name_filter,
+        count=args.count,
+        workers=args.workers,
+        level=args.level,
+    )
 
 
 if __name__ == "__main__":
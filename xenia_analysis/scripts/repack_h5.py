@@ -0,0 +1,216 @@
+import os
+import time
+import shutil
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+import h5py
+import numpy as np
+
+
+H5_SUFFIX = ".analysis.h5"
+
+
+class Compression:
+    LZF = "lzf"
+    GZIP = "gzip"
+    NONE = "none"
+
+    ALL = [LZF, GZIP, NONE]
+
+
+def time_axis(shape: tuple, n_frames: int):
+    """The axis of a dataset that runs over the frames, None if there isn't one."""
+    if n_frames <= 1:
+        return None
+    # tracks, point_scores.. have the frames last, track_occupancy first
+    for axis in (len(shape) - 1, 0):
+        if len(shape) > 0 and shape[axis] == n_frames:
+            return axis
+    return None
+
+
+def read_window_secs(path: Path, start: int, frames: int, repeat: int):
+    # best of `repeat` reads of a time window of the tracks
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        with h5py.File(path, "r") as f:
+            f["tracks"][..., start : start + frames]
+        elapsed = time.perf_counter() - t
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def same_values(a, b):
+    if isinstance(a, np.ndarray) and a.dtype.kind == "f":
+        return a.shape == b.shape and np.array_equal(a, b, equal_nan=True)
+    return np.array_equal(np.asarray(a, dtype=object), np.asarray(b, dtype=object))
+
+
+def verify(original: Path, repacked: Path):
+    """Raises if a dataset or an attribute of the original differs in the repacked file."""
+    with h5py.File(original, "r") as fin, h5py.File(repacked, "r") as fout:
+        for obj in (fin, *(fin[k] for k in fin)):
+            other = fout[obj.name]
+            for key, value in obj.attrs.items():
+                if not same_values(value, other.attrs[key]):
+                    raise ValueError(f"attribute {obj.name}:{key} differs")
+            if not isinstance(obj, h5py.Dataset):
+                continue
+            if obj.shape != other.shape or obj.dtype != other.dtype:
+                raise ValueError(f"{obj.name} is {other.shape} {other.dtype}, expected {obj.shape} {obj.dtype}")
+            if not same_values(obj[()], other[()]):
+                raise ValueError(f"{obj.name} values differ")
+
+
+def repack_file(src: Path, dest_dir: Path, compression: str, level: int, chunk_frames: int, check: bool, bench_frames: int):
+    dest = Path(dest_dir, src.name)
+    tmp = Path(dest_dir, f".{src.name}.tmp")
+    opts = {}
+    if compression == Compression.GZIP:
+        opts = dict(compression="gzip", compression_opts=level, shuffle=True)
+    elif compression == Compression.LZF:
+        opts = dict(compression="lzf", shuffle=True)
+
+    start = time.perf_counter()
+    try:
+        with h5py.File(src, "r") as fin, h5py.File(tmp, "w") as fout:
+            n_frames = fin["tracks"].shape[-1] if "tracks" in fin else 0
+            fout.attrs.update(fin.attrs)
+            for key in fin:
+                obj = fin[key]
+                axis = time_axis(obj.shape, n_frames) if isinstance(obj, h5py.Dataset) else None
+                if axis is None or obj.dtype.kind not in "biuf":
+                    fin.copy(obj, fout, name=key)  # small or not numeric, as is
+                    continue
+                chunks = list(obj.shape)
+                chunks[axis] = min(chunk_frames, n_frames)
+                out = fout.create_dataset(key, data=obj[()], chunks=tuple(chunks), **opts)
+                out.attrs.update(obj.attrs)
+        repack_secs = time.perf_counter() - start
+
+        if check:
+            verify(src, tmp)  # before replacing, a failed check leaves a previous repack in place
+        os.replace(tmp, dest)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+    window = min(bench_frames, n_frames)
+    window_start = max(0, n_frames // 2 - window // 2)
+    return dict(
+        name=src.name,
+        frames=n_frames,
+        size=src.stat().st_size,
+        repacked_size=dest.stat().st_size,
+        repack_secs=repack_secs,
+        read_secs=read_window_secs(src, window_start, window, repeat=3),
+        repacked_read_secs=read_window_secs(dest, window_start, window, repeat=3),
+    )
+
+
+class RepackH5Script:
+    SCRIPT_NAME = "h5 xenia repack"
+
+    def parseArgs(self):
+        parser = ArgumentParser(
+            prog=self.SCRIPT_NAME,
+            formatter_class=ArgumentDefaultsHelpFormatter,
+            description="rewrites analysis h5 files chunked along the time axis and compressed, "
+            "for fast reads of time windows (e.g. over nfs)",
+        )
+        # fmt: off
+        parser.add_argument("-i", "--input",
+            required=True, type=Path,
+            help="path of the inputs dir",
+        )
+        parser.add_argument("-o", "--output",
+            default=None, type=Path,
+            help="dir to write the repacked files (and a copy of details.json) to, defaults to <input>_repacked",
+        )
+        parser.add_argument("-c", "--compression",
+            default=Compression.LZF, choices=Compression.ALL,
+            help="lzf is fast, gzip is smaller",
+        )
+        parser.add_argument("-l", "--level",
+            default=4, type=int, choices=range(0, 10),
+            help="gzip compression level",
+        )
+        parser.add_argument("--chunk-frames",
+            default=4096, type=int,
+            help="frames per chunk along the time axis",
+        )
+        parser.add_argument("--bench-frames",
+            default=1200, type=int,
+            help="frames of the time window read to compare the read speed (1 min at 20fps)",
+        )
+        parser.add_argument("--no-verify",
+            default=False, action="store_true",
+            help="don't compare the repacked files to the originals",
+        )
+        parser.add_argument("-j", "--workers",
+            default=None, type=int,
+            help="number of files repacked in parallel, defaults to cpu count",
+        )
+        # fmt: on
+        return parser.parse_args()
+
+    @staticmethod
+    def report(results: list):
+        def mb(n):
+            return f"{n / 1024 / 1024:8.1f}MB"
+
+        for r in results:
+            print(
+                f"{r['name']}: {mb(r['size'])} -> {mb(r['repacked_size'])} "
+                f"({r['repacked_size'] / r['size']:.0%}), window read "
+                f"{r['read_secs'] * 1000:.1f}ms -> {r['repacked_read_secs'] * 1000:.1f}ms"
+            )
+        size = sum(r["size"] for r in results)
+        repacked = sum(r["repacked_size"] for r in results)
+        read = sum(r["read_secs"] for r in results)
+        repacked_read = sum(r["repacked_read_secs"] for r in results)
+        print("+" * 100)
+        print(f"total: {mb(size)} -> {mb(repacked)} ({repacked / size:.0%} of the size)")
+        print(f"window reads: {read:.3f}s -> {repacked_read:.3f}s ({read / repacked_read:.1f}x)")
+
+    def main(self):
+        args = self.parseArgs()
+        print(f"starting execution of {self.SCRIPT_NAME} with {args=}")
+        print("+" * 100)
+
+        if not args.input.is_dir():
+            return print("please provide a path to a dir")
+        output = args.output or Path(args.input.parent, f"{args.input.name}_repacked")
+        output.mkdir(exist_ok=True)
+
+        files = sorted(args.input.glob(f"*{H5_SUFFIX}"))
+        details = args.input.joinpath("details.json")
+        if details.is_file():
+            shutil.copy2(details, output)
+
+        results = []
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            futures = {
+                pool.submit(
+                    repack_file, f, output, args.compression, args.level,
+                    args.chunk_frames, not args.no_verify, args.bench_frames,
+                ): f
+                for f in files
+            }
+            for future, f in futures.items():
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    print(f"failed to repack {f.name}: {e!r}")
+
+        if results:
+            self.report(results)
+        print("+" * 100)
+        print(f"done execution of {self.SCRIPT_NAME}, {len(results)}/{len(files)} files in {output}")
+
+
+if __name__ == "__main__":
+    RepackH5Script().main()
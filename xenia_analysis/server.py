@@ -0,0 +1,336 @@
+"""Local processing server, runs main.py jobs in warm worker processes.
+
+The workers import the pipeline once and keep the recently read tracks in an
+LRU, so many small jobs don't pay the imports and the h5 reads every time.
+Only listens on the loopback interface or on a unix socket.
+"""
+
+import io
+import os
+import json
+import logging
+import uuid
+import socket
+import tempfile
+import threading
+import contextlib
+from pathlib import Path
+from datetime import datetime
+from socketserver import ThreadingMixIn, UnixStreamServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ProcessPoolExecutor
+
+from logger import getLogger, get_log_queue, init_worker_logging
+
+LOGGER = getLogger(__name__)
+
+
+LOCAL_HOSTS = {"127.0.0.1", "localhost", "::1"}
+DEFAULT_PORT = 8765
+JOB_TTL_SECS = 60 * 60  # finished jobs nobody asked about are dropped after this
+
+
+class JobKeys:
+    JOB = "job"
+    STATUS = "status"
+    INPUT = "input"
+    DETAILS = "details"
+    ARGS = "args"
+    WAIT = "wait"
+    OUTPUT_DIR = "output_dir"
+    FAILED = "failed"
+    ERROR = "error"
+    SUBMITTED = "submitted"
+    DURATION = "duration_secs"
+    CACHE = "cache"
+
+
+class JobStatus:
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+# per worker process, set by _init_worker
+_TRACKS_CACHE = None
+
+
+def _init_worker(cache_bytes: int, log_queue, log_level: int):
+    global _TRACKS_CACHE
+    init_worker_logging(log_queue, log_level)
+    # warm up: the heavy imports happen once per worker, not once per job
+    import h5process
+    import exporters.h5_exporters
+    import exporters.dist_exporters
+    import exporters.peak_exporters
+    import exporters.excel_exporters
+    import exporters.synchrony_exporters
+
+    _TRACKS_CACHE = h5process.TracksCache(cache_bytes)
+
+
+def _run_job(argv: list):
+    import main
+
+    start = datetime.now()
+    output_dir, failed = main.run(main.parseArgs(argv), tracks_cache=_TRACKS_CACHE)
+    return {
+        JobKeys.OUTPUT_DIR: str(output_dir),
+        JobKeys.FAILED: failed,
+        JobKeys.DURATION: (datetime.now() - start).total_seconds(),
+        JobKeys.CACHE: _TRACKS_CACHE.stats(),
+    }
+
+
+class JobsManager:
+    def __init__(self, workers: int, cache_bytes: int, spool_dir: Path):
+        self.pool = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(cache_bytes, get_log_queue(), logging.getLogger().level),
+        )
+        self.workers = workers
+        self.spool_dir = spool_dir
+        self.jobs = {}
+        self._lock = threading.Lock()
+
+    def build_argv(self, job_id: str, request: dict):
+        """main.py args of a job request, raises ValueError if they don't parse."""
+        import main
+
+        if not request.get(JobKeys.INPUT):
+            raise ValueError(f"'{JobKeys.INPUT}' (the data dir) is required")
+        argv = ["-i", str(request[JobKeys.INPUT])]
+
+        details = request.get(JobKeys.DETAILS)
+        if isinstance(details, dict):
+            # inline details.json, kept in the spool dir for the job's metadata
+            details_path = Path(self.spool_dir, f"{job_id}.details.json")
+            with open(details_path, "w") as f:
+                json.dump(details, f, indent=True)
+            argv += ["--details", str(details_path)]
+        elif details:
+            argv += ["--details", str(details)]
+
+        extra = request.get(JobKeys.ARGS, [])
+        if not isinstance(extra, list):
+            raise ValueError(f"'{JobKeys.ARGS}' should be a list of main.py arguments")
+        argv += [str(a) for a in extra]
+
+        stderr = io.StringIO()
+        try:
+            with contextlib.redirect_stderr(stderr):
+                parsed = main.parseArgs(argv)
+        except SystemExit:
+            raise ValueError(stderr.getvalue().strip().splitlines()[-1])
+        if parsed.keep_last is not None or parsed.keep_days is not None:
+            # a job only writes its own output dir, never deletes other runs
+            raise ValueError("retention args (--keep-last, --keep-days, --delete-all-other-outputs) aren't allowed in jobs")
+        return argv
+
+    def _evict_expired(self):
+        now = datetime.now()
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self.jobs.items()
+                if job["future"].done() and (now - job["submitted_at"]).total_seconds() > JOB_TTL_SECS
+            ]
+            for job_id in expired:
+                del self.jobs[job_id]
+        if expired:
+            LOGGER.info(f"dropped {len(expired)} finished jobs older than {JOB_TTL_SECS} secs")
+
+    def submit(self, request: dict):
+        self._evict_expired()
+        job_id = uuid.uuid4().hex[:12]
+        argv = self.build_argv(job_id, request)
+        LOGGER.info(f"job {job_id}: {argv}")
+        with self._lock:
+            submitted_at = datetime.now()
+            self.jobs[job_id] = {
+                "submitted_at": submitted_at,
+                JobKeys.SUBMITTED: submitted_at.isoformat(),
+                "future": self.pool.submit(_run_job, argv),
+            }
+        return job_id
+
+    def status(self, job_id: str, wait: bool = False):
+        """The job's status, a finished job is dropped once its status is read."""
+        with self._lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            return None
+
+        future = job["future"]
+        status = {JobKeys.JOB: job_id, JobKeys.SUBMITTED: job[JobKeys.SUBMITTED]}
+        if wait or future.done():
+            try:
+                status.update(future.result())
+                status[JobKeys.STATUS] = JobStatus.FAILED if status[JobKeys.FAILED] else JobStatus.DONE
+            except Exception as e:
+                LOGGER.error(f"job {job_id} failed", exc_info=True)
+                status[JobKeys.STATUS] = JobStatus.FAILED
+                status[JobKeys.ERROR] = repr(e)
+            with self._lock:
+                self.jobs.pop(job_id, None)
+        else:
+            status[JobKeys.STATUS] = JobStatus.RUNNING if future.running() else JobStatus.QUEUED
+        return status
+
+    def summary(self):
+        with self._lock:
+            futures = [job["future"] for job in self.jobs.values()]
+        return {
+            JobKeys.STATUS: "ok",
+            "workers": self.workers,
+            "jobs": len(futures),
+            "pending": sum(not f.done() for f in futures),
+        }
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+class JobsRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET  /health          server status
+    POST /jobs            {"input": data dir, "details": path or inline json (optional),
+                           "args": [main.py args], "wait": false} -> job status
+    GET  /jobs/<id>       job status, with the output dir once done (then the job is forgotten)
+
+    POSTs must be application/json and not come from a web page (no Origin
+    header), so a page open in the browser can't start jobs.
+    """
+
+    jobs: JobsManager = None
+
+    def _reply(self, code: int, body: dict):
+        data = json.dumps(body, indent=True).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if parts == ["health"]:
+            return self._reply(200, self.jobs.summary())
+        if len(parts) == 2 and parts[0] == "jobs":
+            status = self.jobs.status(parts[1])
+            if status is None:
+                return self._reply(404, {JobKeys.ERROR: f"no job {parts[1]}"})
+            return self._reply(200, status)
+        self._reply(404, {JobKeys.ERROR: f"unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path.strip("/") != "jobs":
+            return self._reply(404, {JobKeys.ERROR: f"unknown path {self.path}"})
+        if self.headers.get("Origin") is not None:
+            return self._reply(403, {JobKeys.ERROR: "cross origin requests aren't allowed"})
+        if self.headers.get_content_type() != "application/json":
+            return self._reply(415, {JobKeys.ERROR: "expected an application/json body"})
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            job_id = self.jobs.submit(request)
+        except ValueError as e:  # bad json or bad job args
+            return self._reply(400, {JobKeys.ERROR: str(e)})
+        wait = bool(request.get(JobKeys.WAIT))
+        self._reply(200 if wait else 202, self.jobs.status(job_id, wait=wait))
+
+    def log_message(self, format, *args):
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug(f"{self.command} {self.path}: " + format % args)
+
+
+class ThreadingHTTPServerV6(ThreadingHTTPServer):
+    address_family = socket.AF_INET6
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ("local", 0)  # the handler expects a (host, port) address
+
+
+class ServerScript:
+    SCRIPT_NAME = "processing server"
+    description = f"""
+        \nExamples:
+        \tpython {Path(__file__).name} -j 2  # http://127.0.0.1:{DEFAULT_PORT}
+        \tpython {Path(__file__).name} --socket /tmp/xenia.sock
+        \tcurl -s localhost:{DEFAULT_PORT}/jobs -H "Content-Type: application/json" -d '{{"input": "data/example", "args": ["--gen-csv"], "wait": true}}'
+    """
+
+    def parseArgs(self):
+        from argparse import ArgumentParser, RawDescriptionHelpFormatter
+
+        parser = ArgumentParser(
+            prog=self.SCRIPT_NAME,
+            formatter_class=RawDescriptionHelpFormatter,
+            description=self.description,
+        )
+        # fmt: off
+        parser.add_argument("--host",
+            default="127.0.0.1", choices=sorted(LOCAL_HOSTS),
+            help="loopback address to listen on",
+        )
+        parser.add_argument("-p", "--port",
+            default=DEFAULT_PORT, type=int,
+        )
+        parser.add_argument("--socket",
+            default=None, type=Path,
+            help="listen on this unix socket instead of a tcp port",
+        )
+        parser.add_argument("-j", "--workers",
+            default=1, type=int,
+            help="number of worker processes, each with its own tracks cache",
+        )
+        parser.add_argument("--cache-mb",
+            default=1024, type=int,
+            help="max size of the tracks cache of each worker",
+        )
+        # fmt: on
+        return parser.parse_args()
+
+    def make_server(self, args):
+        if args.socket is not None:
+            with contextlib.suppress(FileNotFoundError):
+                if args.socket.is_socket():
+                    args.socket.unlink()  # stale, from a previous server
+            server = ThreadingUnixHTTPServer(str(args.socket), JobsRequestHandler)
+            os.chmod(args.socket, 0o600)
+            return server, f"unix:{args.socket}"
+
+        server_class = ThreadingHTTPServerV6 if args.host == "::1" else ThreadingHTTPServer
+        server = server_class((args.host, args.port), JobsRequestHandler)
+        return server, f"http://{args.host}:{server.server_port}"
+
+    def main(self):
+        args = self.parseArgs()
+        LOGGER.info(f"starting {self.SCRIPT_NAME} with {args=}")
+
+        with tempfile.TemporaryDirectory(prefix="xenia-server.") as spool_dir:
+            JobsRequestHandler.jobs = JobsManager(
+                args.workers, args.cache_mb * 1024 * 1024, Path(spool_dir)
+            )
+            server, address = self.make_server(args)
+            LOGGER.info(f"listening on {address}")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                LOGGER.info("stopping")
+            finally:
+                server.server_close()
+                JobsRequestHandler.jobs.shutdown()
+                if args.socket is not None:
+                    with contextlib.suppress(FileNotFoundError):
+                        args.socket.unlink()
+
+
+if __name__ == "__main__":
+    ServerScript().main()
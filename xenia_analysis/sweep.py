@@ -0,0 +1,164 @@
+"""Sweep of the peak detection params over all the input files, reusing the
+per file normalized distances for every params combination."""
+
+import os
+import itertools
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+from logger import getLogger, get_log_queue, init_worker_logging
+from xenio import InputsLoader
+
+LOGGER = getLogger(__name__)
+
+
+class SweepKeys:
+    FILE = "file"
+    TENTACLE = "tentacle"
+    PERCENT = "percent"
+    PROMINENCE = "prominence"
+    WIDTH = "width_secs"
+    DISTANCE = "distance_secs"
+    PEAKS = "peaks"
+    PEAKS_PER_MIN = "peaks_per_min"
+    MEAN_RHYTHM = "mean_pulse_rate_hz"
+
+
+def _sweep_chunk(moving_avgs: dict, framerate: int, duration_mins: float, combos: list):
+    # runs in a worker process: every params combination of the chunk on every tentacle
+    import numpy as np
+    from h5process import H5Processor
+    from analysis.rhythm import instantaneous_rates
+
+    rows = []
+    for percent, prominence, width_secs, distance_secs in combos:
+        params = dict(
+            percent=percent,
+            prominence=prominence,
+            width=width_secs * framerate,
+            distance=max(1, distance_secs * framerate),
+        )
+        peaks = {
+            tentacle: H5Processor._detect_peaks(moving_avg, **params) / framerate
+            for tentacle, moving_avg in moving_avgs.items()
+        }
+        _, rates, offsets = instantaneous_rates(list(peaks.values()))
+        for i, (tentacle, timestamps) in enumerate(peaks.items()):
+            tentacle_rates = rates[offsets[i] : offsets[i + 1]]
+            rows.append((
+                tentacle, percent, prominence, width_secs, distance_secs,
+                len(timestamps),
+                len(timestamps) / duration_mins if duration_mins else np.nan,
+                np.nanmean(tentacle_rates) if np.isfinite(tentacle_rates).any() else np.nan,
+            ))
+    return rows
+
+
+class PeakSweepScript:
+    SCRIPT_NAME = "peaks params sweep"
+    description = f"""
+        \nExamples:
+        \tpython {Path(__file__).name} -i data/example --prominence 0.05 0.1 0.2 --width-secs 0.25 0.5 1
+    """
+
+    def parseArgs(self):
+        from argparse import ArgumentParser, RawDescriptionHelpFormatter
+
+        parser = ArgumentParser(
+            prog=self.SCRIPT_NAME,
+            formatter_class=RawDescriptionHelpFormatter,
+            description=self.description,
+        )
+        # fmt: off
+        parser.add_argument("-i", "--input",
+            required=True,
+            help="path of the input dir with details.json",
+        )
+        parser.add_argument("-o", "--output",
+            default=None, type=Path,
+            help="csv path of the sweep table, defaults to outputs/<timestamp>.peak-sweep.csv",
+        )
+        parser.add_argument("--percent", nargs="+", type=float, default=[95],
+            help="percentiles the moving avg is normalized by",
+        )
+        parser.add_argument("--prominence", nargs="+", type=float, default=[0.1])
+        parser.add_argument("--width-secs", nargs="+", type=float, default=[0.5])
+        parser.add_argument("--distance-secs", nargs="+", type=float, default=[1])
+        parser.add_argument("--no-aggs",
+            default=False, action="store_true",
+            help="don't sweep the tentacles aggs (average, median, variance)",
+        )
+        parser.add_argument("-j", "--workers",
+            default=None, type=int,
+            help="number of worker processes, defaults to cpu count",
+        )
+        # fmt: on
+        return parser.parse_args()
+
+    @staticmethod
+    def sweep_file(pool, input_dir, file_details, combos: list, with_aggs: bool, workers: int):
+        from h5process import H5Processor
+
+        processor = H5Processor(input_dir, file_details)
+        dists_df, aggs_df = processor.normalized_dists()
+        moving_avgs = processor._peaks_moving_avgs(dists_df)
+        if with_aggs:
+            moving_avgs.update(processor._peaks_moving_avgs(aggs_df))
+        duration_mins = dists_df.shape[1] / processor.framerate / 60
+
+        n_chunks = max(1, min(len(combos), workers))
+        chunks = [combos[i::n_chunks] for i in range(n_chunks)]
+        futures = [
+            pool.submit(_sweep_chunk, moving_avgs, processor.framerate, duration_mins, chunk)
+            for chunk in chunks
+        ]
+        return processor.shortname, futures
+
+    def main(self):
+        args = self.parseArgs()
+        LOGGER.info(f"starting execution of {self.SCRIPT_NAME} with {args=}")
+        # heavy imports after parsing, so --help and bad args are quick
+        import pandas as pd
+
+        combos = list(itertools.product(args.percent, args.prominence, args.width_secs, args.distance_secs))
+        inputs = InputsLoader(args.input).get_inputs()
+        workers = args.workers or os.cpu_count()
+        LOGGER.info(f"sweeping {len(combos)} params combinations over {len(inputs)} files")
+
+        rows = []
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=init_worker_logging, initargs=(get_log_queue(),)
+        ) as pool:
+            # files are prepared one by one here while the workers sweep the previous ones
+            pending = []
+            for file_details in inputs:
+                try:
+                    pending.append(
+                        self.sweep_file(pool, args.input, file_details, combos, not args.no_aggs, workers)
+                    )
+                except Exception:
+                    LOGGER.error(f"failed to process file: {file_details}", exc_info=True)
+            for shortname, futures in pending:
+                for future in futures:
+                    rows.extend((shortname, *row) for row in future.result())
+
+        table = pd.DataFrame(rows, columns=[
+            SweepKeys.FILE, SweepKeys.TENTACLE, SweepKeys.PERCENT, SweepKeys.PROMINENCE,
+            SweepKeys.WIDTH, SweepKeys.DISTANCE, SweepKeys.PEAKS, SweepKeys.PEAKS_PER_MIN,
+            SweepKeys.MEAN_RHYTHM,
+        ]).sort_values([
+            SweepKeys.FILE, SweepKeys.TENTACLE, SweepKeys.PERCENT, SweepKeys.PROMINENCE,
+            SweepKeys.WIDTH, SweepKeys.DISTANCE,
+        ])
+
+        output = args.output or Path(
+            Path(__file__, "..", "..", "outputs").resolve(),
+            f"{datetime.now().strftime('%Y-%m-%dT%H:%M:%S')}.peak-sweep.csv",
+        )
+        table.to_csv(output, index=False)
+        LOGGER.info(f"done execution of {self.SCRIPT_NAME}, {len(table)} rows in {output}")
+
+
+if __name__ == "__main__":
+    PeakSweepScript().main()
@@ -0,0 +1,259 @@
+"""Local zoomable viewer of the distances pyramids (ExportDistsPyramid) of the outputs.
+
+The page asks for the current x range on every zoom/pan and gets back only the
+pyramid level that fits it in a bounded number of points, so recordings of
+any length stay interactive. Only listens on the loopback interface. The
+pyramids are exported by main.py --pyramids.
+"""
+
+import html
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+from string import Template
+from urllib.parse import urlparse, parse_qs, quote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from logger import getLogger
+from server import LOCAL_HOSTS, ThreadingHTTPServerV6
+
+LOGGER = getLogger(__name__)
+
+
+DEFAULT_PORT = 8766
+PYRAMID_SUFFIX = ".pyramid"
+PYRAMIDS_TTL_SECS = 10  # the outputs dir is rescanned at most this often, new runs show up after it
+
+PAGE = Template("""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>$name</title>
+<script src="/plotly.min.js"></script></head>
+<body style="font-family: sans-serif">
+<a href="/">all recordings</a> | $links
+<div id="plot" style="height: 88vh"></div>
+<script>
+const NAME = $name_json, GROUP = $group_json, POINTS = $points;
+const plot = document.getElementById("plot");
+let latest = 0;
+
+async function load(range) {
+  const request = ++latest;
+  const query = new URLSearchParams({p: NAME, group: GROUP, points: POINTS});
+  if (range) {
+    query.set("start", range[0] * 60);
+    query.set("stop", range[1] * 60);
+  }
+  const data = await (await fetch("/data?" + query)).json();
+  if (request !== latest) return;  // zoomed again meanwhile
+  const traces = data.labels.map((label, i) => ({
+    x: data.x, y: data.y[i], name: label, mode: "lines", type: "scattergl",
+  }));
+  await Plotly.react(plot, traces, {
+    title: {text: NAME + " " + GROUP + " (" + data.bucket + " frames per point)"},
+    xaxis: {title: {text: "Time [min]"}},
+    yaxis: {title: {text: "Normalized distance"}},
+    uirevision: "keep",
+  });
+}
+
+load(null).then(() => plot.on("plotly_relayout", (event) => {
+  if (event["xaxis.range[0]"] !== undefined) {
+    load([event["xaxis.range[0]"], event["xaxis.range[1]"]]);
+  } else if (event["xaxis.autorange"]) {
+    load(null);
+  }
+}));
+</script></body></html>
+""")
+
+
+def _nan_to_none(values):
+    return [None if v != v else v for v in values.tolist()]
+
+
+class ViewerRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET /                        the pyramids under the outputs dir
+    GET /view?p=<name>&group=    zoomable plot of a pyramid group
+    GET /data?p=<name>&group=&start=&stop=&points=
+                                 the level fitting [start, stop] (secs) in `points`
+    """
+
+    root: Path = None
+    max_points: int = 4000
+    _plotlyjs: bytes = None
+    _pyramids: dict = None
+    _pyramids_at: float = 0
+    _pyramids_lock = threading.Lock()
+
+    def _reply(self, code: int, body: bytes, content_type: str):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _reply_json(self, code: int, body: dict):
+        self._reply(code, json.dumps(body).encode(), "application/json")
+
+    def _reply_html(self, page: str):
+        self._reply(200, page.encode(), "text/html; charset=utf-8")
+
+    @classmethod
+    def pyramids(cls):
+        # output dir relative name -> pyramid dir, looked up by name so no other path is served.
+        # cached, every zoom is a /data request and the outputs dir can be large
+        with cls._pyramids_lock:
+            if cls._pyramids is None or time.monotonic() - cls._pyramids_at > PYRAMIDS_TTL_SECS:
+                cls._pyramids = {
+                    p.relative_to(cls.root).as_posix(): p
+                    for p in sorted(cls.root.rglob(f"*{PYRAMID_SUFFIX}"))
+                    if p.is_dir() and not any(part.startswith(".") for part in p.relative_to(cls.root).parts)
+                }
+                cls._pyramids_at = time.monotonic()
+            return cls._pyramids
+
+    def _pyramid(self, query: dict):
+        from analysis.pyramid import Pyramid
+
+        path = self.pyramids().get(query.get("p", [""])[0])
+        if path is None:
+            raise KeyError(f"no pyramid {query.get('p')}")
+        pyramid = Pyramid(path)
+        group = query.get("group", [next(iter(pyramid.groups))])[0]
+        if group not in pyramid.groups:
+            raise KeyError(f"no group {group}, has {list(pyramid.groups)}")
+        return pyramid, group
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        try:
+            if url.path == "/":
+                return self._index()
+            if url.path == "/plotly.min.js":
+                return self._plotly()
+            if url.path == "/view":
+                return self._view(query)
+            if url.path == "/data":
+                return self._data(query)
+        except KeyError as e:
+            return self._reply_json(404, {"error": e.args[0]})
+        except ValueError as e:
+            return self._reply_json(400, {"error": str(e)})
+        self._reply_json(404, {"error": f"unknown path {url.path}"})
+
+    def _index(self):
+        items = "".join(
+            f'<li><a href="/view?p={quote(name)}">{html.escape(name.removesuffix(PYRAMID_SUFFIX))}</a></li>'
+            for name in self.pyramids()
+        )
+        self._reply_html(f"<html><body style='font-family: sans-serif'><ul>{items or 'no pyramids yet'}</ul></body></html>")
+
+    def _plotly(self):
+        if ViewerRequestHandler._plotlyjs is None:
+            from plotly.offline import get_plotlyjs
+
+            ViewerRequestHandler._plotlyjs = get_plotlyjs().encode()
+        self._reply(200, self._plotlyjs, "application/javascript")
+
+    def _view(self, query: dict):
+        pyramid, group = self._pyramid(query)
+        name = query["p"][0]
+        links = " | ".join(f'<a href="/view?p={quote(name)}&group={quote(g)}">{html.escape(g)}</a>' for g in pyramid.groups)
+        self._reply_html(PAGE.substitute(
+            name=html.escape(name),
+            links=links,
+            name_json=json.dumps(name),
+            group_json=json.dumps(group),
+            points=self.max_points,
+        ))
+
+    def _data(self, query: dict):
+        import numpy as np
+
+        pyramid, group = self._pyramid(query)
+
+        def number(key, default):
+            return float(query[key][0]) if key in query else default
+
+        points = min(int(number("points", self.max_points)), self.max_points)
+        bucket, times, mins, maxs = pyramid.window(
+            group, number("start", None), number("stop", None), max_points=points
+        )
+        x = times / 60
+        if bucket == 1:
+            ys = mins
+        else:
+            # min and max of every bucket one after the other, the line spans the bucket's range
+            x = x.repeat(2)
+            ys = [np.stack([lo, hi], axis=-1).ravel() for lo, hi in zip(mins, maxs)]
+        self._reply_json(200, {
+            "bucket": bucket,
+            "labels": pyramid.groups[group]["labels"],
+            "x": x.tolist(),
+            "y": [_nan_to_none(y) for y in ys],
+        })
+
+    def log_message(self, format, *args):
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug(f"{self.command} {self.path}: " + format % args)
+
+
+class ViewerScript:
+    SCRIPT_NAME = "pyramid viewer"
+    description = f"""
+        \nExamples:
+        \tpython {Path(__file__).name}  # http://127.0.0.1:{DEFAULT_PORT}, all the outputs
+        \tpython {Path(__file__).name} -d ../outputs/2025-03-04T15:46:24_my-new-h5s
+    """
+
+    def parseArgs(self):
+        from argparse import ArgumentParser, RawDescriptionHelpFormatter
+
+        parser = ArgumentParser(
+            prog=self.SCRIPT_NAME,
+            formatter_class=RawDescriptionHelpFormatter,
+            description=self.description,
+        )
+        # fmt: off
+        parser.add_argument("-d", "--dir",
+            default=Path(__file__, "..", "..", "outputs").resolve(), type=Path,
+            help="outputs dir (or a single run's output dir) to serve the pyramids of",
+        )
+        parser.add_argument("--host",
+            default="127.0.0.1", choices=sorted(LOCAL_HOSTS),
+            help="loopback address to listen on",
+        )
+        parser.add_argument("-p", "--port",
+            default=DEFAULT_PORT, type=int,
+        )
+        parser.add_argument("--max-points",
+            default=4000, type=int,
+            help="max points per trace sent to the browser",
+        )
+        # fmt: on
+        return parser.parse_args()
+
+    def main(self):
+        args = self.parseArgs()
+        LOGGER.info(f"starting {self.SCRIPT_NAME} with {args=}")
+        if not args.dir.is_dir():
+            return LOGGER.error(f"{args.dir} is not a dir")
+
+        ViewerRequestHandler.root = args.dir.resolve()
+        ViewerRequestHandler.max_points = args.max_points
+        server_class = ThreadingHTTPServerV6 if args.host == "::1" else ThreadingHTTPServer
+        server = server_class((args.host, args.port), ViewerRequestHandler)
+        LOGGER.info(f"listening on http://{args.host}:{server.server_port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            LOGGER.info("stopping")
+        finally:
+            server.server_close()
+
+
+if __name__ == "__main__":
+    ViewerScript().main()
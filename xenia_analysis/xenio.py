@@ -1,12 +1,19 @@
 """Module managing input/output (xenia-io) behaviors around the data."""
 
+import os
 import re
 import json
+import errno
 import random
+import pickle
 import shutil
+import hashlib
 import platform
+import tempfile
+import contextlib
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 
 from logger import getLogger, log_runtime
 
@@ -15,9 +22,231 @@ LOGGER = getLogger(__name__)
 
 INPUT_CONFIG_JSON_NAME = "details.json"
 OUTPUT_SUMMARY_JSON_NAME = "metadata.json"
+INPUTS_STORE_DIR_NAME = ".inputs-store"
+INPUTS_CHECKSUMS_NAME = "checksums.sha256"
+SCRATCH_DIR_NAME = ".scratch"
+CHECKPOINTS_DIR_NAME = ".checkpoints"
+RUN_LOG_NAME = "run.log.jsonl"
+RUN_LOCK_NAME = ".run.lock"
+OUTPUTS_LOCK_NAME = ".outputs.lock"
+TMP_MARK = ".tmp"
+DELETING_PREFIX = ".deleting."
+STORE_GRACE_SECS = 60 * 60
+OUTPUT_DIRNAME_REGEX = re.compile(r"^(?P<timestamp>\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})_")
 NAMES_SALT = ['black', 'navy', 'darkblue', 'mediumblue', 'blue', 'darkgreen', 'green', 'teal', 'darkcyan', 'deepskyblue', 'darkturquoise', 'mediumspringgreen', 'lime', 'springgreen', 'aqua', 'cyan', 'midnightblue', 'dodgerblue', 'lightseagreen', 'forestgreen', 'seagreen', 'darkslategray', 'darkslategrey', 'limegreen', 'mediumseagreen', 'turquoise', 'royalblue', 'steelblue', 'darkslateblue', 'mediumturquoise', 'indigo', 'darkolivegreen', 'cadetblue', 'cornflowerblue', 'rebeccapurple', 'mediumaquamarine', 'dimgray', 'dimgrey', 'slateblue', 'olivedrab', 'slategray', 'slategrey', 'lightslategray', 'lightslategrey', 'mediumslateblue', 'lawngreen', 'chartreuse', 'aquamarine', 'maroon', 'purple', 'olive', 'gray', 'grey', 'skyblue', 'lightskyblue', 'blueviolet', 'darkred', 'darkmagenta', 'saddlebrown', 'darkseagreen', 'lightgreen', 'mediumpurple', 'darkviolet', 'palegreen', 'darkorchid', 'yellowgreen', 'sienna', 'brown', 'darkgray', 'darkgrey', 'lightblue', 'greenyellow', 'paleturquoise', 'lightsteelblue', 'powderblue', 'firebrick', 'darkgoldenrod', 'mediumorchid', 'rosybrown', 'darkkhaki', 'silver', 'mediumvioletred', 'indianred', 'peru', 'chocolate', 'tan', 'lightgray', 'lightgrey', 'thistle', 'orchid', 'goldenrod', 'palevioletred', 'crimson', 'gainsboro', 'plum', 'burlywood', 'lightcyan', 'lavender', 'darksalmon', 'violet', 'palegoldenrod', 'lightcoral', 'khaki', 'aliceblue', 'honeydew', 'azure', 'sandybrown', 'wheat', 'beige', 'whitesmoke', 'mintcream', 'ghostwhite', 'salmon', 'antiquewhite', 'linen', 'lightgoldenrodyellow', 'oldlace', 'red', 'fuchsia', 'magenta', 'deeppink', 'orangered', 'tomato', 'hotpink', 'coral', 'darkorange', 'lightsalmon', 'orange', 'lightpink', 'pink', 'gold', 'peachpuff', 'navajowhite', 'moccasin', 'bisque', 'mistyrose', 'blanchedalmond', 'papayawhip', 'lavenderblush', 'seashell', 'cornsilk', 'lemonchiffon', 'floralwhite', 'snow', 'yellow', 'lightyellow', 'ivory', 'white'] # fmt: skip
 
 
+def gen_output_dirname(rand_key: str, name_suffix: str = ""):
+    timestamp = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+    return f"{timestamp}_{rand_key}{name_suffix}"
+
+
+@contextlib.contextmanager
+def _flock(path: Path):
+    """Exclusive lock on `path` for the block, between processes. a no-op without fcntl (windows)."""
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def tmp_path_for(path: Path):
+    # hidden, same dir (so the rename is atomic) and same suffix (writers infer the format from it)
+    path = Path(path)
+    return path.with_name(f".{path.stem}.{os.getpid()}{TMP_MARK}{path.suffix}")
+
+
+@contextlib.contextmanager
+def atomic_output(path: Path):
+    """Yields a temp path to write `path` through, renamed over it once the block completes.
+
+    a crash (or an error) never leaves a truncated artifact at `path`, only a
+    hidden temp file, removed here on errors and by a resumed run otherwise.
+    the path may also be written as a dir.
+    """
+    path = Path(path)
+    tmp = tmp_path_for(path)
+    try:
+        yield tmp
+    except BaseException:
+        _remove(tmp)
+        raise
+    if tmp.is_dir() and path.is_dir():
+        shutil.rmtree(path)  # a dir can't be renamed over a non empty one
+    os.replace(tmp, path)
+
+
+def _remove(path: Path):
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+
+
+def create_output_dir(parent_dir: Path, name_suffix: str = "", rand_key: str = None):
+    """Creates a new, uniquely named, run dir, and returns it with its (acquired) RunLock.
+
+    mkdir fails if the name is taken (e.g. a parallel run in the same second),
+    then another random key is tried. it's created and locked while holding
+    the outputs lock, so the retention of another run never sees it unlocked.
+    """
+    parent_dir = Path(parent_dir)
+    keys = [rand_key] if rand_key else []
+    keys += random.sample(NAMES_SALT, len(NAMES_SALT))
+    keys += [f"{random.choice(NAMES_SALT)}-{os.getpid()}-{i}" for i in range(100)]
+    with _flock(parent_dir.joinpath(OUTPUTS_LOCK_NAME)):
+        for key in keys:
+            dir_path = parent_dir.joinpath(gen_output_dirname(key, name_suffix)).resolve()
+            try:
+                dir_path.mkdir()
+            except FileExistsError:
+                LOGGER.debug(f"{dir_path.name} is taken, trying another name")
+                continue
+            lock = RunLock(dir_path)
+            lock.acquire()
+            return dir_path, key, lock
+    raise FileExistsError(f"failed to find a free output dir name under {parent_dir}")
+
+
+class RunLock:
+    """Held by a run (or a merge) on its output dir while it's writing to it.
+
+    an flock on a file in the dir, so the os releases it even if the run is
+    killed. where there's no flock (windows) an existing lock file is taken as
+    held, a killed run's lock file has to be removed by hand.
+    """
+
+    def __init__(self, dir_path: Path):
+        self.path = Path(dir_path, RUN_LOCK_NAME)
+        self._file = None
+
+    def acquire(self):
+        f = open(self.path, "a+")
+        try:
+            import fcntl
+
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                raise RuntimeError(f"{self.path.parent} is used by another running run")
+        except ImportError:
+            pass
+        f.truncate(0)
+        f.write(json.dumps({"pid": os.getpid(), "host": platform.node(), "started": datetime.now().isoformat()}))
+        f.flush()
+        self._file = f
+        return self
+
+    def release(self):
+        if self._file is None:
+            return
+        self.path.unlink(missing_ok=True)
+        self._file.close()  # releases the flock
+        self._file = None
+
+    @staticmethod
+    def is_held(dir_path: Path):
+        path = Path(dir_path, RUN_LOCK_NAME)
+        try:
+            f = open(path)
+        except FileNotFoundError:
+            return False
+        with f:
+            try:
+                import fcntl
+            except ImportError:
+                return True
+            try:
+                fcntl.flock(f, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except OSError:
+                return True
+            fcntl.flock(f, fcntl.LOCK_UN)
+            return False  # left behind by a killed run
+
+
+def _run_started_at(dir_path: Path):
+    match = OUTPUT_DIRNAME_REGEX.match(dir_path.name)
+    if match:
+        return datetime.strptime(match.group("timestamp"), "%Y-%m-%dT%H:%M:%S")
+    return datetime.fromtimestamp(dir_path.stat().st_mtime)
+
+
+def prune_outputs(parent_dir: Path, keep_last: int = None, keep_days: float = None, current: Path = None):
+    """Deletes the run dirs under `parent_dir` that the retention policy doesn't keep.
+
+    a run is kept if it's one of the `keep_last` latest or younger than
+    `keep_days` (either, when both are given). never deleted: the current
+    run, runs that are running (RunLock), interrupted runs that can still be
+    resumed (they have checkpoints) and anything that isn't a run dir. the
+    inputs store entries no run links to anymore are deleted after the runs
+    (prune_inputs_store). returns the deleted dirs.
+    """
+    parent_dir = Path(parent_dir)
+    current = Path(current).resolve() if current else None
+    deleted = []
+    with _flock(parent_dir.joinpath(OUTPUTS_LOCK_NAME)):
+        runs = [
+            d for d in parent_dir.iterdir()
+            if d.is_dir() and not d.is_symlink() and OUTPUT_DIRNAME_REGEX.match(d.name)
+            and d.resolve() != current
+        ]
+        runs.sort(key=_run_started_at, reverse=True)
+        now = datetime.now()
+        for i, d in enumerate(runs):
+            kept_by_count = keep_last is not None and i < keep_last
+            kept_by_age = keep_days is not None and now - _run_started_at(d) < timedelta(days=keep_days)
+            if kept_by_count or kept_by_age:
+                continue
+            if RunLock.is_held(d):
+                LOGGER.info(f"not deleting {d.name}, it's running")
+                continue
+            if Path(d, CHECKPOINTS_DIR_NAME).is_dir():
+                LOGGER.warning(f"not deleting {d.name}, it was interrupted (resume it with --resume or delete it by hand)")
+                continue
+            # hidden first (atomic), so nothing picks up a half deleted run
+            hidden = d.with_name(f"{DELETING_PREFIX}{d.name}")
+            os.replace(d, hidden)
+            deleted.append(hidden)
+    for d in deleted:
+        shutil.rmtree(d, ignore_errors=True)
+        LOGGER.info(f"deleted {d.name.removeprefix(DELETING_PREFIX)}")
+    prune_inputs_store(Path(parent_dir, INPUTS_STORE_DIR_NAME))
+    return deleted
+
+
+def prune_inputs_store(store_dir: Path, grace_secs: float = STORE_GRACE_SECS):
+    """Deletes the inputs store entries no run dir hard links to (and leftover temp files).
+
+    the runs' staged inputs are hard links to the stored files, so an entry
+    with a single link is garbage. entries (and temps) changed in the last
+    `grace_secs` are kept, a run staging right now may not have linked them
+    yet (linking and storing both update the ctime). returns the deleted paths.
+    """
+    store_dir = Path(store_dir)
+    if not store_dir.is_dir():
+        return []
+    deleted = []
+    now = datetime.now().timestamp()
+    for path in store_dir.iterdir():
+        stat = path.stat(follow_symlinks=False)
+        if not path.is_file() or now - stat.st_ctime < grace_secs:
+            continue
+        if stat.st_nlink == 1 or path.name.startswith("."):
+            path.unlink(missing_ok=True)
+            deleted.append(path)
+    if deleted:
+        LOGGER.info(f"deleted {len(deleted)} inputs store files no run uses")
+    return deleted
+
+
 class JSON_KEYS:
     INPUTS = "inputs"
     INPUT_DIR_PATH = "input-path"
@@ -29,16 +258,238 @@ class JSON_KEYS:
     CONCENTRATION_UNIT = "unit"
     FRAMERATE = "framerate_fps"
 
+    SHARD = "shard"
+    SHARD_INDEX = "index"
+    SHARD_COUNT = "count"
+    SHARD_FILENAMES = "filenames"
+    MERGED_FROM = "merged-from"
+
+
+class StageStrategy:
+    HARDLINK = "hardlink"
+    REFLINK = "reflink"
+    SYMLINK = "symlink"
+    COPY = "copy"
+
+    ALL = [HARDLINK, REFLINK, SYMLINK, COPY]
+    # what to try next when the filesystem doesn't support a strategy
+    FALLBACKS = {
+        HARDLINK: [HARDLINK, REFLINK, COPY],
+        REFLINK: [REFLINK, COPY],
+        SYMLINK: [SYMLINK, COPY],
+        COPY: [COPY],
+    }
+
+
+class InputsStager:
+    """Stage input files into a dir, as copies or links, and record their checksums.
+
+    Real copies go through a content-addressed store shared by all the runs
+    under the same outputs dir, so each input is only ever copied once (and
+    reflinked into the store when the filesystem allows it).
+    """
+
+    FICLONE = 0x40049409  # linux ioctl, copy-on-write clone of a whole file
+    HASH_CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, store_dir: Path = None, strategy: str = StageStrategy.COPY, workers: int = None):
+        if strategy not in StageStrategy.ALL:
+            raise ValueError(f"unknown {strategy=}, expected one of {StageStrategy.ALL}")
+        self.store_dir = Path(store_dir) if store_dir else None  # no store, plain copies
+        self.strategy = strategy
+        self.workers = workers or min(8, os.cpu_count() or 1)
+
+    @classmethod
+    def checksum(cls, path: Path):
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            while chunk := f.read(cls.HASH_CHUNK_SIZE):
+                h.update(chunk)
+        return h.hexdigest()
+
+    @classmethod
+    def _reflink(cls, src: Path, dst: Path):
+        import fcntl  # posix only, ImportError is handled as unsupported
+
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), cls.FICLONE, fsrc.fileno())
+            except OSError:
+                fdst.close()
+                dst.unlink()
+                raise
+        shutil.copystat(src, dst)
+
+    def _store_copy(self, src: Path, digest: str):
+        stored = self.store_dir.joinpath(digest + src.suffix)
+        if stored.is_file():
+            LOGGER.debug(f"{src.name} already in inputs store as {stored.name}")
+            return stored
+
+        self.store_dir.mkdir(exist_ok=True)
+        # a unique temp name, the staging threads (and concurrent runs) may store the same file
+        fd, tmp = tempfile.mkstemp(prefix=f".{stored.name}.", suffix=".tmp", dir=self.store_dir)
+        os.close(fd)
+        tmp = Path(tmp)
+        try:
+            try:
+                self._reflink(src, tmp)
+            except (OSError, ImportError):
+                shutil.copy2(src, tmp)
+            os.replace(tmp, stored)  # atomic
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        return stored
+
+    def _stage_one(self, src: Path, dst: Path, strategy: str, digest: str):
+        if strategy == StageStrategy.HARDLINK:
+            os.link(src, dst)
+        elif strategy == StageStrategy.SYMLINK:
+            dst.symlink_to(src.resolve())
+        elif strategy == StageStrategy.REFLINK:
+            self._reflink(src, dst)
+        elif self.store_dir is None:
+            shutil.copy2(src, dst)
+        else:
+            # real copy, dedup it through the store and hard link to the stored file
+            stored = self._store_copy(src, digest)
+            try:
+                os.link(stored, dst)
+            except FileNotFoundError:
+                # garbage collected meanwhile (prune_inputs_store), store it again
+                os.link(self._store_copy(src, digest), dst)
+            except OSError:
+                shutil.copy2(stored, dst)
+
+    def stage_file(self, src: Path, dest_dir: Path):
+        dst = Path(dest_dir, src.name)
+        if dst.exists() or dst.is_symlink():
+            # restaged (resumed run), never write through an existing link into its source
+            dst.unlink()
+        digest = self.checksum(src)  # whatever the strategy, the run records what it read
+        for strategy in StageStrategy.FALLBACKS[self.strategy]:
+            try:
+                self._stage_one(src, dst, strategy, digest)
+                LOGGER.debug(f"staged {src.name} with {strategy=}")
+                return strategy, digest
+            except (OSError, ImportError) as e:
+                if isinstance(e, OSError) and e.errno == errno.ENOSPC:
+                    raise
+                LOGGER.debug(f"{strategy=} unsupported for {src.name}: {e!r}, falling back")
+        raise OSError(f"failed to stage {src}")
+
+    def stage(self, files: list, dest_dir: Path):
+        dest_dir = Path(dest_dir)
+        dest_dir.mkdir(exist_ok=True)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            staged = list(pool.map(lambda f: self.stage_file(Path(f), dest_dir), files))
+
+        checksums = {Path(file).name: digest for file, (_, digest) in zip(files, staged)}
+        if checksums:
+            # same format as sha256sum, verify with `sha256sum -c`
+            with atomic_output(dest_dir.joinpath(INPUTS_CHECKSUMS_NAME)) as tmp, open(tmp, "w") as f:
+                for name, digest in checksums.items():
+                    f.write(f"{digest}  {name}\n")
+
+        strategies = sorted({strategy for strategy, _ in staged})
+        LOGGER.info(f"staged {len(files)} inputs into {dest_dir} ({', '.join(strategies)})")
+        return checksums
+
+
+class SpillStore:
+    """Backs large arrays with .npy files, memory mapped back (read only) so
+    they live in the page cache rather than the process memory."""
+
+    def __init__(self, dir_path: Path):
+        self.dir_path = Path(dir_path)
+
+    def spill(self, name: str, df):
+        import numpy as np
+        import pandas as pd
+
+        if df is None:
+            return None
+        self.dir_path.mkdir(parents=True, exist_ok=True)
+        path = self.dir_path.joinpath(f"{name}.npy")
+        values = df.to_numpy()
+        mapped = np.lib.format.open_memmap(path, mode="w+", dtype=values.dtype, shape=values.shape)
+        mapped[:] = values
+        mapped.flush()
+        del mapped, values
+
+        # zero copy for everything reading the df from here on (e.g. exporters)
+        return pd.DataFrame(np.load(path, mmap_mode="r"), index=df.index, columns=df.columns, copy=False)
+
+
+class Shard:
+    """A deterministic, size balanced, part `index` of `count` of the inputs."""
+
+    def __init__(self, index: int, count: int):
+        if not 0 <= index < count:
+            raise ValueError(f"shard index should be in [0, {count}), got {index}")
+        self.index = index
+        self.count = count
+
+    @classmethod
+    def parse(cls, value: str):
+        # "i/N", for argparse
+        try:
+            index, count = (int(v) for v in value.split("/"))
+        except ValueError:
+            raise ValueError(f"expected a shard like 0/4, got {value!r}")
+        return cls(index, count)
+
+    @property
+    def name(self):
+        return f"shard-{self.index}-of-{self.count}"
+
+    def __str__(self):
+        return f"{self.index}/{self.count}"
+
+    def select(self, inputs: list, input_dir):
+        # longest processing time first: biggest files first, each to the
+        # currently lightest shard. ties are broken by name so every job
+        # computes the same assignment
+        def size(file_details):
+            try:
+                return Path(input_dir, file_details[JSON_KEYS.FILENAME]).stat().st_size
+            except OSError:
+                return 0
+
+        ordered = sorted(inputs, key=lambda i: (-size(i), i[JSON_KEYS.FILENAME]))
+        loads = [0] * self.count
+        selected = []
+        for file_details in ordered:
+            shard = min(range(self.count), key=lambda s: (loads[s], s))
+            loads[shard] += max(size(file_details), 1)
+            if shard == self.index:
+                selected.append(file_details)
+
+        # keep the details.json order
+        selected_names = {i[JSON_KEYS.FILENAME] for i in selected}
+        return [i for i in inputs if i[JSON_KEYS.FILENAME] in selected_names]
+
+    def to_json(self, selected: list):
+        return {
+            JSON_KEYS.SHARD_INDEX: self.index,
+            JSON_KEYS.SHARD_COUNT: self.count,
+            JSON_KEYS.SHARD_FILENAMES: [i[JSON_KEYS.FILENAME] for i in selected],
+        }
+
 
 class InputsLoader:
-    def __init__(self, input_dir):
+    def __init__(self, input_dir, details_path=None):
         self.input_dir = input_dir
+        self.details_path = details_path
 
         if not Path(input_dir).is_dir():
             LOGGER.error(f"{input_dir=} doesn't exist, stopping execution.")
             raise ValueError()
 
     def get_input_details_json_path(self) -> Path:
+        if self.details_path is not None:
+            return Path(self.details_path).resolve()
         return Path(self.input_dir, INPUT_CONFIG_JSON_NAME).resolve()
 
     def get_inputs(self):
@@ -61,6 +512,122 @@ class InputsLoader:
         raise e
 
 
+class _SpillRefPickler(pickle.Pickler):
+    # arrays backed by a spilled .npy under `root` are pickled as a reference to it, not copied
+    def __init__(self, file, root: Path):
+        import numpy as np
+
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._np = np
+        self.root = Path(root).resolve()
+
+    def persistent_id(self, obj):
+        np = self._np
+        if not isinstance(obj, np.ndarray):
+            return None
+        mapped = obj  # a view (e.g. a dataframe block) of the memmap of a spilled file
+        while not (isinstance(mapped, np.memmap) and mapped.filename) and isinstance(mapped.base, np.ndarray):
+            mapped = mapped.base
+        if not (isinstance(mapped, np.memmap) and mapped.filename and Path(mapped.filename).is_relative_to(self.root)):
+            return None
+        offset = obj.__array_interface__["data"][0] - mapped.__array_interface__["data"][0]
+        return (
+            Path(mapped.filename).relative_to(self.root).as_posix(),
+            obj.dtype.str, obj.shape, obj.strides, offset,
+        )
+
+
+class _SpillRefUnpickler(pickle.Unpickler):
+    def __init__(self, file, root: Path):
+        super().__init__(file)
+        self.root = Path(root)
+
+    def persistent_load(self, pid):
+        import numpy as np
+
+        rel_path, dtype, shape, strides, offset = pid
+        mapped = np.load(Path(self.root, rel_path), mmap_mode="r")
+        return np.ndarray(shape, dtype=np.dtype(dtype), buffer=mapped, offset=offset, strides=strides)
+
+
+class Checkpoints:
+    """Per file completion markers of a run, so an interrupted run can resume.
+
+    with spilling, the processed results are pickled straight to the checkpoint
+    file, with the spilled (memory mapped) arrays as references to their
+    scratch files, which are kept until the file is exported. otherwise only
+    the markers are written and unexported files are processed again.
+    """
+
+    RUN = "run"
+    SETUP = "setup"
+    PROCESSED = "processed"
+    EXPORTED = "exported"
+    ARGS_NAME = "args.json"
+
+    def __init__(self, dir_path: Path):
+        self.dir_path = Path(dir_path)
+
+    def _file_dir(self, name: str):
+        return Path(self.dir_path, name)
+
+    def _marker_path(self, name: str, step: str):
+        return Path(self._file_dir(name), f"{step}.done")
+
+    def _processed_path(self, name: str):
+        return Path(self._file_dir(name), f"{self.PROCESSED}.pkl")
+
+    @staticmethod
+    def _write_atomic(path: Path, data: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_output(path) as tmp:
+            tmp.write_bytes(data)
+
+    def is_done(self, name: str, step: str):
+        return self._marker_path(name, step).is_file()
+
+    def mark_done(self, name: str, step: str):
+        marker = json.dumps({"step": step, "done-at": datetime.now().isoformat()})
+        self._write_atomic(self._marker_path(name, step), marker.encode())
+        LOGGER.debug(f"checkpoint {name}/{step}")
+
+    def save_processed(self, name: str, processed):
+        path = self._processed_path(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_output(path) as tmp, open(tmp, "wb") as f:
+            _SpillRefPickler(f, self.dir_path.parent).dump(processed)
+        self.mark_done(name, self.PROCESSED)
+
+    def load_processed(self, name: str):
+        with open(self._processed_path(name), "rb") as f:
+            return _SpillRefUnpickler(f, self.dir_path.parent).load()
+
+    def mark_exported(self, name: str):
+        self.mark_done(name, self.EXPORTED)
+        self._processed_path(name).unlink(missing_ok=True)  # not needed anymore
+
+    def save_args(self, args: dict):
+        data = json.dumps(args, indent=True, default=str)
+        self._write_atomic(Path(self.dir_path, self.ARGS_NAME), data.encode())
+
+    def check_args(self, args: dict, ignore=()):
+        path = Path(self.dir_path, self.ARGS_NAME)
+        if not path.is_file():
+            return
+        with open(path) as f:
+            saved = json.load(f)
+        args = json.loads(json.dumps(args, default=str))
+        for key in sorted(set(saved) | set(args)):
+            if key not in ignore and saved.get(key) != args.get(key):
+                LOGGER.warning(
+                    f"resuming with {key}={args.get(key)!r} but the run started with "
+                    f"{saved.get(key)!r}, outputs may be inconsistent"
+                )
+
+    def clear(self):
+        shutil.rmtree(self.dir_path, ignore_errors=True)
+
+
 class OutputsManager:
     def __init__(
         self,
@@ -70,10 +637,21 @@ class OutputsManager:
         gen_csv: bool,
         show_plot: bool,
         name_suffix: str,
+        stage_strategy: str = StageStrategy.COPY,
+        spill: bool = False,
+        keep_scratch: bool = False,
+        pyramids: bool = False,
+        shard: Shard = None,
+        resume_dir: Path = None,
     ):
         self.no_input_copy = no_copy
+        self.stage_strategy = stage_strategy
+        self.spill = spill
+        self.keep_scratch = keep_scratch
+        self.shard = shard
         self.gen_csv = gen_csv
         self.show_plot = show_plot
+        self.pyramids = pyramids  # for viewer.py, opt in
         self._dash_html_exporter = None
 
         self.output_parent_dir_path = output_dir
@@ -81,46 +659,87 @@ class OutputsManager:
         self.output_dir_path = None
         self.rand_key = None
         self.name_suffix = name_suffix
+        self.lock: RunLock = None
 
         if not output_dir.is_dir():
             LOGGER.error(f"{output_dir=} doesn't exist, stopping execution.")
             raise ValueError()
 
-        self._create_output_dir()
+        try:
+            if resume_dir is not None:
+                self._resume_output_dir(Path(resume_dir))
+            else:
+                self._create_output_dir()
+        except BaseException:
+            self.close()
+            raise
+
+    def _resume_output_dir(self, resume_dir: Path):
+        if not resume_dir.is_dir():
+            LOGGER.error(f"{resume_dir=} doesn't exist, nothing to resume.")
+            raise ValueError()
+        self.output_dir_path = resume_dir.resolve()
+        self.output_parent_dir_path = self.output_dir_path.parent
+        self.lock = RunLock(self.output_dir_path).acquire()  # raises if it's still running
+        self.checkpoints = Checkpoints(Path(self.output_dir_path, CHECKPOINTS_DIR_NAME))
+        LOGGER.info(f"resuming run in {self.output_dir_path}")
+
+        for tmp in self.output_dir_path.glob(f".*{TMP_MARK}*"):
+            LOGGER.debug(f"removing {tmp.name}, left behind by the interrupted run")
+            _remove(tmp)
+
+        if not self.checkpoints.is_done(Checkpoints.RUN, Checkpoints.SETUP):
+            # interrupted while writing the metadata / staging the inputs, redo it
+            self._setup_output_dir()
 
     def _create_output_dir(self):
+        self.name_suffix = "." + self.name_suffix if self.name_suffix else ""
+        if self.shard:
+            self.name_suffix += "." + self.shard.name
+        self.output_dir_path, self.rand_key, self.lock = create_output_dir(
+            self.output_parent_dir_path, self.name_suffix, rand_key=self.rand_key
+        )
+        self.checkpoints = Checkpoints(Path(self.output_dir_path, CHECKPOINTS_DIR_NAME))
+        self._setup_output_dir()
+
+    def _setup_output_dir(self):
         # prep metadata for output dir
         input_path = self.input_loader.get_input_details_json_path()
         with open(input_path) as f:
             input_details = json.load(f)
-            rand_key = random.choice(NAMES_SALT)
 
-        # create output dir
-        self.rand_key = self.rand_key or rand_key
-        timestamp = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
-        self.name_suffix = "." + self.name_suffix if self.name_suffix else ""
-        dirname = f"{timestamp}_{self.rand_key}{self.name_suffix}"
-        self.output_dir_path = Path(self.output_parent_dir_path, dirname).resolve()
-        Path(self.output_dir_path).mkdir()
+        shard_inputs = None
+        if self.shard:
+            shard_inputs = self.shard.select(input_details[JSON_KEYS.INPUTS], self.input_loader.input_dir)
+            input_details[JSON_KEYS.SHARD] = self.shard.to_json(shard_inputs)
 
-        if self.no_input_copy:
+        if self.no_input_copy or self.shard:
             # save metadata about input in output dir
             input_details[JSON_KEYS.INPUT_DIR_PATH] = (
                 input_path.as_uri()
                 if platform.system().lower() == "windows"
                 else input_path.as_posix()
             )
-            with open(self.get_output_metadata_json_path(), "w") as f:
+            with atomic_output(self.get_output_metadata_json_path()) as tmp, open(tmp, "w") as f:
                 json.dump(input_details, f, indent=True)
-        else:
-            # requested, copy the input data into the output dir
+
+        if not self.no_input_copy:
+            # requested, copy the input data (of this shard) into the output dir
             inputs = Path(self.input_loader.input_dir).glob("*.*")
+            if shard_inputs is not None:
+                others = {i[JSON_KEYS.FILENAME] for i in input_details[JSON_KEYS.INPUTS]}
+                others -= {i[JSON_KEYS.FILENAME] for i in shard_inputs}
+                inputs = [f for f in inputs if f.name not in others]
             inputs_dest_dir = Path(self.output_dir_path, JSON_KEYS.INPUTS)
-            Path(inputs_dest_dir).mkdir()
+            Path(inputs_dest_dir).mkdir(exist_ok=True)
 
-            for file in inputs:
-                if Path(file).is_file():
-                    shutil.copy2(file, inputs_dest_dir)
+            stager = InputsStager(
+                store_dir=Path(self.output_parent_dir_path, INPUTS_STORE_DIR_NAME),
+                strategy=self.stage_strategy,
+            )
+            stager.stage([f for f in inputs if Path(f).is_file()], inputs_dest_dir)
+
+        self.checkpoints.mark_done(Checkpoints.RUN, Checkpoints.SETUP)
 
     def get_output_metadata_json_path(self):
         return Path(self.output_dir_path, OUTPUT_SUMMARY_JSON_NAME).resolve()
@@ -128,11 +747,33 @@ class OutputsManager:
     def get_output_full_path(self, filename):
         return Path(self.output_dir_path, filename).resolve()
 
-    def delete_all_other_outputs(self):
-        for d in Path(self.output_parent_dir_path).iterdir():
-            if d in self.output_dir_path:
-                continue  # don't delete my new output
-            shutil.rmtree(Path(self.output_parent_dir_path, d))
+    def get_scratch_dir_path(self):
+        return Path(self.output_dir_path, SCRATCH_DIR_NAME)
+
+    def new_spill_store(self, name: str):
+        if not self.spill:
+            return None
+        return SpillStore(Path(self.get_scratch_dir_path(), name))
+
+    def cleanup_scratch(self, name: str = None):
+        # of one file (once exported, its processed checkpoint may point into it) or all
+        path = self.get_scratch_dir_path() if name is None else Path(self.get_scratch_dir_path(), name)
+        if self.keep_scratch:
+            LOGGER.info(f"keeping scratch files in {path}")
+            return
+        shutil.rmtree(path, ignore_errors=True)
+
+    def apply_retention(self, keep_last: int = None, keep_days: float = None):
+        return prune_outputs(
+            self.output_parent_dir_path,
+            keep_last=keep_last,
+            keep_days=keep_days,
+            current=self.output_dir_path,
+        )
+
+    def close(self):
+        if self.lock is not None:
+            self.lock.release()
 
 
 class GenDetailsFileScript:
@@ -191,7 +832,7 @@ class GenDetailsFileScript:
     def gen_file_data(self, file: Path):
         try:
             # try crude parse
-            parts = self.filename.removeprefix("labels.xenia").removesuffix(".analysis.h5")
+            parts = file.name.removeprefix("labels.xenia").removesuffix(".analysis.h5")
             parts = parts.split('_')[5:]
             exp_num, exp_well, substance, con = parts[:4]
             better_con =  re.search(r'(\d+)([a-zA-Z]+)', con)
@@ -200,7 +841,7 @@ class GenDetailsFileScript:
                 return self.build_file_data(file, substance, concentration=con, unit=unit)
 
             return self.build_file_data(file, substance, concentration=con, unit="")
-        except: pass
+        except ValueError: pass  # not enough parts
 
         regex = r"([a-zA-Z]+)_(\d+)([a-zA-Z]+)\.analysis\.h5$"
         match = re.search(regex, file.name)